@@ -0,0 +1,186 @@
+"""
+Active Alerts
+The current low-stock, reorder and consumption-anomaly alerts, one row per
+SKU and category in active_alerts, kept up to date from write events instead
+of rescanning the catalog on every dashboard load.
+
+Triggers note every SKU touched by a stock movement (transactions), a
+consumption record or an inventory change in alert_dirty, at constant cost
+per write. A refresh re-evaluates the rules for just the noted SKUs with
+keyed reads and replaces their rows, so its cost follows the number of
+changed SKUs, not the catalog. The consumption windows move with the date,
+and forecast runs and supplier changes touch many SKUs at once, so those
+mark the whole table stale and the next refresh re-evaluates every SKU once.
+"""
+
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+CATEGORIES = ('stock', 'reorder', 'consumption')
+
+ACTIVE_ALERTS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS active_alerts (
+    drug_id INTEGER NOT NULL,
+    category TEXT NOT NULL,
+    rank REAL NOT NULL,
+    type TEXT NOT NULL,
+    priority TEXT NOT NULL,
+    message TEXT NOT NULL,
+    raised_at TEXT NOT NULL,
+    evaluation INTEGER NOT NULL,
+    PRIMARY KEY (drug_id, category)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_active_alerts_rank ON active_alerts (category, rank);
+
+CREATE TABLE IF NOT EXISTS active_alert_state (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    evaluation INTEGER NOT NULL,
+    evaluated_day TEXT NOT NULL,
+    evaluated_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS alert_dirty (
+    drug_id INTEGER PRIMARY KEY
+);
+
+CREATE TRIGGER IF NOT EXISTS trg_alert_dirty_transaction
+AFTER INSERT ON transactions
+WHEN NEW.drug_id IS NOT NULL
+BEGIN
+    INSERT OR IGNORE INTO alert_dirty (drug_id) VALUES (NEW.drug_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_alert_dirty_consumption_insert
+AFTER INSERT ON consumption_patterns
+WHEN NEW.drug_id IS NOT NULL
+BEGIN
+    INSERT OR IGNORE INTO alert_dirty (drug_id) VALUES (NEW.drug_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_alert_dirty_consumption_delete
+AFTER DELETE ON consumption_patterns
+WHEN OLD.drug_id IS NOT NULL
+BEGIN
+    INSERT OR IGNORE INTO alert_dirty (drug_id) VALUES (OLD.drug_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_alert_dirty_consumption_update
+AFTER UPDATE OF drug_id, date, quantity_consumed ON consumption_patterns
+BEGIN
+    INSERT OR IGNORE INTO alert_dirty (drug_id) SELECT OLD.drug_id WHERE OLD.drug_id IS NOT NULL;
+    INSERT OR IGNORE INTO alert_dirty (drug_id) SELECT NEW.drug_id WHERE NEW.drug_id IS NOT NULL;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_alert_dirty_inventory_insert
+AFTER INSERT ON inventory
+BEGIN
+    INSERT OR IGNORE INTO alert_dirty (drug_id) VALUES (NEW.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_alert_dirty_inventory_delete
+AFTER DELETE ON inventory
+BEGIN
+    INSERT OR IGNORE INTO alert_dirty (drug_id) VALUES (OLD.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_alert_dirty_inventory_update
+AFTER UPDATE OF drug_name, current_stock, minimum_stock, unit_price, tablets_per_sheet, supplier_name
+ON inventory
+BEGIN
+    INSERT OR IGNORE INTO alert_dirty (drug_id) VALUES (NEW.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_alert_stale_forecast
+AFTER INSERT ON forecast_runs
+BEGIN
+    UPDATE active_alert_state SET evaluated_day = '';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_alert_stale_supplier_insert
+AFTER INSERT ON suppliers
+BEGIN
+    UPDATE active_alert_state SET evaluated_day = '';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_alert_stale_supplier_delete
+AFTER DELETE ON suppliers
+BEGIN
+    UPDATE active_alert_state SET evaluated_day = '';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_alert_stale_supplier_update
+AFTER UPDATE OF name, lead_time_days ON suppliers
+BEGIN
+    UPDATE active_alert_state SET evaluated_day = '';
+END;
+"""
+
+# (drug_id, category, rank, type, priority, message); lower rank sorts first
+AlertRow = Tuple[int, str, float, str, str, str]
+
+
+def pending_alert_skus(conn, today: str) -> Optional[np.ndarray]:
+    """
+    SKUs whose alerts need re-evaluating, ascending; None when every SKU does
+
+    Every SKU does on first use, on the first refresh of a new day and after
+    a forecast run or supplier change.
+    """
+    state = conn.execute("SELECT evaluated_day FROM active_alert_state").fetchone()
+    if state is None or state[0] != today:
+        return None
+    return np.array([row[0] for row in conn.execute("SELECT drug_id FROM alert_dirty ORDER BY drug_id")],
+                    dtype=np.int64)
+
+
+def store_alerts(conn, drug_ids: Optional[Sequence[int]], rows: Iterable[AlertRow],
+                 today: str) -> Dict[str, int]:
+    """
+    Replace the alerts of drug_ids (None: of every SKU) with rows
+
+    An alert that is still raised keeps its raised_at. Clears alert_dirty;
+    run it inside one write transaction with the evaluation that produced
+    rows. Returns {'raised': rows written, 'cleared': alerts removed}.
+    """
+    state = conn.execute("SELECT evaluation FROM active_alert_state").fetchone()
+    evaluation = (state[0] if state else 0) + 1
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    raised = conn.executemany(
+        """
+        INSERT INTO active_alerts (drug_id, category, rank, type, priority, message, raised_at, evaluation)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (drug_id, category) DO UPDATE SET
+            rank = excluded.rank, type = excluded.type, priority = excluded.priority,
+            message = excluded.message, evaluation = excluded.evaluation
+        """,
+        (row + (now, evaluation) for row in rows)
+    ).rowcount
+    if drug_ids is None:
+        cleared = conn.execute("DELETE FROM active_alerts WHERE evaluation != ?", (evaluation,)).rowcount
+    else:
+        cleared = conn.executemany(
+            "DELETE FROM active_alerts WHERE drug_id = ? AND evaluation != ?",
+            ((drug_id, evaluation) for drug_id in drug_ids)
+        ).rowcount
+    conn.execute("DELETE FROM alert_dirty")
+    conn.execute("INSERT OR REPLACE INTO active_alert_state VALUES (1, ?, ?, ?)", (evaluation, today, now))
+    return {'raised': max(raised, 0), 'cleared': max(cleared, 0)}
+
+
+def read_active_alerts(conn, category: str, limit: Optional[int] = None) -> List[tuple]:
+    """(drug_id, type, priority, message, raised_at) of one category's alerts, most severe first"""
+    if category not in CATEGORIES:
+        raise ValueError(f"category must be one of {CATEGORIES}, got {category!r}")
+    return conn.execute(
+        """
+        SELECT drug_id, type, priority, message, raised_at
+        FROM active_alerts
+        WHERE category = ?
+        ORDER BY rank
+        LIMIT ?
+        """,
+        (category, -1 if limit is None else limit)
+    ).fetchall()
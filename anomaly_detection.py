@@ -0,0 +1,232 @@
+"""
+Anomaly Detection
+Consumption anomalies for the whole catalog from the SKU x day consumption
+matrix, scored three ways for every SKU and every day with NumPy:
+
+- rolling: distance from the mean of the previous `window` days, in
+  standard deviations of those days
+- ewma: distance from an exponentially weighted mean of all earlier days,
+  in exponentially weighted standard deviations
+- robust: distance from the median of the previous `window` days, in
+  scaled median absolute deviations, so one earlier spike does not mask
+  the next
+
+A day's score is the middle one of the three z-scores, so it takes two
+methods agreeing to flag a day. Every scale is floored at MIN_SCALE units,
+which keeps days of steady or intermittent demand (zero spread) from
+turning any one-unit change into an anomaly.
+
+The ranked result is cached on the change counters of the rollup's inputs,
+so dashboard loads without new consumption reuse it.
+"""
+
+from datetime import date, timedelta
+from typing import Any, Dict, List
+
+import numpy as np
+
+from consumption_matrix import load_consumption_matrix
+from consumption_rollups import days_ago
+from db_connection import connection
+from recommendation_cache import get_recommendation_cache
+from table_versions import dependency_counters
+
+WINDOW_DAYS = 28
+RECENT_DAYS = 7
+EWMA_ALPHA = 0.1
+MIN_SCALE = 1.0
+# Standard deviations per median absolute deviation of a normal distribution
+MAD_SCALE = 1.4826
+# Lower bounds of |score| for each severity, most severe first. Daily counts
+# are skewed, so a Poisson SKU passes 3 on one day in a few hundred.
+SEVERITY_THRESHOLDS = (('critical', 10.0), ('high', 6.0), ('medium', 4.0))
+# SKUs per block, bounding the robust scores' window copies at roughly
+# CHUNK_SKUS x days x window values
+CHUNK_SKUS = 4096
+NAME_LOOKUP_CHUNK = 200
+
+ANOMALY_DEPENDENCIES = {
+    'inventory': ('id', 'drug_name'),
+    'consumption_patterns': ('drug_id', 'date', 'quantity_consumed'),
+}
+
+
+def rolling_zscores(matrix: np.ndarray, window: int = WINDOW_DAYS):
+    """
+    (mean, z) of each day against the previous `window` days, for days
+    window onwards (shape SKUs x days - window)
+    """
+    padded = np.concatenate([np.zeros((len(matrix), 1)), np.cumsum(matrix, axis=1)], axis=1)
+    squares = np.concatenate([np.zeros((len(matrix), 1)), np.cumsum(matrix * matrix, axis=1)], axis=1)
+    total = padded[:, window:-1] - padded[:, :-window - 1]
+    total_squares = squares[:, window:-1] - squares[:, :-window - 1]
+    mean = total / window
+    variance = np.maximum(total_squares - total * mean, 0) / (window - 1)
+    return mean, (matrix[:, window:] - mean) / np.maximum(np.sqrt(variance), MIN_SCALE)
+
+
+def ewma_zscores(matrix: np.ndarray, window: int = WINDOW_DAYS, alpha: float = EWMA_ALPHA):
+    """
+    (mean, z) of each day against the exponentially weighted mean and
+    variance of the days before it, started from the first `window` days,
+    for days window onwards
+    """
+    days = matrix.shape[1]
+    mean = matrix[:, :window].mean(axis=1)
+    variance = matrix[:, :window].var(axis=1, ddof=1)
+    means = np.empty((len(matrix), days - window))
+    z = np.empty_like(means)
+    for t in range(window, days):
+        means[:, t - window] = mean
+        deviation = matrix[:, t] - mean
+        z[:, t - window] = deviation / np.maximum(np.sqrt(variance), MIN_SCALE)
+        mean = mean + alpha * deviation
+        variance = (1 - alpha) * (variance + alpha * deviation * deviation)
+    return means, z
+
+
+def _sorted_median(values: np.ndarray) -> np.ndarray:
+    """Median along the last axis of values already sorted along it"""
+    middle = values.shape[-1] // 2
+    if values.shape[-1] % 2:
+        return values[..., middle]
+    return (values[..., middle - 1] + values[..., middle]) / 2
+
+
+def robust_zscores(matrix: np.ndarray, window: int = WINDOW_DAYS):
+    """
+    (median, z) of each day against the median and median absolute
+    deviation of the previous `window` days, for days window onwards
+    """
+    # Sorting the short window axis outright beats np.median's partitioning
+    windows = np.sort(np.lib.stride_tricks.sliding_window_view(matrix[:, :-1], window, axis=1), axis=2)
+    median = _sorted_median(windows)
+    mad = _sorted_median(np.sort(np.abs(windows - median[:, :, None]), axis=2))
+    return median, (matrix[:, window:] - median) / np.maximum(MAD_SCALE * mad, MIN_SCALE)
+
+
+def anomaly_scores(matrix: np.ndarray, window: int = WINDOW_DAYS,
+                   alpha: float = EWMA_ALPHA) -> Dict[str, np.ndarray]:
+    """
+    Every z-score for every SKU and every day from day `window` on, each
+    array SKUs x (days - window)
+
+    'expected' is the rolling mean, 'score' the middle of the three z-scores.
+    """
+    if matrix.shape[1] <= window:
+        raise ValueError(f"{matrix.shape[1]} days cannot fit a {window}-day baseline")
+    expected, rolling = rolling_zscores(matrix, window)
+    _, ewma = ewma_zscores(matrix, window, alpha)
+    _, robust = robust_zscores(matrix, window)
+    score = rolling + ewma + robust - np.maximum(np.maximum(rolling, ewma), robust) \
+        - np.minimum(np.minimum(rolling, ewma), robust)
+    return {'expected': expected, 'rolling': rolling, 'ewma': ewma, 'robust': robust, 'score': score}
+
+
+def severity(score: np.ndarray) -> np.ndarray:
+    """Severity label per |score|, None below the lowest threshold"""
+    magnitude = np.abs(score)
+    labels = np.full(magnitude.shape, None, dtype=object)
+    for label, threshold in reversed(SEVERITY_THRESHOLDS):
+        labels[magnitude >= threshold] = label
+    return labels
+
+
+def rank_anomalies(matrix: np.ndarray, recent_days: int = RECENT_DAYS, window: int = WINDOW_DAYS,
+                   alpha: float = EWMA_ALPHA) -> Dict[str, np.ndarray]:
+    """
+    Each SKU's most anomalous day among the last recent_days, for the SKUs
+    where it reaches the lowest severity, ranked by |score|
+
+    Returns arrays aligned on the ranking: 'sku' (matrix row), 'day' (column),
+    'quantity', 'expected', 'rolling', 'ewma', 'robust', 'score' and
+    'severity'. Scores SKUs in blocks of CHUNK_SKUS.
+    """
+    recent_days = min(recent_days, matrix.shape[1] - window)
+    keys = ('expected', 'rolling', 'ewma', 'robust', 'score')
+    found = {key: [] for key in ('sku', 'day', 'quantity') + keys}
+    lowest = SEVERITY_THRESHOLDS[-1][1]
+    for start in range(0, len(matrix), CHUNK_SKUS):
+        block = matrix[start:start + CHUNK_SKUS]
+        # Only the recent days are ranked, so score just as much history as they need
+        recent = block[:, -(window + recent_days):]
+        # A middle score reaches the threshold only where two of the three
+        # do, so SKUs that neither cheap score flags skip the robust one
+        _, rolling = rolling_zscores(recent, window)
+        _, ewma = ewma_zscores(recent, window, alpha)
+        candidates = np.flatnonzero(((np.abs(rolling) >= lowest) | (np.abs(ewma) >= lowest)).any(axis=1))
+        scores = anomaly_scores(recent[candidates], window, alpha)
+        best = np.abs(scores['score']).argmax(axis=1)
+        flagged = np.abs(scores['score'][np.arange(len(candidates)), best]) >= lowest
+        rows, best = candidates[flagged], best[flagged]
+        found['sku'].append(start + rows)
+        found['day'].append(matrix.shape[1] - recent_days + best)
+        found['quantity'].append(block[rows, -recent_days + best])
+        for key in keys:
+            found[key].append(scores[key][np.flatnonzero(flagged), best])
+    result = {key: np.concatenate(values) if values else np.empty(0) for key, values in found.items()}
+    order = np.argsort(-np.abs(result['score']), kind='stable')
+    result = {key: values[order] for key, values in result.items()}
+    result['severity'] = severity(result['score'])
+    return result
+
+
+def describe_change(quantity: float, expected: float) -> str:
+    """A day's quantity against its expected value, e.g. 'increased by 240.0%'"""
+    if expected <= 0:
+        return f'rose to {quantity:g} from none expected'
+    change = (quantity / expected - 1) * 100
+    return f"{'increased' if change >= 0 else 'decreased'} by {abs(change):.1f}%"
+
+
+def _detect(db, recent_days: int, window: int) -> List[Dict[str, Any]]:
+    with connection(db) as conn:
+        history = load_consumption_matrix(conn, window + recent_days)
+    ranked = rank_anomalies(history['matrix'], recent_days, window)
+    flagged = history['drug_ids'][ranked['sku']].tolist()
+    names = {}
+    with connection(db) as conn:
+        for start in range(0, len(flagged), NAME_LOOKUP_CHUNK):
+            chunk = flagged[start:start + NAME_LOOKUP_CHUNK]
+            names.update(conn.execute(
+                f"SELECT id, drug_name FROM inventory WHERE id IN ({', '.join('?' * len(chunk))})", chunk
+            ))
+    first_day = date.fromisoformat(history['start'])
+    anomalies = []
+    for index, drug_id in enumerate(flagged):
+        quantity, expected = float(ranked['quantity'][index]), float(ranked['expected'][index])
+        anomalies.append({
+            'drug_id': drug_id,
+            'drug_name': names.get(drug_id),
+            'day': (first_day + timedelta(days=int(ranked['day'][index]))).isoformat(),
+            'quantity': quantity,
+            'expected': expected,
+            'direction': 'spike' if ranked['score'][index] > 0 else 'drop',
+            'rolling_z': float(ranked['rolling'][index]),
+            'ewma_z': float(ranked['ewma'][index]),
+            'robust_z': float(ranked['robust'][index]),
+            'score': float(ranked['score'][index]),
+            'severity': ranked['severity'][index],
+            'change_description': describe_change(quantity, expected),
+        })
+    return anomalies
+
+
+def detect_anomalies(db, recent_days: int = RECENT_DAYS, window: int = WINDOW_DAYS) -> List[Dict[str, Any]]:
+    """
+    Ranked consumption anomalies over the last recent_days (days before
+    today), one per SKU at its most anomalous day, most severe first
+
+    Reused while consumption and the inventory ids and names are unchanged.
+    """
+    cache = get_recommendation_cache(db)
+    if cache is None:
+        return _detect(db, recent_days, window)
+    versions = cache.versions()
+    key = ('consumption_anomalies', recent_days, window, days_ago(0),
+           tuple(versions.get(counter) for counter in dependency_counters(ANOMALY_DEPENDENCIES)))
+    anomalies = cache.get(key)
+    if anomalies is None:
+        anomalies = _detect(db, recent_days, window)
+        cache.put(key, anomalies)
+    return anomalies
@@ -0,0 +1,270 @@
+"""
+Backtesting
+Rolling-origin (walk-forward) evaluation of the per-SKU forecasters over the
+whole SKU x day consumption matrix. At every cutoff each forecaster is fitted
+on the train_days before it and scored on the `horizon` days after; the
+errors reduce to MAE, MSE, bias and MAPE with array operations across all
+SKUs at once.
+
+The (forecaster, cutoff) fits run in parallel through the TrainingOrchestrator,
+reading the matrix from a memory-mapped .npy instead of each receiving a copy.
+Every fit's per-SKU errors are written to a SQLite results file as soon as it
+finishes, and only running sums stay in memory.
+"""
+
+import hashlib
+import os
+import sqlite3
+import tempfile
+import time
+from contextlib import closing
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from batch_forecasting import FITTERS, SEASON_LENGTH, WARMUP_DAYS, forecast_matrix
+from consumption_matrix import load_consumption_matrix
+from db_connection import connection
+from model_registry import get_model_registry, params_key
+from training_orchestrator import TrainingOrchestrator
+
+# Forecasters the statistical backend can be told to use, then reference baselines
+SELECTABLE_FORECASTERS = ('auto',) + tuple(FITTERS)
+BASELINE_FORECASTERS = ('seasonal_naive', 'moving_average')
+FORECASTERS = SELECTABLE_FORECASTERS + BASELINE_FORECASTERS
+
+MOVING_AVERAGE_DAYS = 4 * SEASON_LENGTH
+
+RESULTS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS backtest_errors (
+    forecaster TEXT NOT NULL,
+    cutoff TEXT NOT NULL,
+    drug_id INTEGER NOT NULL,
+    mae REAL NOT NULL,
+    mse REAL NOT NULL,
+    bias REAL NOT NULL,
+    mape REAL,
+    actual_total REAL NOT NULL,
+    forecast_total REAL NOT NULL,
+    PRIMARY KEY (forecaster, cutoff, drug_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS backtest_fits (
+    forecaster TEXT NOT NULL,
+    cutoff TEXT NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT,
+    seconds REAL,
+    mae REAL,
+    mse REAL,
+    bias REAL,
+    mape REAL,
+    PRIMARY KEY (forecaster, cutoff)
+);
+"""
+
+
+def predict(forecaster: str, train: np.ndarray, horizon: int) -> np.ndarray:
+    """SKUs x horizon forecast from a SKUs x days training matrix"""
+    if forecaster in SELECTABLE_FORECASTERS:
+        return forecast_matrix(train, horizon, method=forecaster)['forecast']
+    if forecaster == 'seasonal_naive':
+        last_week = train[:, -SEASON_LENGTH:]
+        return last_week[:, np.arange(horizon) % SEASON_LENGTH]
+    if forecaster == 'moving_average':
+        return np.repeat(train[:, -MOVING_AVERAGE_DAYS:].mean(axis=1, keepdims=True), horizon, axis=1)
+    raise ValueError(f"Unknown forecaster: {forecaster}")
+
+
+def error_sums(actual: np.ndarray, forecast: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Per-SKU error sums over the horizon (axis 1)
+
+    'error' is forecast minus actual, so a positive bias is over-forecasting.
+    Percentage errors only count days with nonzero actual demand.
+    """
+    error = forecast - actual
+    nonzero = actual != 0
+    ape = np.abs(error) / np.where(nonzero, np.abs(actual), 1.0)
+    return {
+        'abs': np.abs(error).sum(axis=1),
+        'squared': (error * error).sum(axis=1),
+        'error': error.sum(axis=1),
+        'ape': np.where(nonzero, ape, 0.0).sum(axis=1),
+        'nonzero': nonzero.sum(axis=1),
+        'actual': actual.sum(axis=1),
+        'forecast': forecast.sum(axis=1),
+    }
+
+
+def metrics_from_sums(sums: Dict[str, np.ndarray], days) -> Dict[str, np.ndarray]:
+    """MAE, MSE, bias and MAPE (in %, NaN without nonzero actuals) from error_sums() totals over `days` days"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return {
+            'mae': sums['abs'] / days,
+            'mse': sums['squared'] / days,
+            'bias': sums['error'] / days,
+            'mape': np.where(sums['nonzero'] > 0, 100 * sums['ape'] / sums['nonzero'], np.nan),
+        }
+
+
+def backtest_fit(matrix_path: str, forecaster: str, cutoff: int, horizon: int,
+                 train_days: int) -> Dict[str, np.ndarray]:
+    """Worker: fit one forecaster on the train_days before column `cutoff` and score the next horizon days"""
+    matrix = np.load(matrix_path, mmap_mode='r')
+    train = np.array(matrix[:, cutoff - train_days:cutoff])
+    actual = np.array(matrix[:, cutoff:cutoff + horizon])
+    return error_sums(actual, predict(forecaster, train, horizon))
+
+
+def rolling_cutoffs(days: int, horizon: int, origins: int, step: int, train_days: int) -> List[int]:
+    """Column indices of the cutoffs, oldest first, the last one leaving exactly `horizon` days to score"""
+    cutoffs = [days - horizon - offset * step for offset in range(origins)]
+    cutoffs = [cutoff for cutoff in cutoffs if cutoff >= train_days]
+    if not cutoffs:
+        raise ValueError(f"{days} days cannot fit {train_days} training days plus a {horizon}-day horizon")
+    return sorted(cutoffs)
+
+
+def run_backtest(db, output_path: str, forecasters=FORECASTERS, horizon: int = 30,
+                 origins: int = 6, step: int = 7, train_days: int = 180,
+                 orchestrator: Optional[TrainingOrchestrator] = None,
+                 report: Optional[Callable[[float, str], None]] = None) -> Dict[str, Any]:
+    """
+    Walk-forward backtest of `forecasters` over every SKU, written to output_path
+
+    Cutoffs are `step` days apart, the latest `horizon` days before today.
+    The results file (replaced on completion) holds per-SKU errors per
+    forecaster and cutoff in backtest_errors and per-fit totals in
+    backtest_fits. Returns catalog-wide metrics per forecaster, pooled over
+    SKUs, days and the cutoffs it was scored at ('cutoffs_scored'), plus
+    'best_forecaster': the selectable forecaster with the lowest MAE. Only
+    forecasters scored at every cutoff are ranked, so a fit that failed
+    cannot win by skipping a hard cutoff: they alone get 'wins', the SKUs on
+    which they had the lowest MAE, and the rest appear under 'failed'.
+    """
+    if train_days < 2 * WARMUP_DAYS:
+        raise ValueError(f"train_days must be at least {2 * WARMUP_DAYS}")
+    started = time.perf_counter()
+    forecasters = tuple(forecasters)
+    history_days = train_days + horizon + (origins - 1) * step
+    with connection(db) as conn:
+        history = load_consumption_matrix(conn, history_days)
+    matrix = history['matrix']
+    n, days = matrix.shape
+    cutoffs = rolling_cutoffs(days, horizon, origins, step, train_days)
+    first_day = date.fromisoformat(history['start'])
+    cutoff_days = {cutoff: (first_day + timedelta(days=cutoff)).isoformat() for cutoff in cutoffs}
+
+    orchestrator = orchestrator or TrainingOrchestrator(timeout=1800)
+    scratch = tempfile.mkdtemp(prefix='backtest-')
+    matrix_path = os.path.join(scratch, 'matrix.npy')
+    np.save(matrix_path, matrix)
+    del matrix
+    partial_path = f"{output_path}.partial"
+    if os.path.exists(partial_path):
+        os.remove(partial_path)
+
+    totals = {name: {key: 0.0 for key in ('abs', 'squared', 'error', 'ape', 'nonzero', 'days')}
+              for name in forecasters}
+    sku_abs = np.zeros((len(forecasters), n))
+    scored_cutoffs = dict.fromkeys(forecasters, 0)
+    tasks = {(name, cutoff): (backtest_fit, (matrix_path, name, cutoff, horizon, train_days))
+             for name in forecasters for cutoff in cutoffs}
+    finished = []
+
+    try:
+        with closing(sqlite3.connect(partial_path)) as out:
+            out.execute("PRAGMA journal_mode=OFF")
+            out.execute("PRAGMA synchronous=OFF")
+            out.executescript(RESULTS_SCHEMA)
+
+            def on_complete(task, outcome):
+                name, cutoff = task
+                sums = outcome.pop('result', None)
+                summary = (None,) * 4
+                if sums is not None:
+                    per_sku = metrics_from_sums(sums, horizon)
+                    mape = np.where(np.isnan(per_sku['mape']), None, per_sku['mape'])
+                    with out:
+                        out.executemany(
+                            "INSERT INTO backtest_errors VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                            zip([name] * n, [cutoff_days[cutoff]] * n, history['drug_ids'].tolist(),
+                                per_sku['mae'].tolist(), per_sku['mse'].tolist(), per_sku['bias'].tolist(),
+                                mape.tolist(), sums['actual'].tolist(), sums['forecast'].tolist())
+                        )
+                    pooled = {key: float(values.sum()) for key, values in sums.items()}
+                    for key in ('abs', 'squared', 'error', 'ape', 'nonzero'):
+                        totals[name][key] += pooled[key]
+                    totals[name]['days'] += n * horizon
+                    sku_abs[forecasters.index(name)] += sums['abs']
+                    scored_cutoffs[name] += 1
+                    summary = tuple(float(value) for value in
+                                    metrics_from_sums(pooled, n * horizon).values())
+                with out:
+                    out.execute("INSERT INTO backtest_fits VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                (name, cutoff_days[cutoff], outcome['status'], outcome['error'],
+                                 outcome['seconds']) + summary)
+                finished.append(task)
+                if report is not None:
+                    report(0.1 + 0.85 * len(finished) / len(tasks),
+                           f"Scored {name} at cutoff {cutoff_days[cutoff]}")
+
+            outcomes = orchestrator.run(tasks, on_complete)
+        os.replace(partial_path, output_path)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        os.remove(matrix_path)
+        os.rmdir(scratch)
+
+    results = {}
+    for name in forecasters:
+        total = totals[name]
+        if not total['days']:
+            continue
+        metrics = metrics_from_sums(total, total['days'])
+        results[name] = {key: float(value) for key, value in metrics.items()}
+        results[name]['rmse'] = float(np.sqrt(results[name]['mse']))
+        results[name]['cutoffs_scored'] = scored_cutoffs[name]
+    if not results:
+        raise RuntimeError(f"Every backtest fit failed: {outcomes[next(iter(outcomes))]['error']}")
+
+    # Errors summed over fewer cutoffs are not comparable, so rank only the
+    # forecasters with a fit at every cutoff
+    ranked = [index for index, name in enumerate(forecasters) if scored_cutoffs[name] == len(cutoffs)]
+    if ranked:
+        wins = np.bincount(sku_abs[ranked].argmin(axis=0), minlength=len(ranked))
+        for index, count in zip(ranked, wins):
+            results[forecasters[index]]['wins'] = int(count)
+    selectable = [name for name in SELECTABLE_FORECASTERS
+                  if name in results and scored_cutoffs[name] == len(cutoffs)]
+
+    return {
+        'forecasters': results,
+        'best_forecaster': min(selectable, key=lambda name: results[name]['mae']) if selectable else None,
+        'failed': {f"{name}@{cutoff_days[cutoff]}": outcome['error']
+                   for (name, cutoff), outcome in outcomes.items() if outcome['status'] != 'ok'},
+        'cutoffs': [cutoff_days[cutoff] for cutoff in cutoffs],
+        'horizon': horizon,
+        'train_days': train_days,
+        'sku_count': n,
+        'output_path': output_path,
+        'created_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'seconds': time.perf_counter() - started,
+    }
+
+
+def backtest_backend(db, params: Dict[str, Any], report: Callable[[float, str], None]) -> Optional[Dict[str, Any]]:
+    """
+    Forecasting-backend entry point: backtest every forecaster with
+    params['forecast_days'] as the horizon, the results file next to the
+    model registry
+    """
+    digest = hashlib.sha256(params_key(params).encode()).hexdigest()[:12]
+    report(0.05, 'Loading consumption history')
+    return run_backtest(db, os.path.join(get_model_registry(db).root, f'backtest-{digest}.db'),
+                        horizon=params.get('forecast_days', 30), origins=params.get('origins', 6),
+                        step=params.get('step', 7), train_days=params.get('train_days', 180),
+                        report=report)
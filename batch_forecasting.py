@@ -0,0 +1,356 @@
+"""
+Batch Forecasting
+Catalog-wide statistical demand forecasts: simple exponential smoothing,
+damped additive Holt-Winters with weekly seasonality and Croston (SBA) for
+intermittent demand, fitted for every SKU at once over the SKU x day
+consumption matrix.
+
+Each model steps through time once with NumPy operations across all SKUs
+and all candidate smoothing parameters, so a whole catalog takes seconds on
+one core instead of one model fit per SKU.
+"""
+
+import itertools
+import time
+from collections import Counter
+from datetime import date, timedelta
+from statistics import NormalDist
+from typing import Any, Callable, Dict, Optional
+
+import numpy as np
+
+from consumption_matrix import load_consumption_matrix
+from db_connection import connection
+from forecast_store import save_forecast_run
+from training_orchestrator import TrainingOrchestrator
+
+SEASON_LENGTH = 7
+# Days used to initialize the models; their one-step errors are not scored
+WARMUP_DAYS = 2 * SEASON_LENGTH
+# Syntetos-Boylan cut-off: an average inter-demand interval above this is intermittent
+INTERMITTENT_ADI = 1.32
+DAMPING = 0.98
+# SKUs per block, bounding memory at roughly 36 parameter lanes x CHUNK_SKUS x 7
+CHUNK_SKUS = 4096
+
+SES_ALPHAS = np.array([0.05, 0.1, 0.2, 0.3, 0.5, 0.8])
+HW_GRID = np.array(list(itertools.product(
+    [0.05, 0.1, 0.2, 0.4],   # level
+    [0.0, 0.01, 0.05],       # trend
+    [0.05, 0.15, 0.3],       # season
+)))
+CROSTON_ALPHAS = np.array([0.05, 0.1, 0.2, 0.3])
+
+
+def _best_lane(sse: np.ndarray):
+    """Index of the lowest-error parameter lane for every SKU"""
+    return sse.argmin(axis=0), np.arange(sse.shape[1])
+
+
+def _fit_ses(series: np.ndarray, horizon: int) -> Dict[str, np.ndarray]:
+    """series is day x SKU; returns per-SKU forecast, mse and interval scale"""
+    days, n = series.shape
+    alpha = SES_ALPHAS[:, None]
+    level = np.repeat(series[:WARMUP_DAYS].mean(axis=0)[None, :], len(SES_ALPHAS), axis=0)
+    sse = np.zeros_like(level)
+
+    for t in range(days):
+        error = series[t] - level
+        if t >= WARMUP_DAYS:
+            sse += error * error
+        level += alpha * error
+
+    best, cols = _best_lane(sse)
+    chosen = SES_ALPHAS[best][:, None]
+    steps = np.arange(horizon)[None, :]
+    return {
+        'forecast': np.repeat(level[best, cols][:, None], horizon, axis=1),
+        'mse': sse[best, cols] / (days - WARMUP_DAYS),
+        'scale': np.sqrt(1 + steps * chosen ** 2),
+    }
+
+
+def _fit_holt_winters(series: np.ndarray, horizon: int) -> Dict[str, np.ndarray]:
+    """Damped additive trend with additive weekly season, series is day x SKU"""
+    days, n = series.shape
+    lanes = len(HW_GRID)
+    alpha, beta, gamma = (HW_GRID[:, i][:, None] for i in range(3))
+
+    first, second = series[:SEASON_LENGTH], series[SEASON_LENGTH:WARMUP_DAYS]
+    level = np.repeat(series[:WARMUP_DAYS].mean(axis=0)[None, :], lanes, axis=0)
+    trend = np.repeat(((second.mean(axis=0) - first.mean(axis=0)) / SEASON_LENGTH)[None, :], lanes, axis=0)
+    season = np.repeat(((first + second) / 2 - level[0])[:, None, :], lanes, axis=1)
+    sse = np.zeros_like(level)
+
+    for t in range(days):
+        position = t % SEASON_LENGTH
+        previous = season[position]
+        damped = DAMPING * trend
+        error = series[t] - (level + damped + previous)
+        if t >= WARMUP_DAYS:
+            sse += error * error
+        new_level = level + damped + alpha * error
+        trend = damped + beta * (new_level - level - damped)
+        season[position] = previous + gamma * (series[t] - new_level - previous)
+        level = new_level
+
+    best, cols = _best_lane(sse)
+    steps = np.arange(1, horizon + 1)
+    damped_steps = np.cumsum(DAMPING ** steps)
+    positions = (days + steps - 1) % SEASON_LENGTH
+    forecast = (level[best, cols][:, None] + damped_steps[None, :] * trend[best, cols][:, None]
+                + season[positions][:, best, cols].T)
+
+    # Variance multiplier of the error-correction form: 1 + sum (a + a*b*phi_j + g*(1-a)*[j % m == 0])^2
+    a, b, g = (HW_GRID[best, i][:, None] for i in range(3))
+    j = steps[None, :-1]
+    terms = a + a * b * damped_steps[None, :-1] + g * (1 - a) * (j % SEASON_LENGTH == 0)
+    variance = np.concatenate([np.ones((n, 1)), 1 + np.cumsum(terms ** 2, axis=1)], axis=1)
+    return {
+        'forecast': forecast,
+        'mse': sse[best, cols] / (days - WARMUP_DAYS),
+        'scale': np.sqrt(variance),
+    }
+
+
+def _fit_croston(series: np.ndarray, horizon: int) -> Dict[str, np.ndarray]:
+    """Croston with the Syntetos-Boylan bias correction, series is day x SKU"""
+    days, n = series.shape
+    alpha = CROSTON_ALPHAS[:, None]
+
+    # Start from the demand size and interval seen over the first four weeks,
+    # or the whole history when those weeks had no demand
+    window = min(4 * SEASON_LENGTH, days)
+    early = series[:window]
+    early_count = (early > 0).sum(axis=0)
+    total_count = (series > 0).sum(axis=0)
+    size = np.where(early_count > 0, early.sum(axis=0) / np.maximum(early_count, 1),
+                    series.sum(axis=0) / np.maximum(total_count, 1))
+    interval = np.where(early_count > 0, window / np.maximum(early_count, 1),
+                        days / np.maximum(total_count, 1))
+
+    lanes = len(CROSTON_ALPHAS)
+    size = np.repeat(size[None, :], lanes, axis=0)
+    interval = np.repeat(interval[None, :], lanes, axis=0)
+    since_demand = np.ones(n)
+    sse = np.zeros_like(size)
+    correction = 1 - alpha / 2
+
+    for t in range(days):
+        error = series[t] - correction * size / interval
+        if t >= WARMUP_DAYS:
+            sse += error * error
+        demand = series[t] > 0
+        size = np.where(demand, size + alpha * (series[t] - size), size)
+        interval = np.where(demand, interval + alpha * (since_demand - interval), interval)
+        since_demand = np.where(demand, 1.0, since_demand + 1)
+
+    best, cols = _best_lane(sse)
+    chosen = CROSTON_ALPHAS[best][:, None]
+    rate = (1 - chosen[:, 0] / 2) * size[best, cols] / interval[best, cols]
+    steps = np.arange(horizon)[None, :]
+    return {
+        'forecast': np.repeat(rate[:, None], horizon, axis=1),
+        'mse': sse[best, cols] / (days - WARMUP_DAYS),
+        'scale': np.sqrt(1 + steps * chosen ** 2),
+    }
+
+
+FITTERS = {
+    'ses': _fit_ses,
+    'holt_winters': _fit_holt_winters,
+    'croston': _fit_croston,
+}
+
+
+def forecast_matrix(matrix: np.ndarray, horizon: int = 30, level: float = 0.95,
+                    method: str = 'auto') -> Dict[str, np.ndarray]:
+    """
+    Forecast every row of a SKU x day matrix `horizon` days past its last column
+
+    With method 'auto', intermittent SKUs (average inter-demand interval
+    above INTERMITTENT_ADI) use Croston and the rest use whichever of SES and
+    Holt-Winters had the lower one-step in-sample error; any FITTERS name
+    fits that model for every SKU instead. Intervals are normal at `level`,
+    from the chosen model's residual variance, and floored at zero like the
+    forecast. Returns per-SKU 'method' plus (SKUs x horizon) 'forecast',
+    'lower', 'upper'.
+    """
+    if method != 'auto' and method not in FITTERS:
+        raise ValueError(f"Unknown forecasting method: {method}")
+    n, days = matrix.shape
+    if days < 2 * WARMUP_DAYS:
+        raise ValueError(f"Need at least {2 * WARMUP_DAYS} days of history, got {days}")
+
+    chosen_method = np.empty(n, dtype=object)
+    forecast = np.empty((n, horizon))
+    spread = np.empty((n, horizon))
+    z = NormalDist().inv_cdf(0.5 + level / 2)
+
+    for start in range(0, n, CHUNK_SKUS):
+        block = slice(start, min(start + CHUNK_SKUS, n))
+        series = np.ascontiguousarray(matrix[block].T)
+        if method != 'auto':
+            groups = [(np.arange(series.shape[1]), (method,))]
+        else:
+            # Only fit the models a SKU can end up with
+            intermittent = days > INTERMITTENT_ADI * (series > 0).sum(axis=0)
+            groups = [(np.flatnonzero(intermittent), ('croston',)),
+                      (np.flatnonzero(~intermittent), ('ses', 'holt_winters'))]
+
+        for rows, names in groups:
+            if not len(rows):
+                continue
+            subset = np.ascontiguousarray(series[:, rows])
+            fits = [FITTERS[name](subset, horizon) for name in names]
+            choice = np.argmin(np.stack([fit['mse'] for fit in fits]), axis=0)
+            for index, (name, fit) in enumerate(zip(names, fits)):
+                chosen = choice == index
+                target = start + rows[chosen]
+                chosen_method[target] = name
+                forecast[target] = fit['forecast'][chosen]
+                spread[target] = z * np.sqrt(fit['mse'][chosen])[:, None] * fit['scale'][chosen]
+
+    return {
+        'method': chosen_method,
+        'forecast': np.maximum(forecast, 0),
+        'lower': np.maximum(forecast - spread, 0),
+        'upper': np.maximum(forecast + spread, 0),
+    }
+
+
+def forecast_matrix_parallel(matrix: np.ndarray, horizon: int = 30, level: float = 0.95,
+                             orchestrator: Optional[TrainingOrchestrator] = None) -> Dict[str, np.ndarray]:
+    """forecast_matrix() with blocks of SKUs fitted in separate worker processes"""
+    orchestrator = orchestrator or TrainingOrchestrator()
+    blocks = np.array_split(np.arange(len(matrix)), min(orchestrator.max_workers, max(1, len(matrix))))
+    outcomes = orchestrator.run({
+        index: (forecast_matrix, (matrix[rows], horizon, level)) for index, rows in enumerate(blocks)
+    })
+    failed = {index: outcome['error'] for index, outcome in outcomes.items() if outcome['status'] != 'ok'}
+    if failed:
+        raise RuntimeError(f"Forecast blocks failed: {failed}")
+    parts = [outcomes[index]['result'] for index in range(len(blocks))]
+    return {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
+
+
+def save_forecasts(db, history: Dict[str, Any], result: Dict[str, Any], level: float,
+                   elapsed_ms: Optional[float] = None) -> int:
+    """
+    Store a forecast_matrix() result for the SKUs of a load_consumption_matrix()
+    catalog history as the stored forecast; returns the run_id
+    """
+    n, horizon = result['forecast'].shape
+    first = date.fromisoformat(history['end'])
+    days = [(first + timedelta(days=offset)).isoformat() for offset in range(horizon)]
+    rows = zip(
+        np.repeat(history['drug_ids'], horizon).tolist(),
+        days * n,
+        np.repeat(result['method'], horizon).tolist(),
+        result['forecast'].ravel().tolist(),
+        result['lower'].ravel().tolist(),
+        result['upper'].ravel().tolist(),
+    )
+    run = {
+        'history_start': history['start'],
+        'history_end': history['end'],
+        'horizon_days': horizon,
+        'interval_level': level,
+        'sku_count': n,
+        'elapsed_ms': elapsed_ms,
+    }
+    with connection(db, readonly=False) as conn:
+        return save_forecast_run(conn, run, rows)
+
+
+def forecast_catalog(db, horizon: int = 30, history_days: int = 365, level: float = 0.95,
+                     end_day: Optional[str] = None, save: bool = True, workers: int = 1) -> Dict[str, Any]:
+    """
+    Forecast daily demand for every SKU and, with save, replace the stored forecast
+
+    History is the `history_days` full days before end_day (default today);
+    forecasts start on end_day. workers > 1 fits blocks of SKUs in that many
+    processes. Returns the forecast_matrix() arrays plus 'drug_ids', 'days',
+    'run_id' (None unless saved) and stage 'timings' in ms.
+    """
+    started = time.perf_counter()
+    with connection(db) as conn:
+        history = load_consumption_matrix(conn, history_days, end_day)
+    loaded = time.perf_counter()
+
+    if workers > 1:
+        result = forecast_matrix_parallel(history['matrix'], horizon, level, TrainingOrchestrator(workers))
+    else:
+        result = forecast_matrix(history['matrix'], horizon, level)
+    fitted = time.perf_counter()
+
+    first = date.fromisoformat(history['end'])
+    result['drug_ids'] = history['drug_ids']
+    result['days'] = [(first + timedelta(days=offset)).isoformat() for offset in range(horizon)]
+    result['run_id'] = None
+    result['timings'] = {
+        'load_ms': (loaded - started) * 1000,
+        'fit_ms': (fitted - loaded) * 1000,
+    }
+
+    if save:
+        result['run_id'] = save_forecasts(db, history, result, level, (fitted - started) * 1000)
+        result['timings']['save_ms'] = (time.perf_counter() - fitted) * 1000
+
+    return result
+
+
+def forecast_errors(actual: np.ndarray, predicted: np.ndarray) -> Dict[str, float]:
+    """MAE, RMSE and MAPE (in %, over days with nonzero actuals)"""
+    error = actual - predicted
+    nonzero = actual != 0
+    return {
+        'mae': float(np.abs(error).mean()) if len(error) else 0.0,
+        'rmse': float(np.sqrt((error ** 2).mean())) if len(error) else 0.0,
+        'mape': float(np.abs(error[nonzero] / actual[nonzero]).mean() * 100) if nonzero.any() else 0.0,
+    }
+
+
+def statistical_backend(db, params: Dict[str, Any], report: Callable[[float, str], None]) -> Optional[Dict[str, Any]]:
+    """
+    Default forecasting backend: total daily consumption as the sum of the
+    per-SKU statistical forecasts
+
+    Metrics come from refitting without the last forecast_days days and
+    comparing against them. params['method'] forces one model for every SKU
+    (see forecast_matrix). The per-SKU forecasts replace the stored ones
+    unless params['save_forecasts'] is false. Returns None with under 30
+    days of consumption.
+    """
+    forecast_days = params.get('forecast_days', 30)
+    report(0.1, 'Loading consumption history')
+    with connection(db) as conn:
+        history = load_consumption_matrix(conn, params.get('history_days', 365))
+    matrix = history['matrix']
+    totals = matrix.sum(axis=0)
+    if np.count_nonzero(totals) < 30:
+        return None
+
+    report(0.3, 'Scoring on the most recent days')
+    method = params.get('method', 'auto')
+    holdout = forecast_matrix(matrix[:, :-forecast_days], forecast_days, method=method)
+    predicted = holdout['forecast'].sum(axis=0)
+    actual = totals[-forecast_days:]
+
+    report(0.6, 'Forecasting every SKU')
+    forecast = forecast_matrix(matrix, forecast_days, method=method)
+    if params.get('save_forecasts', True):
+        report(0.8, 'Storing per-SKU forecasts')
+        save_forecasts(db, history, forecast, 0.95)
+    start = date.fromisoformat(history['start'])
+    end = date.fromisoformat(history['end'])
+    return dict(
+        forecast_errors(actual, predicted),
+        future_pred=forecast['forecast'].sum(axis=0),
+        future_dates=[(end + timedelta(days=offset)).isoformat() for offset in range(forecast_days)],
+        dates=[(start + timedelta(days=offset)).isoformat() for offset in range(len(totals))],
+        history=totals,
+        actual=actual,
+        predicted=predicted,
+        methods=dict(Counter(forecast['method'])),
+    )
@@ -0,0 +1,382 @@
+"""
+Benchmark Suite
+Times the dashboard queries in utils.py, the recommendation engine and the
+forecasting entry points on synthetic databases at several multiples of the
+production data size, and writes the timings as JSON so runs from different
+commits can be compared.
+
+Usage:
+    python benchmark_suite.py                                  1x, 10x and 100x
+    python benchmark_suite.py --scales 1x,10x --output before.json
+    python benchmark_suite.py --scales 1x --compare before.json
+    python benchmark_suite.py --scales '' --output imports.json    import costs only
+"""
+
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+import utils
+from anomaly_detection import RECENT_DAYS, WINDOW_DAYS, rank_anomalies
+from consumption_matrix import load_consumption_matrix
+from consumption_rollups import days_ago
+from db_migrations import get_schema_version, LATEST_VERSION
+from generate_synthetic_data import generate_dataset
+from smart_recommendations import SmartRecommendationEngine
+
+# Roughly the shipped dataset: 1.7k SKUs and 82k consumption rows over a year
+BASE_SKUS = 1700
+BASE_CONSUMPTION_ROWS = 82_000
+BASE_DAYS = 365
+
+SCALES = {'1x': 1, '10x': 10, '100x': 100}
+
+
+class BenchmarkDatabase:
+    """Minimal stand-in for the app's database manager"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+
+    def get_connection(self):
+        return sqlite3.connect(self.db_path)
+
+
+def build_database(scale: str, data_dir: str, seed: int = 42) -> Tuple[str, Dict[str, Any]]:
+    """Path of the synthetic database for scale, generating it unless a current copy exists"""
+    factor = SCALES[scale]
+    db_path = os.path.join(data_dir, f"synthetic_{scale}_seed{seed}.db")
+    meta_path = db_path + '.json'
+
+    if os.path.exists(db_path) and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        conn = sqlite3.connect(db_path)
+        try:
+            current = get_schema_version(conn) == LATEST_VERSION
+        finally:
+            conn.close()
+        if current and meta.get('generated_on') == days_ago(0):
+            return db_path, meta
+
+    os.makedirs(data_dir, exist_ok=True)
+    n_skus = BASE_SKUS * factor
+    summary = generate_dataset(
+        db_path, n_skus=n_skus, days=BASE_DAYS,
+        density=BASE_CONSUMPTION_ROWS / (BASE_SKUS * BASE_DAYS),
+        seed=seed, overwrite=True
+    )
+    meta = dict(summary, scale=scale, seed=seed, generated_on=days_ago(0))
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f, indent=2)
+    return db_path, meta
+
+
+def time_call(func: Callable[[], Any], repeat: int = 5, warmup: int = 1) -> Dict[str, Any]:
+    """Wall-clock statistics in ms over repeat calls, after warmup untimed calls"""
+    for _ in range(warmup):
+        func()
+    samples = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {
+        'repeat': repeat,
+        'min_ms': samples[0],
+        'median_ms': statistics.median(samples),
+        'mean_ms': statistics.fmean(samples),
+        'max_ms': samples[-1],
+        'result_size': len(result) if hasattr(result, '__len__') else None,
+    }
+
+
+def _load_inventory_frame(db) -> pd.DataFrame:
+    conn = db.get_connection()
+    try:
+        return pd.read_sql_query("SELECT id, drug_name, current_stock, unit_price FROM inventory", conn)
+    finally:
+        conn.close()
+
+
+def _load_anomaly_matrix(db):
+    conn = db.get_connection()
+    try:
+        return load_consumption_matrix(conn, WINDOW_DAYS + RECENT_DAYS)['matrix']
+    finally:
+        conn.close()
+
+
+def _sample_drug_name(db) -> Optional[str]:
+    conn = db.get_connection()
+    try:
+        row = conn.execute("SELECT drug_name FROM inventory ORDER BY id LIMIT 1").fetchone()
+        return row[0] if row else None
+    finally:
+        conn.close()
+
+
+def query_benchmarks(db) -> List[Tuple[str, Callable[[], Any]]]:
+    """(name, call) for every database-backed public function"""
+    drug_name = _sample_drug_name(db)
+    inventory = _load_inventory_frame(db)
+    anomaly_matrix = _load_anomaly_matrix(db)
+
+    def uncached_recommendations():
+        return SmartRecommendationEngine(db, use_cache=False).get_personalized_recommendations()
+
+    def sequential_recommendations():
+        return SmartRecommendationEngine(db, parallel=False, use_cache=False).get_personalized_recommendations()
+
+    def cached_recommendations():
+        return SmartRecommendationEngine(db).get_personalized_recommendations()
+
+    return [
+        ('utils.generate_alerts', lambda: utils.generate_alerts(db)),
+        ('utils.get_alert_snapshot', lambda: utils.get_alert_snapshot(db)),
+        ('utils.get_active_alerts', lambda: utils.get_active_alerts(db, 'stock', 10)),
+        ('utils.get_low_stock_items', lambda: utils.get_low_stock_items(db)),
+        ('utils.get_expiring_items', lambda: utils.get_expiring_items(db)),
+        ('utils.get_high_value_expiring_items', lambda: utils.get_high_value_expiring_items(db)),
+        ('utils.get_expiring_value', lambda: utils.get_expiring_value(db)),
+        ('utils.get_expiry_calendar', lambda: utils.get_expiry_calendar(db)),
+        ('utils.detect_consumption_anomalies', lambda: utils.detect_consumption_anomalies(db)),
+        ('anomaly_detection.rank_anomalies', lambda: rank_anomalies(anomaly_matrix)),
+        ('utils.get_reorder_alerts', lambda: utils.get_reorder_alerts(db)),
+        ('utils.calculate_inventory_turnover', lambda: utils.calculate_inventory_turnover(db)),
+        ('utils.calculate_inventory_turnover[drug]', lambda: utils.calculate_inventory_turnover(db, drug_name)),
+        ('utils.calculate_abc_classification', lambda: utils.calculate_abc_classification(inventory.copy())),
+        ('utils.get_sku_class_summary', lambda: utils.get_sku_class_summary(db)),
+        ('SmartRecommendationEngine.get_personalized_recommendations', uncached_recommendations),
+        ('SmartRecommendationEngine.get_personalized_recommendations[sequential]', sequential_recommendations),
+        ('SmartRecommendationEngine.get_personalized_recommendations[cached]', cached_recommendations),
+    ]
+
+
+def helper_benchmarks() -> List[Tuple[str, Callable[[], Any]]]:
+    """(name, call) for the pure helpers; each call runs the helper 10k times"""
+    today = datetime.now()
+    predicted, actual = [10.0] * 30, [12.0] * 30
+
+    def loop(func):
+        return lambda: [func() for _ in range(10_000)]
+
+    return [
+        ('utils.format_currency', loop(lambda: utils.format_currency(123456.789))),
+        ('utils.format_dual_currency', loop(lambda: utils.format_dual_currency(123456.789))),
+        ('utils.calculate_days_until_expiry', loop(lambda: utils.calculate_days_until_expiry('2030-01-01'))),
+        ('utils.calculate_stock_status', loop(lambda: utils.calculate_stock_status(15, 20))),
+        ('utils.get_stock_status_color', loop(lambda: utils.get_stock_status_color('Low Stock'))),
+        ('utils.validate_batch_number', loop(lambda: utils.validate_batch_number('ABC2024011234'))),
+        ('utils.sanitize_drug_name', loop(lambda: utils.sanitize_drug_name(' Paracetamol 500mg '))),
+        ('utils.calculate_safety_stock', loop(lambda: utils.calculate_safety_stock(12.5, 7))),
+        ('utils.generate_order_number', loop(lambda: utils.generate_order_number())),
+        ('utils.parse_expiry_date', loop(lambda: utils.parse_expiry_date('2030-01-31'))),
+        ('utils.calculate_reorder_point', loop(lambda: utils.calculate_reorder_point(12.5, 7))),
+        ('utils.get_consumption_forecast_accuracy', loop(lambda: utils.get_consumption_forecast_accuracy(predicted, actual))),
+        ('utils.format_percentage', loop(lambda: utils.format_percentage(0.4567))),
+        ('utils.get_alert_priority_color', loop(lambda: utils.get_alert_priority_color('High'))),
+        ('utils.clean_numeric_input', loop(lambda: utils.clean_numeric_input('₹1,234.50'))),
+        ('utils.get_seasonal_adjustment_factor', loop(lambda: utils.get_seasonal_adjustment_factor(today, 'respiratory'))),
+    ]
+
+
+def training_benchmarks(db) -> List[Tuple[str, Callable[[], Any]]]:
+    """The regression and LSTM entry points behind regression_lstm_page, when importable"""
+    from inventory_forecasting import InventoryForecaster
+
+    forecaster = InventoryForecaster(db)
+    return [
+        ('InventoryForecaster.train_regression_models', forecaster.train_regression_models),
+        ('InventoryForecaster.train_lstm_model', lambda: forecaster.train_lstm_model(forecast_days=30)),
+    ]
+
+
+# Cold-import probes, each run in a fresh interpreter: what the forecasting
+# page pays at start-up now, what first use of a backend adds, and the eager
+# imports it used to pay up front
+IMPORT_PROBES = [
+    ('page forecasting modules', "import forecasting_backends, model_registry, training_jobs"),
+    ('statistical backend first use', "import forecasting_backends; forecasting_backends.get_backend('statistical')"),
+    ('regression backend first use',
+     "import forecasting_backends; forecasting_backends.get_backend('sku_stock_regression'); "
+     "import sklearn.linear_model"),
+    ('tensorflow', "import tensorflow"),
+    ('inventory_forecasting (eager page import)', "import inventory_forecasting"),
+]
+
+# Peak RSS comes from VmHWM, which starts over at exec; ru_maxrss would
+# carry over the benchmark process's own peak from the fork
+_IMPORT_PROBE = """
+import resource, sys, time
+started = time.perf_counter()
+exec(sys.argv[1])
+elapsed = time.perf_counter() - started
+try:
+    with open('/proc/self/status') as status:
+        peak_kb = next(int(line.split()[1]) for line in status if line.startswith('VmHWM:'))
+except (OSError, StopIteration):
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(elapsed * 1000, peak_kb, len(sys.modules))
+"""
+
+
+def import_benchmarks(repeat: int = 3) -> Dict[str, Dict[str, Any]]:
+    """Median cold-import time, peak RSS and module count per IMPORT_PROBES entry"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    for name, statement in IMPORT_PROBES:
+        samples = []
+        for _ in range(repeat):
+            probe = subprocess.run([sys.executable, '-c', _IMPORT_PROBE, statement],
+                                   capture_output=True, text=True, cwd=here)
+            if probe.returncode != 0:
+                error = probe.stderr.strip().splitlines()
+                samples = None
+                results[name] = {'skipped': error[-1] if error else f'exit code {probe.returncode}'}
+                break
+            elapsed_ms, max_rss_kb, modules = probe.stdout.split()
+            samples.append((float(elapsed_ms), int(max_rss_kb), int(modules)))
+        if samples:
+            results[name] = {
+                'repeat': repeat,
+                'median_ms': statistics.median(sample[0] for sample in samples),
+                'min_ms': min(sample[0] for sample in samples),
+                'max_rss_mb': max(sample[1] for sample in samples) / 1024,
+                'modules': samples[0][2],
+            }
+        entry = results[name]
+        described = f"{_describe(entry)}, {entry['max_rss_mb']:.0f} MB RSS" if 'max_rss_mb' in entry else _describe(entry)
+        print(f"  {name}: {described}", flush=True)
+    return results
+
+
+def _run_group(results: Dict[str, Any], benchmarks, repeat: int, warmup: int) -> None:
+    for name, func in benchmarks:
+        try:
+            results[name] = time_call(func, repeat=repeat, warmup=warmup)
+        except Exception as e:
+            results[name] = {'error': f"{type(e).__name__}: {e}"}
+        print(f"  {name}: {_describe(results[name])}", flush=True)
+
+
+def _describe(entry: Dict[str, Any]) -> str:
+    if 'median_ms' in entry:
+        return f"{entry['median_ms']:.2f} ms (min {entry['min_ms']:.2f})"
+    return entry.get('skipped') or entry.get('error', '')
+
+
+def run_scale(scale: str, data_dir: str, seed: int = 42, repeat: int = 5,
+              include_training: bool = True) -> Dict[str, Any]:
+    """Build (or reuse) the database for one scale and time every benchmark on it"""
+    started = time.perf_counter()
+    db_path, dataset = build_database(scale, data_dir, seed)
+    print(f"[{scale}] {dataset['skus']:,} SKUs, {dataset['consumption_rows']:,} consumption rows "
+          f"({time.perf_counter() - started:.1f}s to prepare)", flush=True)
+
+    db = BenchmarkDatabase(db_path)
+    results = {}
+    _run_group(results, query_benchmarks(db), repeat, warmup=1)
+    _run_group(results, helper_benchmarks(), repeat, warmup=1)
+
+    if include_training:
+        try:
+            training = training_benchmarks(db)
+        except ImportError as e:
+            for name in ('InventoryForecaster.train_regression_models', 'InventoryForecaster.train_lstm_model'):
+                results[name] = {'skipped': f"forecasting dependencies unavailable ({e})"}
+                print(f"  {name}: {results[name]['skipped']}", flush=True)
+        else:
+            # Model fits are slow and stateful, so time single cold runs
+            _run_group(results, training, repeat=1, warmup=0)
+
+    return {'dataset': dataset, 'results': results}
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(scales: List[str], data_dir: str, seed: int = 42, repeat: int = 5,
+              include_training: bool = True) -> Dict[str, Any]:
+    """Benchmark every scale; the returned dict is what gets written as JSON"""
+    print("[imports]", flush=True)
+    imports = import_benchmarks()
+    return {
+        'commit': _git_commit(),
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'seed': seed,
+        'imports': imports,
+        'scales': {
+            scale: run_scale(scale, data_dir, seed, repeat, include_training)
+            for scale in scales
+        },
+    }
+
+
+def compare_reports(baseline: Dict[str, Any], current: Dict[str, Any]) -> List[Tuple[str, str, float, float]]:
+    """(scale, benchmark, baseline median ms, current median ms) for benchmarks timed in both"""
+    rows = []
+    before = baseline.get('imports', {})
+    for name, entry in current.get('imports', {}).items():
+        if 'median_ms' in entry and 'median_ms' in before.get(name, {}):
+            rows.append(('imports', name, before[name]['median_ms'], entry['median_ms']))
+    for scale, run in current['scales'].items():
+        before = baseline.get('scales', {}).get(scale, {}).get('results', {})
+        for name, entry in run['results'].items():
+            if 'median_ms' in entry and 'median_ms' in before.get(name, {}):
+                rows.append((scale, name, before[name]['median_ms'], entry['median_ms']))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark queries, recommendations and training")
+    parser.add_argument('--scales', default='1x,10x,100x',
+                        help=f"comma-separated subset of {', '.join(SCALES)}")
+    parser.add_argument('--data-dir', default='benchmark_data')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help="earlier results JSON to compare medians against")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--skip-training', action='store_true')
+    args = parser.parse_args()
+
+    scales = [scale.strip() for scale in args.scales.split(',') if scale.strip()]
+    unknown = [scale for scale in scales if scale not in SCALES]
+    if unknown:
+        parser.error(f"unknown scale(s): {', '.join(unknown)}")
+
+    report = run_suite(scales, args.data_dir, args.seed, args.repeat, not args.skip_training)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"\nMedian ms vs {args.compare} (commit {baseline.get('commit') or 'unknown'}):")
+        for scale, name, before, after in compare_reports(baseline, report):
+            change = (after - before) / before * 100 if before else 0.0
+            print(f"  [{scale}] {name}: {before:.2f} -> {after:.2f} ({change:+.1f}%)")
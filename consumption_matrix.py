@@ -0,0 +1,65 @@
+"""
+Consumption Matrix
+Dense SKU x day consumption matrix built from the daily rollup, the shared
+input for catalog-wide forecasting and statistics.
+"""
+
+from datetime import date, timedelta
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+from consumption_rollups import days_ago
+
+# Up to this many requested SKUs are read by primary-key ranges instead of a
+# scan of the whole window
+SUBSET_LOOKUP_LIMIT = 500
+
+
+def load_consumption_matrix(conn, history_days: int = 365, end_day: Optional[str] = None,
+                            drug_ids: Optional[np.ndarray] = None) -> Dict[str, Any]:
+    """
+    Daily consumption for every SKU over [end_day - history_days, end_day)
+
+    end_day defaults to today, so the partial current day is left out. Every
+    inventory item gets a row, and days without consumption are zero. Returns
+    {'drug_ids': sorted int64 ids, 'start': first day (ISO), 'end': end_day,
+    'matrix': float64 array of shape (len(drug_ids), history_days)}.
+    """
+    end = date.fromisoformat(end_day) if end_day else date.fromisoformat(days_ago(0))
+    start = end - timedelta(days=history_days)
+
+    subset = drug_ids is not None
+    if drug_ids is None:
+        drug_ids = np.fromiter((row[0] for row in conn.execute("SELECT id FROM inventory ORDER BY id")),
+                               dtype=np.int64)
+    else:
+        drug_ids = np.sort(np.asarray(drug_ids, dtype=np.int64))
+    matrix = np.zeros((len(drug_ids), history_days))
+
+    if subset and len(drug_ids) <= SUBSET_LOOKUP_LIMIT:
+        rows = []
+        if len(drug_ids):
+            rows = conn.execute(f"""
+                SELECT drug_id, day, total_quantity FROM consumption_daily_rollup
+                WHERE drug_id IN ({', '.join('?' * len(drug_ids))}) AND day >= ? AND day < ?
+            """, drug_ids.tolist() + [start.isoformat(), end.isoformat()]).fetchall()
+    else:
+        rows = conn.execute(
+            "SELECT drug_id, day, total_quantity FROM consumption_daily_rollup WHERE day >= ? AND day < ?",
+            (start.isoformat(), end.isoformat())
+        ).fetchall()
+    if rows and len(drug_ids):
+        ids, days, quantities = zip(*rows)
+        ids = np.fromiter(ids, dtype=np.int64, count=len(rows))
+        offsets = (np.array(days, dtype='datetime64[D]') - np.datetime64(start, 'D')).astype(np.int64)
+        positions = np.searchsorted(drug_ids, ids)
+        known = (positions < len(drug_ids)) & (drug_ids[np.minimum(positions, len(drug_ids) - 1)] == ids)
+        matrix[positions[known], offsets[known]] = np.fromiter(quantities, dtype=np.float64, count=len(rows))[known]
+
+    return {
+        'drug_ids': drug_ids,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'matrix': matrix,
+    }
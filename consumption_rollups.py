@@ -0,0 +1,180 @@
+"""
+Consumption Rollups
+Per-drug daily and monthly consumption totals, maintained incrementally by
+triggers on consumption_patterns, plus a query layer that answers
+"consumption since N days ago" questions from the rollups instead of raw rows.
+db_migrations installs the tables and triggers and backfills them (migration 2).
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+
+# Rows with a NULL drug, date or quantity are ignored by AVG/SUM in the raw
+# queries, so they are left out of the rollups as well.
+ROLLUP_SCHEMA = """
+CREATE TABLE IF NOT EXISTS consumption_daily_rollup (
+    drug_id INTEGER NOT NULL,
+    day TEXT NOT NULL,
+    total_quantity INTEGER NOT NULL DEFAULT 0,
+    row_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (drug_id, day)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_consumption_daily_rollup_day
+    ON consumption_daily_rollup (day, drug_id, total_quantity, row_count);
+
+CREATE TABLE IF NOT EXISTS consumption_monthly_rollup (
+    drug_id INTEGER NOT NULL,
+    month TEXT NOT NULL,
+    total_quantity INTEGER NOT NULL DEFAULT 0,
+    row_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (drug_id, month)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_consumption_monthly_rollup_month
+    ON consumption_monthly_rollup (month, drug_id, total_quantity, row_count);
+
+CREATE TRIGGER IF NOT EXISTS trg_consumption_rollup_insert
+AFTER INSERT ON consumption_patterns
+WHEN NEW.drug_id IS NOT NULL AND date(NEW.date) IS NOT NULL AND NEW.quantity_consumed IS NOT NULL
+BEGIN
+    INSERT INTO consumption_daily_rollup (drug_id, day, total_quantity, row_count)
+    VALUES (NEW.drug_id, date(NEW.date), NEW.quantity_consumed, 1)
+    ON CONFLICT (drug_id, day) DO UPDATE SET
+        total_quantity = total_quantity + excluded.total_quantity,
+        row_count = row_count + 1;
+    INSERT INTO consumption_monthly_rollup (drug_id, month, total_quantity, row_count)
+    VALUES (NEW.drug_id, strftime('%Y-%m', NEW.date), NEW.quantity_consumed, 1)
+    ON CONFLICT (drug_id, month) DO UPDATE SET
+        total_quantity = total_quantity + excluded.total_quantity,
+        row_count = row_count + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_consumption_rollup_delete
+AFTER DELETE ON consumption_patterns
+WHEN OLD.drug_id IS NOT NULL AND date(OLD.date) IS NOT NULL AND OLD.quantity_consumed IS NOT NULL
+BEGIN
+    UPDATE consumption_daily_rollup
+    SET total_quantity = total_quantity - OLD.quantity_consumed, row_count = row_count - 1
+    WHERE drug_id = OLD.drug_id AND day = date(OLD.date);
+    DELETE FROM consumption_daily_rollup
+    WHERE drug_id = OLD.drug_id AND day = date(OLD.date) AND row_count <= 0;
+    UPDATE consumption_monthly_rollup
+    SET total_quantity = total_quantity - OLD.quantity_consumed, row_count = row_count - 1
+    WHERE drug_id = OLD.drug_id AND month = strftime('%Y-%m', OLD.date);
+    DELETE FROM consumption_monthly_rollup
+    WHERE drug_id = OLD.drug_id AND month = strftime('%Y-%m', OLD.date) AND row_count <= 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_consumption_rollup_update
+AFTER UPDATE OF drug_id, date, quantity_consumed ON consumption_patterns
+BEGIN
+    UPDATE consumption_daily_rollup
+    SET total_quantity = total_quantity - OLD.quantity_consumed, row_count = row_count - 1
+    WHERE OLD.quantity_consumed IS NOT NULL AND drug_id = OLD.drug_id AND day = date(OLD.date);
+    DELETE FROM consumption_daily_rollup
+    WHERE drug_id = OLD.drug_id AND day = date(OLD.date) AND row_count <= 0;
+    UPDATE consumption_monthly_rollup
+    SET total_quantity = total_quantity - OLD.quantity_consumed, row_count = row_count - 1
+    WHERE OLD.quantity_consumed IS NOT NULL AND drug_id = OLD.drug_id AND month = strftime('%Y-%m', OLD.date);
+    DELETE FROM consumption_monthly_rollup
+    WHERE drug_id = OLD.drug_id AND month = strftime('%Y-%m', OLD.date) AND row_count <= 0;
+    INSERT INTO consumption_daily_rollup (drug_id, day, total_quantity, row_count)
+    SELECT NEW.drug_id, date(NEW.date), NEW.quantity_consumed, 1
+    WHERE NEW.drug_id IS NOT NULL AND date(NEW.date) IS NOT NULL AND NEW.quantity_consumed IS NOT NULL
+    ON CONFLICT (drug_id, day) DO UPDATE SET
+        total_quantity = total_quantity + excluded.total_quantity,
+        row_count = row_count + 1;
+    INSERT INTO consumption_monthly_rollup (drug_id, month, total_quantity, row_count)
+    SELECT NEW.drug_id, strftime('%Y-%m', NEW.date), NEW.quantity_consumed, 1
+    WHERE NEW.drug_id IS NOT NULL AND date(NEW.date) IS NOT NULL AND NEW.quantity_consumed IS NOT NULL
+    ON CONFLICT (drug_id, month) DO UPDATE SET
+        total_quantity = total_quantity + excluded.total_quantity,
+        row_count = row_count + 1;
+END;
+"""
+
+
+REBUILD_STATEMENTS = (
+    "DELETE FROM consumption_daily_rollup",
+    "DELETE FROM consumption_monthly_rollup",
+    """
+    INSERT INTO consumption_daily_rollup (drug_id, day, total_quantity, row_count)
+    SELECT drug_id, date(date), SUM(quantity_consumed), COUNT(*)
+    FROM consumption_patterns
+    WHERE drug_id IS NOT NULL AND date(date) IS NOT NULL AND quantity_consumed IS NOT NULL
+    GROUP BY drug_id, date(date)
+    """,
+    """
+    INSERT INTO consumption_monthly_rollup (drug_id, month, total_quantity, row_count)
+    SELECT drug_id, substr(day, 1, 7), SUM(total_quantity), SUM(row_count)
+    FROM consumption_daily_rollup
+    GROUP BY drug_id, substr(day, 1, 7)
+    """,
+)
+
+
+def days_ago(days: int) -> str:
+    """Same date as SQLite's date('now', '-N days') (UTC)"""
+    return (datetime.now(timezone.utc).date() - timedelta(days=days)).isoformat()
+
+
+def _next_month_start(day: str) -> str:
+    year, month = int(day[:4]), int(day[5:7])
+    if month == 12:
+        return f"{year + 1}-01-01"
+    return f"{year}-{month + 1:02d}-01"
+
+
+def rollup_periods_sql(since: str, until: Optional[str] = None) -> Tuple[str, List[str]]:
+    """
+    SQL yielding (drug_id, period, total_quantity, row_count) for since <= day < until
+
+    Whole months come from the monthly rollup and only the partial months at the
+    edges of the window are read from the daily rollup. period is 'YYYY-MM-DD'
+    for daily rows and 'YYYY-MM' for monthly rows, so substr(period, 6, 2) is
+    the month of year either way. until=None leaves the window open-ended,
+    matching the raw "date >= X" predicates.
+    """
+    daily = ("SELECT drug_id, day AS period, total_quantity, row_count "
+             "FROM consumption_daily_rollup WHERE day >= ? AND day < ?")
+    monthly = ("SELECT drug_id, month AS period, total_quantity, row_count "
+               "FROM consumption_monthly_rollup WHERE month >= ?")
+
+    first_full_month = since if since.endswith('-01') else _next_month_start(since)
+    parts = []
+    params = []
+
+    if until is None:
+        if since < first_full_month:
+            parts.append(daily)
+            params.extend([since, first_full_month])
+        parts.append(monthly)
+        params.append(first_full_month[:7])
+    else:
+        last_month_start = until[:7] + '-01'
+        if first_full_month >= last_month_start:
+            parts.append(daily)
+            params.extend([since, until])
+        else:
+            if since < first_full_month:
+                parts.append(daily)
+                params.extend([since, first_full_month])
+            parts.append(monthly + " AND month < ?")
+            params.extend([first_full_month[:7], last_month_start[:7]])
+            if last_month_start < until:
+                parts.append(daily)
+                params.extend([last_month_start, until])
+
+    return "\nUNION ALL\n".join(parts), params
+
+
+def rollup_window_sql(since: str, until: Optional[str] = None) -> Tuple[str, List[str]]:
+    """SQL yielding one (drug_id, total_quantity, row_count) row per drug for the window"""
+    periods_sql, params = rollup_periods_sql(since, until)
+    query = f"""
+        SELECT drug_id, SUM(total_quantity) AS total_quantity, SUM(row_count) AS row_count
+        FROM ({periods_sql})
+        GROUP BY drug_id
+    """
+    return query, params
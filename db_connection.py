@@ -0,0 +1,197 @@
+"""
+Pooled SQLite Connections
+Thread-safe pools of tuned read-only and read-write connections, shared by
+every helper that used to open and close its own handle per call.
+"""
+
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+from urllib.parse import quote
+
+from db_migrations import ensure_schema
+from query_profiler import ProfiledConnection, profiler
+
+
+class ConnectionPool:
+    """
+    Pool of tuned connections to one SQLite database file
+
+    Read-only connections are opened with mode=ro and query_only, so many
+    Streamlit sessions can read concurrently under WAL while writes go
+    through a small separate pool (one writer by default, matching SQLite's
+    single-writer model). Connections persist between uses, so their
+    prepared-statement caches are actually reused.
+    """
+
+    def __init__(self, db_path: str, max_readers: int = 8, max_writers: int = 1,
+                 timeout: float = 30.0, mmap_size: int = 256 * 1024 * 1024,
+                 cache_size_kb: int = 32 * 1024, cached_statements: int = 256,
+                 on_connect: Optional[Callable[[sqlite3.Connection], None]] = None,
+                 migrate: bool = True, factory: type = sqlite3.Connection):
+        self.db_path = db_path
+        self.timeout = timeout
+        self.mmap_size = mmap_size
+        self.cache_size_kb = cache_size_kb
+        self.cached_statements = cached_statements
+        self.on_connect = on_connect
+        self.factory = factory
+        self._idle = {True: queue.LifoQueue(), False: queue.LifoQueue()}
+        self._slots = {
+            True: threading.BoundedSemaphore(max_readers),
+            False: threading.BoundedSemaphore(max_writers)
+        }
+        self._closed = False
+
+        with self.write() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            if migrate:
+                ensure_schema(conn)
+
+    def _connect(self, readonly: bool) -> sqlite3.Connection:
+        if readonly:
+            conn = sqlite3.connect(
+                f"file:{quote(self.db_path)}?mode=ro", uri=True,
+                timeout=self.timeout, check_same_thread=False,
+                cached_statements=self.cached_statements, factory=self.factory
+            )
+            conn.execute("PRAGMA query_only = ON")
+        else:
+            conn = sqlite3.connect(
+                self.db_path, timeout=self.timeout, check_same_thread=False,
+                cached_statements=self.cached_statements, factory=self.factory
+            )
+            conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        conn.execute(f"PRAGMA cache_size = -{int(self.cache_size_kb)}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        if self.on_connect:
+            self.on_connect(conn)
+        return conn
+
+    def connect(self, readonly: bool = True) -> sqlite3.Connection:
+        """Dedicated connection with the pool's tuning, owned and closed by the caller"""
+        return self._connect(readonly)
+
+    def _acquire(self, readonly: bool) -> sqlite3.Connection:
+        if self._closed:
+            raise RuntimeError(f"Connection pool for {self.db_path} is closed")
+        if not self._slots[readonly].acquire(timeout=self.timeout):
+            kind = 'read-only' if readonly else 'read-write'
+            raise TimeoutError(f"No {kind} connection to {self.db_path} available after {self.timeout}s")
+        try:
+            return self._idle[readonly].get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            return self._connect(readonly)
+        except Exception:
+            self._slots[readonly].release()
+            raise
+
+    def _release(self, conn: sqlite3.Connection, readonly: bool) -> None:
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            if self._closed:
+                conn.close()
+            else:
+                self._idle[readonly].put(conn)
+        except sqlite3.Error:
+            # A connection that cannot roll back is not safe to hand out again
+            conn.close()
+        finally:
+            self._slots[readonly].release()
+
+    @contextmanager
+    def read(self):
+        """Borrow a read-only connection for the duration of the block"""
+        conn = self._acquire(True)
+        try:
+            yield conn
+        finally:
+            self._release(conn, True)
+
+    @contextmanager
+    def write(self):
+        """Borrow a read-write connection; commits on success, rolls back on error"""
+        conn = self._acquire(False)
+        try:
+            yield conn
+            conn.commit()
+        finally:
+            self._release(conn, False)
+
+    def close(self) -> None:
+        """Close idle connections; borrowed ones are closed when returned"""
+        self._closed = True
+        for idle in self._idle.values():
+            while True:
+                try:
+                    idle.get_nowait().close()
+                except queue.Empty:
+                    break
+
+
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def _database_path(db) -> str:
+    """File path of the main database behind db.get_connection()"""
+    conn = db.get_connection()
+    try:
+        for _, name, path in conn.execute("PRAGMA database_list"):
+            if name == 'main':
+                return path
+        return ''
+    finally:
+        conn.close()
+
+
+def get_pool(db) -> Optional[ConnectionPool]:
+    """Shared pool for the database behind db, or None for in-memory databases"""
+    pool = getattr(db, 'connection_pool', None)
+    if isinstance(pool, ConnectionPool):
+        return pool
+
+    path = _database_path(db)
+    if not path:
+        return None
+
+    with _pools_lock:
+        pool = _pools.get(path)
+        if pool is None:
+            pool = ConnectionPool(path, factory=ProfiledConnection if profiler.enabled else sqlite3.Connection)
+            _pools[path] = pool
+    try:
+        db.connection_pool = pool
+    except AttributeError:
+        pass
+    return pool
+
+
+@contextmanager
+def connection(db, readonly: bool = True):
+    """
+    Pooled connection to db's database for the duration of the block
+
+    Falls back to db.get_connection() (closed on exit) when the database
+    cannot be pooled, e.g. an in-memory database.
+    """
+    pool = get_pool(db)
+    if pool is None:
+        conn = db.get_connection()
+        try:
+            ensure_schema(conn)
+            yield conn
+            if not readonly:
+                conn.commit()
+        finally:
+            conn.close()
+        return
+
+    with (pool.read() if readonly else pool.write()) as conn:
+        yield conn
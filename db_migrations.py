@@ -0,0 +1,309 @@
+"""
+Database Migrations
+Versioned schema changes (indexes, derived structures, rollup tables) applied
+in order and recorded in schema_migrations, plus EXPLAIN QUERY PLAN checks
+that catch hot queries falling back to full table scans.
+
+Usage:
+    python db_migrations.py [db_path]                 apply pending migrations
+    python db_migrations.py [db_path] --check-plans   also fail on full table scans
+"""
+
+import hashlib
+import re
+import sqlite3
+import sys
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+from active_alerts import ACTIVE_ALERTS_SCHEMA
+from consumption_rollups import ROLLUP_SCHEMA, REBUILD_STATEMENTS
+from demand_stats import DEMAND_STATS_SCHEMA
+from expiry_calendar import CALENDAR_REBUILD_STATEMENTS, EXPIRY_CALENDAR_SCHEMA
+from forecast_store import FORECAST_SCHEMA
+from query_profiler import fingerprint
+from sku_classification import SKU_CLASS_SCHEMA
+from table_versions import (
+    TABLE_VERSION_SCHEMA, COLUMN_VERSION_SCHEMA, COLUMN_VERSION_REFRESH, FORECAST_VERSION_SCHEMA,
+)
+
+
+def split_sql_script(script: str) -> List[str]:
+    """Split a script into statements, keeping trigger bodies intact"""
+    statements = []
+    buffer = ''
+    for line in script.splitlines(keepends=True):
+        buffer += line
+        if sqlite3.complete_statement(buffer):
+            if buffer.strip():
+                statements.append(buffer.strip())
+            buffer = ''
+    if buffer.strip():
+        statements.append(buffer.strip())
+    return statements
+
+
+# Expression and partial indexes match the predicates in utils.py and
+# smart_recommendations.py verbatim; SQLite only uses them when the query
+# spells the expression the same way. The partial indexes are keyed on the
+# GROUP BY / ORDER BY columns of their query so no sort is needed either.
+INDEX_STATEMENTS = [
+    "CREATE INDEX IF NOT EXISTS idx_consumption_patterns_drug_date ON consumption_patterns (drug_id, date, quantity_consumed)",
+    "CREATE INDEX IF NOT EXISTS idx_consumption_patterns_date ON consumption_patterns (date)",
+    "CREATE INDEX IF NOT EXISTS idx_inventory_expiry_date ON inventory (expiry_date)",
+    "CREATE INDEX IF NOT EXISTS idx_inventory_stock_levels ON inventory (current_stock, minimum_stock)",
+    "CREATE INDEX IF NOT EXISTS idx_inventory_stock_shortfall ON inventory (minimum_stock - current_stock)",
+    "CREATE INDEX IF NOT EXISTS idx_inventory_drug_name ON inventory (drug_name)",
+    """
+    CREATE INDEX IF NOT EXISTS idx_inventory_below_minimum
+    ON inventory (drug_name, category, current_stock, minimum_stock, unit_price)
+    WHERE minimum_stock - current_stock > 0
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_inventory_overstock
+    ON inventory (drug_name, category, current_stock, minimum_stock, unit_price)
+    WHERE current_stock - minimum_stock * 3 > 0
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_inventory_in_stock
+    ON inventory (drug_name, category, current_stock, unit_price)
+    WHERE current_stock > 0
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_transactions_drug_created ON transactions (drug_id, created_at)",
+    """
+    CREATE INDEX IF NOT EXISTS idx_suppliers_underperforming
+    ON suppliers ((reliability_score + quality_score) / 2)
+    WHERE reliability_score < 3.5 OR quality_score < 3.5 OR lead_time_days > 10
+    """,
+]
+
+# (version, description, statements) - append only, never edit an applied entry
+MIGRATIONS = [
+    (1, 'Indexes for hot inventory, consumption, transaction and supplier predicates',
+     INDEX_STATEMENTS),
+    (2, 'Daily and monthly consumption rollups',
+     split_sql_script(ROLLUP_SCHEMA) + list(REBUILD_STATEMENTS)),
+    (3, 'Per-table change counters for cache invalidation',
+     split_sql_script(TABLE_VERSION_SCHEMA)),
+    (4, 'Row and per-column change counters for dependency tracking',
+     split_sql_script(COLUMN_VERSION_SCHEMA)),
+    (5, 'Catalog-wide demand forecasts and forecast run log',
+     split_sql_script(FORECAST_SCHEMA)),
+    (6, 'Change counters for forecast runs',
+     split_sql_script(FORECAST_VERSION_SCHEMA)),
+    (7, 'Per-SKU demand statistics feature store',
+     split_sql_script(DEMAND_STATS_SCHEMA)),
+    (8, 'Track pack size and supplier changes for replenishment sizing',
+     split_sql_script(COLUMN_VERSION_REFRESH)),
+    (9, 'Stored ABC-XYZ class per SKU',
+     split_sql_script(SKU_CLASS_SCHEMA)),
+    (10, 'Integer expiry days and expiry calendar',
+     split_sql_script(EXPIRY_CALENDAR_SCHEMA) + list(CALENDAR_REBUILD_STATEMENTS)),
+    (11, 'Active alerts maintained from write events',
+     split_sql_script(ACTIVE_ALERTS_SCHEMA)),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+# Hot queries that visit every SKU on purpose (catalog-wide aggregates driven
+# by inventory with indexed lookups underneath), by query_key. Editing one of
+# these queries changes its key, so the plan check flags it for review again.
+FULL_SCAN_ALLOWLIST = {
+    'c62bd4821c25': 'utils.get_alert_snapshot: reorder terms of every consuming SKU',
+    'd17ad1d256b9': 'utils._evaluate_alert_rules: every SKU on a full active-alert refresh',
+    '0af0e6113e44': 'utils._alert_windows: every SKU\'s 30-day rollup on a full active-alert refresh',
+    '85bee71ba3c0': 'consumption_matrix.load_consumption_matrix: the matrix has one row per SKU',
+    '704a41ab8be4': 'SmartRecommendationEngine._analyze_high_demand_items: 30-day demand of every SKU',
+}
+
+# Bookkeeping tables that are never part of a hot query, or that hold one
+# state row (per window) or just the SKUs written since the last refresh
+PLAN_EXEMPT_TABLES = {'schema_migrations', 'table_versions', 'active_alert_state', 'alert_dirty',
+                      'demand_stats_state'}
+
+
+def get_schema_version(conn) -> int:
+    """Highest applied migration version, 0 for an unmigrated database"""
+    try:
+        version = conn.execute("SELECT MAX(version) FROM schema_migrations").fetchone()[0]
+    except sqlite3.OperationalError:
+        return 0
+    return version or 0
+
+
+def apply_migrations(conn) -> List[int]:
+    """Apply pending migrations in order, one transaction each; returns the versions applied"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TEXT NOT NULL
+        )
+    """)
+    conn.commit()
+
+    applied = []
+    for version, description, statements in MIGRATIONS:
+        if version <= get_schema_version(conn):
+            continue
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Another process may have applied it while we waited for the write lock
+            if version <= get_schema_version(conn):
+                conn.rollback()
+                continue
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(
+                "INSERT INTO schema_migrations (version, description, applied_at) VALUES (?, ?, ?)",
+                (version, description, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(version)
+
+    if applied:
+        conn.execute("PRAGMA optimize")
+    return applied
+
+
+def ensure_schema(conn) -> None:
+    """Bring the database up to LATEST_VERSION; a single lookup when already current"""
+    if get_schema_version(conn) < LATEST_VERSION:
+        apply_migrations(conn)
+
+
+_SQL_KEYWORDS = {
+    'WHERE', 'JOIN', 'LEFT', 'INNER', 'CROSS', 'OUTER', 'ON', 'USING', 'GROUP',
+    'ORDER', 'HAVING', 'LIMIT', 'UNION', 'AS', 'NATURAL'
+}
+
+
+def _table_aliases(sql: str) -> Dict[str, str]:
+    """Map every name a base table goes by in the query (alias or bare) to the table"""
+    aliases = {}
+    for table, alias in re.findall(r'\b(?:FROM|JOIN)\s+([A-Za-z_]\w*)(?:\s+(?:AS\s+)?([A-Za-z_]\w*))?', sql, re.IGNORECASE):
+        aliases[table] = table
+        if alias and alias.upper() not in _SQL_KEYWORDS:
+            aliases[alias] = table
+    return aliases
+
+
+def explain_query_plan(conn, sql: str, params=()) -> List[str]:
+    """Detail lines of EXPLAIN QUERY PLAN for one statement"""
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+
+def query_key(sql: str) -> str:
+    """Short stable id of a query: a hash of its fingerprint, literals and IN-list lengths aside"""
+    return hashlib.sha1(fingerprint(sql).encode()).hexdigest()[:12]
+
+
+def find_full_scans(conn, sql: str, params=()) -> List[str]:
+    """
+    Plan lines where a base table is scanned rather than searched
+
+    Scanning a partial index only visits the rows its WHERE clause admits, so
+    that is not reported, and neither are the queries in FULL_SCAN_ALLOWLIST.
+    """
+    if query_key(sql) in FULL_SCAN_ALLOWLIST:
+        return []
+
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    aliases = _table_aliases(sql)
+    scans = []
+    for detail in explain_query_plan(conn, sql, params):
+        match = re.match(r'SCAN (\w+)(?: USING (?:COVERING )?INDEX (\w+))?', detail)
+        if not match:
+            continue
+        table = aliases.get(match.group(1))
+        if table not in tables or table.startswith('sqlite_') or table in PLAN_EXEMPT_TABLES:
+            continue
+        index = match.group(2)
+        if index and _is_partial_index(conn, table, index):
+            continue
+        scans.append(detail)
+    return scans
+
+
+def _is_partial_index(conn, table: str, index: str) -> bool:
+    return any(row[1] == index and row[4] for row in conn.execute(f"PRAGMA index_list({table})"))
+
+
+def collect_hot_queries(db_path: str) -> List[str]:
+    """Run every query in utils.py and smart_recommendations.py and capture the executed SQL"""
+    import utils
+    from db_connection import ConnectionPool
+    from smart_recommendations import SmartRecommendationEngine
+
+    captured = []
+
+    class _TracingDatabase:
+        connection_pool = ConnectionPool(
+            db_path, on_connect=lambda conn: conn.set_trace_callback(captured.append)
+        )
+
+        def get_connection(self):
+            return sqlite3.connect(db_path)
+
+    db = _TracingDatabase()
+    conn = db.get_connection()
+    sample = conn.execute("SELECT drug_name FROM inventory LIMIT 1").fetchone()
+    conn.close()
+
+    utils.get_alert_snapshot(db)
+    utils.get_low_stock_items(db)
+    utils.get_expiring_items(db)
+    utils.get_high_value_expiring_items(db)
+    utils.detect_consumption_anomalies(db)
+    utils.get_reorder_alerts(db)
+    utils.generate_alerts(db)
+    utils.calculate_inventory_turnover(db)
+    if sample:
+        utils.calculate_inventory_turnover(db, sample[0])
+    SmartRecommendationEngine(db).get_personalized_recommendations()
+    db.connection_pool.close()
+
+    return [sql for sql in captured if sql.lstrip().upper().startswith(('SELECT', 'WITH'))]
+
+
+def check_query_plans(db_path: str) -> Tuple[int, List[Tuple[str, List[str]]]]:
+    """
+    (queries checked, [(query, full-scan plan lines)]) over every hot query,
+    the second listing those that do not use an index
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        ensure_schema(conn)
+        queries = collect_hot_queries(db_path)
+        problems = []
+        for sql in queries:
+            scans = find_full_scans(conn, sql)
+            if scans:
+                problems.append((sql, scans))
+        return len(queries), problems
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    db_path = args[0] if args else "pharma_inventory.db"
+
+    conn = sqlite3.connect(db_path)
+    applied = apply_migrations(conn)
+    print(f"Schema version {get_schema_version(conn)} (applied: {applied or 'none'})")
+    conn.close()
+
+    if '--check-plans' in sys.argv:
+        checked, problems = check_query_plans(db_path)
+        for sql, scans in problems:
+            print(f"\nFull table scan (query_key {query_key(sql)}):")
+            print(re.sub(r'\s+', ' ', sql).strip())
+            for detail in scans:
+                print(f"  -> {detail}")
+        print(f"\n{checked} queries checked, {len(problems)} fall back to a full table scan")
+        sys.exit(1 if problems else 0)
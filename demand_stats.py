@@ -0,0 +1,287 @@
+"""
+Demand Statistics
+Feature store of per-SKU daily demand statistics over trailing windows: mean,
+standard deviation, percentiles, share of zero-demand days and the
+day-of-week profile, computed over calendar days (days without consumption
+count as zero) up to but excluding the as-of day.
+
+refresh_demand_stats() keeps the store current. It rebuilds every SKU once a
+day, when the windows slide, and within a day it only recomputes the SKUs
+whose consumption in the window changed. A call with nothing to do is a
+few small lookups.
+"""
+
+import math
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional, Sequence
+
+import numpy as np
+
+from consumption_matrix import load_consumption_matrix
+from consumption_rollups import days_ago
+from table_versions import read_table_versions
+
+DEFAULT_WINDOWS = (30, 90, 365)
+PERCENTILES = (50, 90, 95, 99)
+WEEKDAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+# SKUs per block when computing percentiles, bounding the sort buffer
+CHUNK_SKUS = 8192
+
+STAT_COLUMNS = (('mean', 'std') + tuple(f'p{q}' for q in PERCENTILES) + ('zero_fraction',)
+                + tuple(f'dow_{day}' for day in WEEKDAYS))
+# Fingerprint of a SKU's window, compared to find changed SKUs
+SIGNATURE_COLUMNS = ('total', 'active_days', 'sum_squares')
+# SQLite and NumPy add fractional quantities in different orders, so float
+# signatures within this tolerance count as unchanged
+SIGNATURE_TOLERANCE = 1e-9
+
+DEMAND_STATS_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS demand_stats (
+    window_days INTEGER NOT NULL,
+    drug_id INTEGER NOT NULL,
+{''.join(f'    {column} REAL NOT NULL,{chr(10)}' for column in STAT_COLUMNS + SIGNATURE_COLUMNS)}    PRIMARY KEY (window_days, drug_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS demand_stats_state (
+    window_days INTEGER PRIMARY KEY,
+    as_of TEXT NOT NULL,
+    consumption_version INTEGER,
+    consumption_rows_version INTEGER,
+    consumption_columns_version INTEGER,
+    consumption_max_id INTEGER,
+    inventory_version INTEGER,
+    sku_count INTEGER NOT NULL,
+    refreshed_at TEXT NOT NULL
+);
+"""
+
+STATE_MARKS = ('consumption_version', 'consumption_rows_version', 'consumption_columns_version',
+               'consumption_max_id', 'inventory_version')
+
+
+def compute_demand_stats(matrix: np.ndarray, start_day: str) -> Dict[str, np.ndarray]:
+    """
+    STAT_COLUMNS and SIGNATURE_COLUMNS per row of a SKU x day matrix whose
+    first column is start_day
+
+    The std is the sample standard deviation (0 with one day). dow_* is the
+    mean demand on that weekday divided by the overall mean, 1.0 for SKUs
+    without demand.
+    """
+    n, days = matrix.shape
+    stats = {column: np.zeros(n) for column in STAT_COLUMNS + SIGNATURE_COLUMNS}
+    # 1970-01-01 was a Thursday; weekday 0 is Monday
+    weekday = (np.datetime64(start_day, 'D').astype(np.int64) + np.arange(days) + 3) % 7
+
+    for start in range(0, n, CHUNK_SKUS):
+        block = slice(start, min(start + CHUNK_SKUS, n))
+        values = matrix[block]
+        mean = values.mean(axis=1)
+        stats['mean'][block] = mean
+        stats['std'][block] = values.std(axis=1, ddof=1) if days > 1 else 0.0
+        for q, percentile in zip(PERCENTILES, np.percentile(values, PERCENTILES, axis=1)):
+            stats[f'p{q}'][block] = percentile
+        stats['zero_fraction'][block] = (values == 0).mean(axis=1)
+        for index, day in enumerate(WEEKDAYS):
+            on_day = values[:, weekday == index]
+            day_mean = on_day.mean(axis=1) if on_day.shape[1] else mean
+            with np.errstate(divide='ignore', invalid='ignore'):
+                stats[f'dow_{day}'][block] = np.where(mean > 0, day_mean / mean, 1.0)
+        stats['total'][block] = values.sum(axis=1)
+        stats['active_days'][block] = (values != 0).sum(axis=1)
+        stats['sum_squares'][block] = (values * values).sum(axis=1)
+    return stats
+
+
+def _write_stats(conn, window_days: int, drug_ids: np.ndarray, stats: Dict[str, np.ndarray]) -> None:
+    columns = ('window_days', 'drug_id') + STAT_COLUMNS + SIGNATURE_COLUMNS
+    conn.executemany(
+        f"INSERT OR REPLACE INTO demand_stats ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+        zip([window_days] * len(drug_ids), drug_ids.tolist(),
+            *(stats[column].tolist() for column in STAT_COLUMNS + SIGNATURE_COLUMNS))
+    )
+
+
+def _state_marks(conn) -> Dict[str, int]:
+    """Change counters and the newest consumption row id, to compare with a stored state"""
+    versions = read_table_versions(conn)
+    return {
+        'consumption_version': versions.get('consumption_patterns'),
+        'consumption_rows_version': versions.get('consumption_patterns:rows'),
+        'consumption_columns_version': sum(versions.get(f'consumption_patterns.{column}', 0)
+                                           for column in ('drug_id', 'date', 'quantity_consumed')),
+        'consumption_max_id': conn.execute("SELECT MAX(id) FROM consumption_patterns").fetchone()[0] or 0,
+        'inventory_version': versions.get('inventory:rows'),
+    }
+
+
+def _inserted_skus(conn, state: Dict[str, int], marks: Dict[str, int],
+                   start: str, end: str) -> Optional[np.ndarray]:
+    """
+    SKUs with consumption rows inserted into [start, end) since the state was
+    stored, or None when rows were also updated or deleted
+
+    New rows have ids above the stored maximum. When the rows counter moved
+    by exactly the number of such rows and no tracked column was updated,
+    inserts were the only writes.
+    """
+    if marks['consumption_columns_version'] != state['consumption_columns_version']:
+        return None
+    inserted = conn.execute("SELECT COUNT(*) FROM consumption_patterns WHERE id > ?",
+                            (state['consumption_max_id'],)).fetchone()[0]
+    if marks['consumption_rows_version'] - state['consumption_rows_version'] != inserted:
+        return None
+    return np.array([row[0] for row in conn.execute("""
+        SELECT DISTINCT drug_id FROM consumption_patterns
+        WHERE id > ? AND drug_id IS NOT NULL AND date(date) >= ? AND date(date) < ?
+    """, (state['consumption_max_id'], start, end))], dtype=np.int64)
+
+
+def _same_signature(current: tuple, stored: tuple) -> bool:
+    (total, active_days, sum_squares), (stored_total, stored_days, stored_squares) = current, stored
+    return (active_days == stored_days
+            and math.isclose(total, stored_total, rel_tol=SIGNATURE_TOLERANCE, abs_tol=SIGNATURE_TOLERANCE)
+            and math.isclose(sum_squares, stored_squares, rel_tol=SIGNATURE_TOLERANCE,
+                             abs_tol=SIGNATURE_TOLERANCE))
+
+
+def _changed_skus(conn, window_days: int, start: str, end: str) -> np.ndarray:
+    """
+    SKUs whose window signature differs from the stored one: a different
+    number of active days, or a total or sum of squares off by more than
+    SIGNATURE_TOLERANCE (relative or absolute)
+    """
+    current = {
+        drug_id: (total, active_days, sum_squares)
+        for drug_id, total, active_days, sum_squares in conn.execute("""
+            SELECT drug_id, TOTAL(total_quantity), COUNT(*), TOTAL(total_quantity * total_quantity)
+            FROM consumption_daily_rollup
+            WHERE day >= ? AND day < ? AND total_quantity != 0
+            GROUP BY drug_id
+        """, (start, end))
+    }
+    changed = [
+        drug_id
+        for drug_id, total, active_days, sum_squares in conn.execute("""
+            SELECT drug_id, total, active_days, sum_squares FROM demand_stats WHERE window_days = ?
+        """, (window_days,))
+        if not _same_signature(current.get(drug_id, (0.0, 0, 0.0)), (total, active_days, sum_squares))
+    ]
+    return np.array(changed, dtype=np.int64)
+
+
+def _new_skus(conn, window_days: int) -> np.ndarray:
+    """Inventory SKUs without stored statistics"""
+    return np.array([row[0] for row in conn.execute("""
+        SELECT id FROM inventory
+        WHERE NOT EXISTS (SELECT 1 FROM demand_stats WHERE window_days = ? AND drug_id = inventory.id)
+    """, (window_days,))], dtype=np.int64)
+
+
+def _stored_states(conn) -> Dict[int, Dict[str, Any]]:
+    """The as_of and STATE_MARKS each window was last refreshed at, by window"""
+    return {
+        row[0]: dict(zip(('as_of',) + STATE_MARKS, row[1:]))
+        for row in conn.execute(f"SELECT window_days, as_of, {', '.join(STATE_MARKS)} FROM demand_stats_state")
+    }
+
+
+def demand_stats_current(conn, windows: Sequence[int] = DEFAULT_WINDOWS, as_of: Optional[str] = None) -> bool:
+    """
+    Whether refresh_demand_stats would find nothing to do, from a few small
+    reads, so callers can skip taking a write connection
+    """
+    marks = dict(_state_marks(conn), as_of=as_of or days_ago(0))
+    states = _stored_states(conn)
+    return all(states.get(window) == marks for window in windows)
+
+
+def refresh_demand_stats(conn, windows: Sequence[int] = DEFAULT_WINDOWS,
+                         as_of: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Bring the stored statistics up to date for as_of (default today)
+
+    A new as_of rebuilds every SKU. Otherwise only SKUs whose consumption
+    inside the windows changed are recomputed: found from the ids of newly
+    inserted rows when inserts were the only writes, else by comparing each
+    SKU's window signature with the rollup. Run it inside one write
+    transaction (connection(db, readonly=False)). Returns {'mode': 'current'
+    | 'full' | 'incremental', 'skus': SKUs recomputed}.
+    """
+    as_of = as_of or days_ago(0)
+    windows = sorted(set(windows))
+    marks = _state_marks(conn)
+    states = _stored_states(conn)
+
+    current = [states.get(window) for window in windows]
+    if all(state == dict(marks, as_of=as_of) for state in current):
+        return {'mode': 'current', 'skus': 0}
+
+    longest = windows[-1]
+    full = any(state is None or state['as_of'] != as_of for state in current)
+    if full:
+        history = load_consumption_matrix(conn, longest, as_of)
+        conn.execute(f"DELETE FROM demand_stats WHERE window_days IN ({', '.join('?' * len(windows))})",
+                     windows)
+    else:
+        # Same day, so only edits inside the windows or inventory changes matter;
+        # every window ends on as_of, so the longest one sees all such edits
+        state = current[-1]
+        start = (np.datetime64(as_of, 'D') - longest).astype(str)
+        changed = np.empty(0, dtype=np.int64)
+        if marks['consumption_version'] != state['consumption_version']:
+            changed = _inserted_skus(conn, state, marks, start, as_of)
+            if changed is None:
+                changed = _changed_skus(conn, longest, start, as_of)
+        if marks['inventory_version'] != state['inventory_version']:
+            conn.execute(f"""
+                DELETE FROM demand_stats
+                WHERE window_days IN ({', '.join('?' * len(windows))})
+                  AND NOT EXISTS (SELECT 1 FROM inventory WHERE id = demand_stats.drug_id)
+            """, windows)
+            changed = np.union1d(changed, _new_skus(conn, longest))
+        # Consumption of SKUs no longer (or not yet) in inventory is not tracked
+        history = load_consumption_matrix(conn, longest, as_of, drug_ids=changed)
+        known = np.isin(history['drug_ids'], _inventory_ids(conn, history['drug_ids']))
+        history = dict(history, drug_ids=history['drug_ids'][known], matrix=history['matrix'][known])
+
+    drug_ids = history['drug_ids']
+    for window in windows:
+        matrix = history['matrix'][:, longest - window:]
+        start = (np.datetime64(as_of, 'D') - window).astype(str)
+        _write_stats(conn, window, drug_ids, compute_demand_stats(matrix, start))
+
+    sku_count = conn.execute("SELECT COUNT(*) FROM demand_stats WHERE window_days = ?", (longest,)).fetchone()[0]
+    refreshed_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    conn.executemany(f"""
+        INSERT OR REPLACE INTO demand_stats_state
+            (window_days, as_of, {', '.join(STATE_MARKS)}, sku_count, refreshed_at)
+        VALUES (?, ?, {', '.join('?' * len(STATE_MARKS))}, ?, ?)
+    """, [(window, as_of, *(marks[mark] for mark in STATE_MARKS), sku_count, refreshed_at)
+          for window in windows])
+    return {'mode': 'full' if full else 'incremental', 'skus': len(drug_ids)}
+
+
+def _inventory_ids(conn, drug_ids: np.ndarray) -> np.ndarray:
+    """The subset of drug_ids present in inventory"""
+    if not len(drug_ids):
+        return drug_ids
+    return np.array([row[0] for row in conn.execute(
+        f"SELECT id FROM inventory WHERE id IN ({', '.join('?' * len(drug_ids))})", drug_ids.tolist()
+    )], dtype=np.int64)
+
+
+def load_demand_stats(conn, window_days: int, columns: Iterable[str] = STAT_COLUMNS) -> Dict[str, np.ndarray]:
+    """Stored statistics for one window as arrays aligned on 'drug_ids' (ascending)"""
+    columns = tuple(columns)
+    unknown = set(columns) - set(STAT_COLUMNS + SIGNATURE_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown demand statistics: {sorted(unknown)}")
+    rows = conn.execute(
+        f"SELECT drug_id, {', '.join(columns)} FROM demand_stats WHERE window_days = ? ORDER BY drug_id",
+        (window_days,)
+    ).fetchall()
+    data = np.array(rows, dtype=np.float64).reshape(len(rows), len(columns) + 1)
+    result = {'drug_ids': data[:, 0].astype(np.int64)}
+    result.update({column: data[:, index + 1] for index, column in enumerate(columns)})
+    return result
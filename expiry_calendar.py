@@ -0,0 +1,161 @@
+"""
+Expiry Calendar
+Integer expiry days and a precomputed calendar of stock value by week and
+month of expiry.
+
+inventory.expiry_day holds expiry_date as days since 1970-01-01, set by
+triggers whenever a row is inserted or its expiry_date changes, and indexed
+together with current_stock and unit_price. "What expires in the next N
+days and what is it worth" is then a covering index range read on plain
+integers instead of julianday() arithmetic on every row's TEXT date.
+
+expiry_calendar keeps, per week (starting Monday) and per month of expiry,
+the number of stocked items, their units and their stock value. Triggers on
+inventory keep it current, so the dashboard's expiry timeline reads a few
+dozen rows whatever the catalog size.
+"""
+
+from datetime import date, datetime, timedelta, timezone
+from typing import List, Tuple
+
+PERIODS = ('week', 'month')
+
+EPOCH = date(1970, 1, 1)
+
+# Days since 1970-01-01 of a 'YYYY-MM-DD' date (NULL when it does not parse)
+_EPOCH_DAY = "CAST(julianday({date}) - 2440587.5 AS INTEGER)"
+# 1970-01-01 was a Thursday, so (day + 3) % 7 counts days since Monday
+_WEEK_START = "(" + _EPOCH_DAY + " - (" + _EPOCH_DAY + " + 3) % 7)"
+_MONTH_START = "CAST(julianday({date}, 'start of month') - 2440587.5 AS INTEGER)"
+
+
+def _calendar_add(row: str) -> str:
+    """Statements adding one inventory row (NEW or OLD) to its week and month"""
+    condition = f"{row}.current_stock > 0 AND julianday({row}.expiry_date) IS NOT NULL"
+    value = f"{row}.current_stock * COALESCE({row}.unit_price, 0)"
+    return ''.join(f"""
+    INSERT INTO expiry_calendar (period, bucket_day, item_count, units, stock_value)
+    SELECT '{period}', {start.format(date=f'{row}.expiry_date')}, 1, {row}.current_stock, {value}
+    WHERE {condition}
+    ON CONFLICT (period, bucket_day) DO UPDATE SET
+        item_count = item_count + 1,
+        units = units + excluded.units,
+        stock_value = stock_value + excluded.stock_value;""" for period, start in zip(PERIODS, (_WEEK_START, _MONTH_START)))
+
+
+def _calendar_remove(row: str) -> str:
+    """Statements taking one inventory row back out of its week and month"""
+    condition = f"{row}.current_stock > 0 AND julianday({row}.expiry_date) IS NOT NULL"
+    value = f"{row}.current_stock * COALESCE({row}.unit_price, 0)"
+    statements = []
+    for period, start in zip(PERIODS, (_WEEK_START, _MONTH_START)):
+        bucket = f"period = '{period}' AND bucket_day = {start.format(date=f'{row}.expiry_date')}"
+        statements.append(f"""
+    UPDATE expiry_calendar
+    SET item_count = item_count - 1, units = units - {row}.current_stock, stock_value = stock_value - {value}
+    WHERE {condition} AND {bucket};
+    DELETE FROM expiry_calendar WHERE {bucket} AND item_count <= 0;""")
+    return ''.join(statements)
+
+
+# The calendar triggers work from expiry_date rather than expiry_day, so they
+# do not depend on the order in which SQLite fires them and the expiry_day
+# triggers on the same table.
+EXPIRY_CALENDAR_SCHEMA = f"""
+ALTER TABLE inventory ADD COLUMN expiry_day INTEGER;
+
+UPDATE inventory SET expiry_day = {_EPOCH_DAY.format(date='expiry_date')};
+
+CREATE INDEX IF NOT EXISTS idx_inventory_expiry_day
+    ON inventory (expiry_day, current_stock, unit_price);
+
+CREATE TRIGGER IF NOT EXISTS trg_inventory_expiry_day_insert
+AFTER INSERT ON inventory
+BEGIN
+    UPDATE inventory SET expiry_day = {_EPOCH_DAY.format(date='NEW.expiry_date')} WHERE id = NEW.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_inventory_expiry_day_update
+AFTER UPDATE OF expiry_date ON inventory
+BEGIN
+    UPDATE inventory SET expiry_day = {_EPOCH_DAY.format(date='NEW.expiry_date')} WHERE id = NEW.id;
+END;
+
+CREATE TABLE IF NOT EXISTS expiry_calendar (
+    period TEXT NOT NULL,
+    bucket_day INTEGER NOT NULL,
+    item_count INTEGER NOT NULL DEFAULT 0,
+    units INTEGER NOT NULL DEFAULT 0,
+    stock_value REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (period, bucket_day)
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS trg_expiry_calendar_insert
+AFTER INSERT ON inventory
+BEGIN{_calendar_add('NEW')}
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_expiry_calendar_delete
+AFTER DELETE ON inventory
+BEGIN{_calendar_remove('OLD')}
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_expiry_calendar_update
+AFTER UPDATE OF expiry_date, current_stock, unit_price ON inventory
+BEGIN{_calendar_remove('OLD')}{_calendar_add('NEW')}
+END;
+"""
+
+CALENDAR_REBUILD_STATEMENTS = ("DELETE FROM expiry_calendar",) + tuple(
+    f"""
+    INSERT INTO expiry_calendar (period, bucket_day, item_count, units, stock_value)
+    SELECT '{period}', {start.format(date='expiry_date')}, COUNT(*), SUM(current_stock),
+           SUM(current_stock * COALESCE(unit_price, 0))
+    FROM inventory
+    WHERE current_stock > 0 AND julianday(expiry_date) IS NOT NULL
+    GROUP BY 2
+    """
+    for period, start in zip(PERIODS, (_WEEK_START, _MONTH_START))
+)
+
+
+def rebuild_expiry_calendar(conn) -> None:
+    """Recompute expiry_calendar from inventory"""
+    with conn:
+        for statement in CALENDAR_REBUILD_STATEMENTS:
+            conn.execute(statement)
+
+
+def epoch_day(days_from_now: int = 0) -> int:
+    """expiry_day value of date('now', '+N days') (UTC)"""
+    return (datetime.now(timezone.utc).date() - EPOCH).days + days_from_now
+
+
+def epoch_day_to_date(day: int) -> str:
+    """'YYYY-MM-DD' of an expiry_day or bucket_day value"""
+    return (EPOCH + timedelta(days=int(day))).isoformat()
+
+
+def calendar_bucket_range(period: str, days: int) -> Tuple[int, int]:
+    """bucket_day bounds of the calendar rows covering today through today + days"""
+    if period not in PERIODS:
+        raise ValueError(f"period must be one of {PERIODS}, got {period!r}")
+    today = epoch_day()
+    if period == 'week':
+        return today - (today + 3) % 7, today + days
+    first = date.fromisoformat(epoch_day_to_date(today)).replace(day=1)
+    return (first - EPOCH).days, today + days
+
+
+def calendar_rows(conn, period: str = 'week', days: int = 365) -> List[Tuple[int, int, int, float]]:
+    """(bucket_day, item_count, units, stock_value) for the buckets from this one through today + days"""
+    low, high = calendar_bucket_range(period, days)
+    return conn.execute(
+        """
+        SELECT bucket_day, item_count, units, stock_value
+        FROM expiry_calendar
+        WHERE period = ? AND bucket_day BETWEEN ? AND ?
+        ORDER BY bucket_day
+        """,
+        (period, low, high)
+    ).fetchall()
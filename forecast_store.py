@@ -0,0 +1,101 @@
+"""
+Forecast Store
+Tables holding the latest demand forecast: one row per SKU and forecast day
+with its prediction interval, plus a log of forecast runs. Any forecaster
+that produces per-SKU daily forecasts writes here; reorder sizing and the
+stock recommendations read forecast demand back with a primary-key range
+per SKU and fall back to recent consumption for SKUs without a forecast.
+"""
+
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+FORECAST_SCHEMA = """
+CREATE TABLE IF NOT EXISTS forecast_runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at TEXT NOT NULL,
+    history_start TEXT NOT NULL,
+    history_end TEXT NOT NULL,
+    horizon_days INTEGER NOT NULL,
+    interval_level REAL NOT NULL,
+    sku_count INTEGER NOT NULL,
+    elapsed_ms REAL
+);
+
+CREATE TABLE IF NOT EXISTS demand_forecasts (
+    drug_id INTEGER NOT NULL,
+    day TEXT NOT NULL,
+    run_id INTEGER NOT NULL,
+    method TEXT NOT NULL,
+    forecast REAL NOT NULL,
+    lower_bound REAL NOT NULL,
+    upper_bound REAL NOT NULL,
+    PRIMARY KEY (drug_id, day)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_demand_forecasts_day ON demand_forecasts (day, drug_id);
+"""
+
+
+def save_forecast_run(conn, run: Dict[str, Any], rows: Iterable[Tuple],
+                      drug_ids: Optional[Sequence[int]] = None) -> int:
+    """
+    Replace the stored forecasts with rows from a new run; returns its run_id
+
+    rows are (drug_id, day, method, forecast, lower_bound, upper_bound). With
+    drug_ids only those SKUs' forecasts are replaced, so a forecaster that
+    covers part of the catalog leaves the rest in place. Run it inside one
+    write transaction (connection(db, readonly=False)) so readers see either
+    the old or the new forecast, never a mix.
+    """
+    cursor = conn.execute("""
+        INSERT INTO forecast_runs (created_at, history_start, history_end, horizon_days,
+                                   interval_level, sku_count, elapsed_ms)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (
+        datetime.now().strftime("%Y-%m-%d %H:%M:%S"), run['history_start'], run['history_end'],
+        run['horizon_days'], run['interval_level'], run['sku_count'], run.get('elapsed_ms')
+    ))
+    run_id = cursor.lastrowid
+    if drug_ids is None:
+        conn.execute("DELETE FROM demand_forecasts")
+    else:
+        conn.executemany("DELETE FROM demand_forecasts WHERE drug_id = ?",
+                         ((int(drug_id),) for drug_id in drug_ids))
+    conn.executemany("""
+        INSERT INTO demand_forecasts (drug_id, day, run_id, method, forecast, lower_bound, upper_bound)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, ((drug_id, day, run_id, method, forecast, lower, upper)
+          for drug_id, day, method, forecast, lower, upper in rows))
+    return run_id
+
+
+def forecast_daily_demand_sql(drug_id_column: str, since: str, days: int) -> Tuple[str, List[str]]:
+    """
+    Scalar subquery for the stored forecast's average daily demand of the
+    SKU in drug_id_column over since <= day < since + days
+
+    One primary-key range per SKU. Days the forecast does not reach are
+    left out of the average; NULL when the SKU has no forecast in the window.
+    """
+    until = (date.fromisoformat(since) + timedelta(days=days)).isoformat()
+    expression = f"""(
+        SELECT AVG(forecast) FROM demand_forecasts
+        WHERE drug_id = {drug_id_column} AND day >= ? AND day < ?
+    )"""
+    return expression, [since, until]
+
+
+def get_forecast_demand(conn, drug_ids: Iterable[int], since: str,
+                        days: int = 30) -> Dict[int, Tuple[float, float]]:
+    """Map drug_id -> (daily forecast, daily upper bound) averaged over the window, for forecast SKUs only"""
+    until = (date.fromisoformat(since) + timedelta(days=days)).isoformat()
+    demand = {}
+    for drug_id in drug_ids:
+        forecast, upper = conn.execute("""
+            SELECT AVG(forecast), AVG(upper_bound) FROM demand_forecasts
+            WHERE drug_id = ? AND day >= ? AND day < ?
+        """, (drug_id, since, until)).fetchone()
+        if forecast is not None:
+            demand[drug_id] = (forecast, upper)
+    return demand
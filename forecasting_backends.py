@@ -0,0 +1,95 @@
+"""
+Forecasting Backends
+Registry of forecasting backends. A backend is registered by name with a
+'module:attribute' target and is imported the first time it is used, so the
+dashboard process only loads TensorFlow, scikit-learn and the rest of the ML
+stack when someone actually trains with them. The default 'statistical'
+backend needs nothing beyond NumPy.
+
+A backend is a callable backend(db, params, report) returning a results
+dict, or None when there is too little data; report(fraction, message)
+publishes progress. LSTM-style results carry mae, rmse, mape and
+future_pred; regression results carry one entry per model plus best_model.
+"""
+
+import importlib
+import threading
+from typing import Any, Callable, Dict, List, Optional, Union
+
+DEFAULT_BACKEND = 'statistical'
+
+
+class _Backend:
+    __slots__ = ('name', 'target', 'description', 'callable')
+
+    def __init__(self, name: str, target: Union[str, Callable], description: str):
+        self.name = name
+        self.target = target
+        self.description = description
+        self.callable = target if callable(target) else None
+
+
+_backends: Dict[str, _Backend] = {}
+_backends_lock = threading.Lock()
+
+
+def register_backend(name: str, target: Union[str, Callable], description: str = '') -> None:
+    """Register (or replace) a backend; a 'module:attribute' target is not imported until used"""
+    if isinstance(target, str) and ':' not in target:
+        raise ValueError(f"Backend target must be 'module:attribute', got {target!r}")
+    with _backends_lock:
+        _backends[name] = _Backend(name, target, description)
+
+
+def get_backend(name: Optional[str] = None) -> Callable[..., Optional[Dict[str, Any]]]:
+    """The backend's callable, importing its module on first use"""
+    name = name or DEFAULT_BACKEND
+    with _backends_lock:
+        backend = _backends.get(name)
+    if backend is None:
+        raise KeyError(f"Unknown forecasting backend: {name}")
+    if backend.callable is not None:
+        return backend.callable
+
+    # Import outside the lock: a slow import (TensorFlow for 'lstm') must not
+    # hold up callers of other backends. Python's import lock already keeps
+    # concurrent first uses of one module from importing it twice.
+    module, attribute = backend.target.split(':', 1)
+    resolved = getattr(importlib.import_module(module), attribute)
+    with _backends_lock:
+        if backend.callable is None:
+            backend.callable = resolved
+        return backend.callable
+
+
+def available_backends() -> Dict[str, str]:
+    """Registered backend names and descriptions, without importing any of them"""
+    with _backends_lock:
+        return {name: backend.description for name, backend in _backends.items()}
+
+
+def loaded_backends() -> List[str]:
+    """Backends whose callable has been resolved (imported) in this process"""
+    with _backends_lock:
+        return [name for name, backend in _backends.items() if backend.callable is not None]
+
+
+def _inventory_forecaster_lstm(db, params: Dict[str, Any], report: Callable[[float, str], None]):
+    # InventoryForecaster pulls in TensorFlow at import, so only import it here
+    from inventory_forecasting import InventoryForecaster
+
+    report(0.1, 'Training LSTM')
+    return InventoryForecaster(db).train_lstm_model(forecast_days=params.get('forecast_days', 30))
+
+
+register_backend('statistical', 'batch_forecasting:statistical_backend',
+                 'Exponential smoothing, Holt-Winters and Croston per SKU (NumPy)')
+register_backend('sku_stock_regression', 'training_orchestrator:regression_backend',
+                 "Linear, polynomial and ridge regression of each SKU's current stock on its "
+                 'consumption, price and minimum (scikit-learn)')
+register_backend('lstm', 'forecasting_backends:_inventory_forecaster_lstm',
+                 'LSTM neural network on total daily consumption (TensorFlow)')
+register_backend('lstm_incremental', 'incremental_lstm:lstm_backend',
+                 'LSTM fine-tuned on newly arrived days (TensorFlow)')
+register_backend('backtest', 'backtesting:backtest_backend',
+                 'Walk-forward backtest of every statistical forecaster over the catalog (NumPy)')
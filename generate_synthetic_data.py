@@ -0,0 +1,369 @@
+"""
+Synthetic Data Generator
+Seeded, vectorized generator for large inventory, supplier, transaction and
+consumption datasets. Rows are sampled with NumPy in bounded chunks and
+streamed into SQLite with bulk-load pragmas, so 100k SKUs and 10M+
+consumption rows fit in a fixed amount of memory.
+
+Usage:
+    python generate_synthetic_data.py load_test.db --skus 100000 --days 365 --seed 7
+"""
+
+import argparse
+import os
+import sqlite3
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+
+from db_migrations import apply_migrations
+from populate_inventory import pharmaceutical_drugs, suppliers as supplier_names
+
+# Tables the app expects; created only when generating into an empty file
+BASE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS inventory (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    drug_name TEXT NOT NULL,
+    category TEXT,
+    manufacturer TEXT,
+    batch_number TEXT,
+    current_stock INTEGER DEFAULT 0,
+    minimum_stock INTEGER DEFAULT 0,
+    unit_price REAL DEFAULT 0,
+    per_tablet_price REAL,
+    per_sheet_price REAL,
+    tablets_per_sheet INTEGER,
+    expiry_date TEXT,
+    supplier_name TEXT,
+    description TEXT,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS consumption_patterns (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    drug_id INTEGER,
+    date TEXT,
+    quantity_consumed INTEGER,
+    department TEXT,
+    notes TEXT
+);
+
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    drug_id INTEGER,
+    transaction_type TEXT,
+    quantity INTEGER,
+    unit_price REAL,
+    total_amount REAL,
+    reference_number TEXT,
+    notes TEXT,
+    department TEXT,
+    user_id TEXT,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS suppliers (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT UNIQUE,
+    contact_person TEXT,
+    phone TEXT,
+    email TEXT,
+    address TEXT,
+    lead_time_days INTEGER,
+    reliability_score REAL,
+    quality_score REAL,
+    cost_rating REAL
+);
+"""
+
+# (category, share of SKUs, daily consumption range) - ranges as in populate_consumption_data
+CATEGORIES = (
+    ('Drugs', 0.7, (5, 20)),
+    ('Baby Care Products', 0.15, (10, 30)),
+    ('Surgical Items', 0.15, (15, 50)),
+)
+
+DEPARTMENTS = ('ICU', 'Emergency', 'General Ward', 'Outpatient', 'Pharmacy')
+TRANSACTION_TYPES = ('Purchase', 'Sale', 'Return', 'Adjustment', 'Damage', 'Expired')
+TRANSACTION_DEPARTMENTS = ('Pharmacy', 'Emergency', 'Cardiology', 'Pediatrics', 'General Ward', 'ICU')
+VARIANTS = ('100mg', '250mg', '500mg', '5ml', '10ml', 'Forte', 'SR', 'Kids')
+
+
+def _bulk_load_pragmas(conn) -> None:
+    """Durability traded for speed; the file is fresh, so a crash just means regenerating"""
+    conn.execute("PRAGMA journal_mode = MEMORY")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA cache_size = -65536")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA locking_mode = EXCLUSIVE")
+
+
+def _restore_pragmas(conn) -> None:
+    conn.execute("PRAGMA locking_mode = NORMAL")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+
+
+def _sku_chunks(n_skus: int, rows_per_sku: float, chunk_rows: int) -> Iterator[Tuple[int, int]]:
+    """[start, stop) SKU ranges holding about chunk_rows rows each"""
+    step = max(1, int(chunk_rows // max(rows_per_sku, 1.0)))
+    for start in range(0, n_skus, step):
+        yield start, min(n_skus, start + step)
+
+
+def _insert_chunked(conn, sql: str, chunks) -> int:
+    """executemany each chunk in its own transaction; returns the rows written"""
+    total = 0
+    for rows in chunks:
+        with conn:
+            conn.executemany(sql, rows)
+        total += len(rows)
+    return total
+
+
+def generate_inventory(rng: np.random.Generator, n_skus: int) -> Dict[str, np.ndarray]:
+    """Per-SKU attributes, also used to shape consumption and transactions"""
+    shares = np.array([share for _, share, _ in CATEGORIES])
+    category_index = rng.choice(len(CATEGORIES), size=n_skus, p=shares / shares.sum())
+    low = np.array([lo for _, _, (lo, _) in CATEGORIES])[category_index]
+    high = np.array([hi for _, _, (_, hi) in CATEGORIES])[category_index]
+    daily_level = rng.uniform(low, high)
+
+    base_index = rng.integers(0, len(pharmaceutical_drugs), size=n_skus)
+    base_price = np.array([price for *_, price in pharmaceutical_drugs])[base_index]
+    unit_price = np.round(base_price * rng.uniform(0.9, 1.15, size=n_skus), 2)
+
+    # Days of cover: most SKUs are healthy, some short and some heavily overstocked
+    cover_bucket = rng.choice(3, size=n_skus, p=[0.15, 0.7, 0.15])
+    cover_days = rng.uniform(np.array([0, 10, 90])[cover_bucket], np.array([10, 90, 400])[cover_bucket])
+    current_stock = (daily_level * cover_days).astype(np.int64)
+    minimum_stock = np.maximum(10, (daily_level * 14).astype(np.int64))
+
+    return {
+        'category_index': category_index,
+        'daily_level': daily_level,
+        'base_index': base_index,
+        'variant_index': rng.integers(0, len(VARIANTS), size=n_skus),
+        'manufacturer_index': rng.integers(0, len(pharmaceutical_drugs), size=n_skus),
+        'supplier_index': rng.integers(0, len(supplier_names), size=n_skus),
+        'unit_price': unit_price,
+        'current_stock': current_stock,
+        'minimum_stock': minimum_stock,
+        'expiry_offset': rng.integers(-30, 1096, size=n_skus),
+        'batch_year': rng.integers(2020, 2026, size=n_skus),
+        'batch_month': rng.integers(1, 13, size=n_skus),
+        # Seasonal shape and intermittency drive the forecasting and seasonal analyses
+        'season_amplitude': rng.uniform(0.0, 0.4, size=n_skus),
+        'season_phase': rng.uniform(0, 2 * np.pi, size=n_skus),
+        'trend': rng.normal(0.0, 0.001, size=n_skus),
+        'intermittent': rng.random(n_skus) < 0.1,
+    }
+
+
+def _inventory_rows(skus: Dict[str, np.ndarray], start: int, stop: int, today: date) -> List[tuple]:
+    loaded_at = f"{today.isoformat()} 00:00:00"
+    rows = []
+    for i in range(start, stop):
+        name, _, _, _, _ = pharmaceutical_drugs[skus['base_index'][i]]
+        category = CATEGORIES[skus['category_index'][i]][0]
+        drug_name = f"{name} {VARIANTS[skus['variant_index'][i]]}"
+        year, month = int(skus['batch_year'][i]), int(skus['batch_month'][i])
+        prefix = ''.join(c for c in name if c.isupper())[:3] or name[:3].upper()
+        rows.append((
+            drug_name,
+            category,
+            pharmaceutical_drugs[skus['manufacturer_index'][i]][2],
+            f"{prefix}{year}{month:02d}{i:06d}",
+            int(skus['current_stock'][i]),
+            int(skus['minimum_stock'][i]),
+            float(skus['unit_price'][i]),
+            (today + timedelta(days=int(skus['expiry_offset'][i]))).isoformat(),
+            supplier_names[skus['supplier_index'][i]],
+            f"{drug_name} - {category}",
+            f"{year}-{month:02d}-01 00:00:00",
+            loaded_at
+        ))
+    return rows
+
+
+def _consumption_chunks(rng: np.random.Generator, skus: Dict[str, np.ndarray], days: int,
+                        density: float, chunk_rows: int, today: date) -> Iterator[List[tuple]]:
+    """Consumption rows for blocks of SKUs, one day per row, oldest day first"""
+    day_strings = [(today - timedelta(days=offset)).isoformat() for offset in range(days)]
+    day_offsets = np.arange(days)
+    weekday = np.array([(today - timedelta(days=offset)).weekday() for offset in range(days)])
+    day_of_year = np.array([(today - timedelta(days=offset)).timetuple().tm_yday for offset in range(days)])
+    weekend = weekday >= 5
+    n_skus = len(skus['daily_level'])
+
+    for start, stop in _sku_chunks(n_skus, days * density, chunk_rows):
+        block = slice(start, stop)
+        present = rng.random((stop - start, days)) < density
+        # Intermittent SKUs see demand on roughly one day in seven
+        present &= ~skus['intermittent'][block, None] | (rng.random((stop - start, days)) < 0.15)
+        sku_offset, day_index = np.nonzero(present)
+        if not len(sku_offset):
+            continue
+        sku = sku_offset + start
+
+        season = 1 + skus['season_amplitude'][sku] * np.sin(
+            2 * np.pi * day_of_year[day_index] / 365.25 + skus['season_phase'][sku])
+        trend = np.maximum(0.2, 1 - skus['trend'][sku] * day_offsets[day_index])
+        expected = skus['daily_level'][sku] * season * trend * np.where(weekend[day_index], 0.6, 1.0)
+        quantity = rng.poisson(expected)
+        department = rng.integers(0, len(DEPARTMENTS), size=len(sku))
+
+        # Oldest first so rowids follow time, as an append-only feed would
+        order = np.lexsort((-day_index, sku))
+        sku, day_index, quantity, department = sku[order], day_index[order], quantity[order], department[order]
+        yield list(zip(
+            (sku + 1).tolist(),
+            [day_strings[d] for d in day_index.tolist()],
+            quantity.tolist(),
+            [DEPARTMENTS[d] for d in department.tolist()],
+            ['Synthetic consumption'] * len(sku)
+        ))
+
+
+def _transaction_chunks(rng: np.random.Generator, skus: Dict[str, np.ndarray],
+                        per_sku: int, chunk_rows: int, anchor: datetime) -> Iterator[List[tuple]]:
+    if per_sku <= 0:
+        return
+    n_skus = len(skus['daily_level'])
+    for start, stop in _sku_chunks(n_skus, per_sku, chunk_rows):
+        counts = rng.integers(max(1, per_sku // 2), per_sku + per_sku // 2 + 1, size=stop - start)
+        sku = np.repeat(np.arange(start, stop), counts)
+        n = len(sku)
+        kind = rng.integers(0, len(TRANSACTION_TYPES), size=n)
+        quantity = np.where(kind == 0, rng.integers(50, 501, size=n),
+                            np.where(kind == 1, rng.integers(1, 101, size=n), rng.integers(1, 51, size=n)))
+        price = skus['unit_price'][sku]
+        seconds_ago = rng.integers(86400, 730 * 86400, size=n)
+        created = (np.datetime64(anchor, 's')
+                   - seconds_ago.astype('timedelta64[s]')).astype(str)
+        department = rng.integers(0, len(TRANSACTION_DEPARTMENTS), size=n)
+        reference = rng.integers(100000, 1000000, size=n)
+        yield list(zip(
+            (sku + 1).tolist(),
+            [TRANSACTION_TYPES[k] for k in kind.tolist()],
+            quantity.tolist(),
+            price.tolist(),
+            np.round(quantity * price, 2).tolist(),
+            [f"REF{r}" for r in reference.tolist()],
+            [f"{TRANSACTION_TYPES[k]} transaction" for k in kind.tolist()],
+            [TRANSACTION_DEPARTMENTS[d] for d in department.tolist()],
+            ['admin'] * n,
+            [c.replace('T', ' ') for c in created.tolist()]
+        ))
+
+
+def generate_dataset(db_path: str, n_skus: int = 1700, days: int = 365, density: float = 0.133,
+                     transactions_per_sku: int = 10, seed: int = 42, chunk_rows: int = 250_000,
+                     overwrite: bool = False, migrate: bool = True) -> Dict[str, float]:
+    """
+    Generate a complete synthetic database at db_path
+
+    The defaults give roughly the shipped dataset's shape (about 1.7k SKUs and
+    82k consumption rows); scale n_skus for load tests. Rows are inserted
+    before any index, rollup or trigger exists, then apply_migrations builds
+    those once over the loaded data, which is far cheaper than maintaining
+    them row by row. The same seed always produces the same data for a given
+    day.
+    """
+    if os.path.exists(db_path):
+        if not overwrite:
+            raise FileExistsError(f"{db_path} already exists; pass overwrite=True to replace it")
+        for suffix in ('', '-wal', '-shm', '-journal'):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+
+    started = time.perf_counter()
+    rng = np.random.default_rng(seed)
+    today = datetime.now(timezone.utc).date()
+    skus = generate_inventory(rng, n_skus)
+
+    conn = sqlite3.connect(db_path)
+    try:
+        _bulk_load_pragmas(conn)
+        conn.executescript(BASE_SCHEMA)
+
+        with conn:
+            conn.executemany('''
+                INSERT INTO suppliers (name, contact_person, phone, email, address,
+                                       lead_time_days, reliability_score, quality_score, cost_rating)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', [(
+                name,
+                f"{name.split()[0]} Manager",
+                f"+91-{int(rng.integers(7000000000, 10000000000))}",
+                f"contact@{name.lower().replace(' ', '')}.com",
+                f"{int(rng.integers(1, 1000))} Medical Plaza, Mumbai, India",
+                int(rng.integers(3, 15)),
+                round(float(rng.uniform(2.5, 5.0)), 1),
+                round(float(rng.uniform(2.5, 5.0)), 1),
+                round(float(rng.uniform(3.0, 5.0)), 1)
+            ) for name in supplier_names])
+
+        inventory_count = _insert_chunked(conn, '''
+            INSERT INTO inventory (drug_name, category, manufacturer, batch_number,
+                                   current_stock, minimum_stock, unit_price, expiry_date,
+                                   supplier_name, description, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (_inventory_rows(skus, start, stop, today)
+              for start, stop in _sku_chunks(n_skus, 1, chunk_rows)))
+
+        consumption_count = _insert_chunked(conn, '''
+            INSERT INTO consumption_patterns (drug_id, date, quantity_consumed, department, notes)
+            VALUES (?, ?, ?, ?, ?)
+        ''', _consumption_chunks(rng, skus, days, density, chunk_rows, today))
+
+        transaction_count = _insert_chunked(conn, '''
+            INSERT INTO transactions (drug_id, transaction_type, quantity, unit_price, total_amount,
+                                      reference_number, notes, department, user_id, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', _transaction_chunks(rng, skus, transactions_per_sku, chunk_rows,
+                                    datetime(today.year, today.month, today.day)))
+        load_seconds = time.perf_counter() - started
+
+        _restore_pragmas(conn)
+        if migrate:
+            apply_migrations(conn)
+    finally:
+        conn.close()
+
+    return {
+        'skus': inventory_count,
+        'consumption_rows': consumption_count,
+        'transactions': transaction_count,
+        'suppliers': len(supplier_names),
+        'load_seconds': load_seconds,
+        'total_seconds': time.perf_counter() - started,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic pharmacy inventory database")
+    parser.add_argument('db_path', nargs='?', default='synthetic_inventory.db')
+    parser.add_argument('--skus', type=int, default=1700)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--density', type=float, default=0.133,
+                        help="share of SKU-days with consumption")
+    parser.add_argument('--transactions-per-sku', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--chunk-rows', type=int, default=250_000)
+    parser.add_argument('--overwrite', action='store_true')
+    parser.add_argument('--no-migrate', action='store_true',
+                        help="skip building indexes and rollups after the load")
+    args = parser.parse_args()
+
+    summary = generate_dataset(
+        args.db_path, n_skus=args.skus, days=args.days, density=args.density,
+        transactions_per_sku=args.transactions_per_sku, seed=args.seed,
+        chunk_rows=args.chunk_rows, overwrite=args.overwrite, migrate=not args.no_migrate
+    )
+    print(f"Generated {summary['skus']:,} SKUs, {summary['consumption_rows']:,} consumption rows "
+          f"and {summary['transactions']:,} transactions in {summary['total_seconds']:.1f}s "
+          f"(load {summary['load_seconds']:.1f}s)")
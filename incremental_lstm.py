@@ -0,0 +1,256 @@
+"""
+Incremental LSTM Training
+Warm-started LSTM forecasting of total daily consumption. After one full
+training run, later runs only fine-tune the saved weights on the days that
+arrived since, so training time follows the amount of new data rather than
+the length of the history. A full retrain happens instead when the new days
+drift away from the training distribution or the saved model predicts them
+noticeably worse than it validated.
+
+Model state (weights, scaling, validation error, last trained day) lives in
+the model registry. TensorFlow is imported only when a model is built or
+trained.
+"""
+
+import time
+from datetime import date, timedelta
+from typing import Any, Callable, Dict, Optional
+
+import numpy as np
+
+from batch_forecasting import forecast_errors
+from consumption_rollups import days_ago
+from db_connection import connection
+from model_registry import data_fingerprint, get_model_registry
+
+STATE_KIND = 'lstm_state'
+
+
+def daily_consumption_series(db, history_days: int) -> Dict[str, Any]:
+    """Catalog-wide consumption per day over the `history_days` full days before today"""
+    end = date.fromisoformat(days_ago(0))
+    start = end - timedelta(days=history_days)
+    with connection(db) as conn:
+        rows = conn.execute("""
+            SELECT day, SUM(total_quantity) FROM consumption_daily_rollup
+            WHERE day >= ? AND day < ? GROUP BY day
+        """, (start.isoformat(), end.isoformat())).fetchall()
+
+    values = np.zeros(history_days)
+    for day, quantity in rows:
+        values[(date.fromisoformat(day) - start).days] = quantity
+    return {
+        'start': start.isoformat(),
+        'dates': [(start + timedelta(days=offset)).isoformat() for offset in range(history_days)],
+        'values': values,
+    }
+
+
+def _windows(scaled: np.ndarray, lookback: int, targets: slice):
+    """(inputs, outputs) for the one-step windows whose target day falls in `targets`"""
+    indices = np.arange(len(scaled))[targets]
+    indices = indices[indices >= lookback]
+    inputs = np.stack([scaled[i - lookback:i] for i in indices]) if len(indices) else np.empty((0, lookback))
+    return inputs[..., None], scaled[indices]
+
+
+def drift_score(new_values: np.ndarray, mean: float, std: float) -> float:
+    """Standardized shift of the mean of the new days from the training mean"""
+    if not len(new_values):
+        return 0.0
+    return float(abs(new_values.mean() - mean) / (max(std, 1e-9) / np.sqrt(len(new_values))))
+
+
+class IncrementalLSTMTrainer:
+    """
+    LSTM forecaster that fine-tunes on new days when it can
+
+    train(mode='auto') picks: 'reuse' when no new day arrived, 'incremental'
+    when a few new days look like the training data and the saved model
+    still predicts them within error_tolerance of its validation MAE, and
+    'full' otherwise.
+    """
+
+    def __init__(self, db, lookback: int = 14, units: int = 32, history_days: int = 180,
+                 validation_days: int = 21, full_epochs: int = 50, fine_tune_epochs: int = 5,
+                 learning_rate: float = 1e-3, fine_tune_learning_rate: float = 2e-4,
+                 max_new_days: int = 30, replay_days: int = 14, drift_threshold: float = 4.0,
+                 error_tolerance: float = 0.5, registry=None):
+        self.db = db
+        self.lookback = lookback
+        self.units = units
+        self.history_days = history_days
+        self.validation_days = validation_days
+        self.full_epochs = full_epochs
+        self.fine_tune_epochs = fine_tune_epochs
+        self.learning_rate = learning_rate
+        self.fine_tune_learning_rate = fine_tune_learning_rate
+        self.max_new_days = max_new_days
+        self.replay_days = replay_days
+        self.drift_threshold = drift_threshold
+        self.error_tolerance = error_tolerance
+        self.registry = registry or get_model_registry(db)
+
+    @property
+    def params(self) -> Dict[str, Any]:
+        """Hyperparameters that make saved weights reusable"""
+        return {'lookback': self.lookback, 'units': self.units}
+
+    def _build_model(self, learning_rate: float):
+        from tensorflow import keras
+
+        model = keras.Sequential([
+            keras.layers.Input(shape=(self.lookback, 1)),
+            keras.layers.LSTM(self.units),
+            keras.layers.Dense(1),
+        ])
+        model.compile(optimizer=keras.optimizers.Adam(learning_rate=learning_rate), loss='mse')
+        return model
+
+    def plan(self, state: Optional[Dict[str, Any]], series: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Decide how to train given the saved state; pure NumPy, no model needed
+
+        Returns {'mode', 'reason', 'new_days'}. The validation-error check
+        needs predictions, so train() may still upgrade 'incremental' to 'full'.
+        """
+        if state is None:
+            return {'mode': 'full', 'reason': 'no saved model', 'new_days': 0}
+
+        dates = series['dates']
+        if state['last_day'] < dates[0]:
+            return {'mode': 'full', 'reason': 'saved model is older than the history window', 'new_days': len(dates)}
+        new_days = len(dates) - dates.index(state['last_day']) - 1 if state['last_day'] in dates else 0
+        if new_days == 0:
+            return {'mode': 'reuse', 'reason': 'no new days since the last training run', 'new_days': 0}
+        if new_days > self.max_new_days:
+            return {'mode': 'full', 'reason': f'{new_days} new days exceed {self.max_new_days}', 'new_days': new_days}
+
+        score = drift_score(series['values'][-new_days:], state['mean'], state['std'])
+        if score > self.drift_threshold:
+            return {'mode': 'full', 'reason': f'drift score {score:.1f} above {self.drift_threshold}',
+                    'new_days': new_days}
+        return {'mode': 'incremental', 'reason': f'{new_days} new days', 'new_days': new_days}
+
+    def _forecast(self, model, scaled: np.ndarray, days: int) -> np.ndarray:
+        window = list(scaled[-self.lookback:])
+        predictions = []
+        for _ in range(days):
+            value = float(model(np.array(window[-self.lookback:])[None, :, None], training=False)[0, 0])
+            predictions.append(value)
+            window.append(value)
+        return np.array(predictions)
+
+    def _predict(self, model, inputs: np.ndarray) -> np.ndarray:
+        if not len(inputs):
+            return np.empty(0)
+        return model.predict(inputs, verbose=0)[:, 0]
+
+    def _train_full(self, series: Dict[str, Any], reason: str) -> Dict[str, Any]:
+        values = series['values']
+        training = values[:-self.validation_days]
+        mean, std = float(training.mean()), float(training.std() or 1.0)
+        scaled = (values - mean) / std
+
+        model = self._build_model(self.learning_rate)
+        inputs, outputs = _windows(scaled, self.lookback, slice(None, -self.validation_days))
+        model.fit(inputs, outputs, epochs=self.full_epochs, batch_size=32, verbose=0)
+
+        val_inputs, val_outputs = _windows(scaled, self.lookback, slice(-self.validation_days, None))
+        predicted = self._predict(model, val_inputs) * std + mean
+        metrics = forecast_errors(val_outputs * std + mean, predicted)
+
+        # Fold the validation days in so the saved model has seen the whole history
+        model.fit(val_inputs, val_outputs, epochs=self.fine_tune_epochs, batch_size=32, verbose=0)
+        state = {'weights': model.get_weights(), 'mean': mean, 'std': std,
+                 'val_mae': metrics['mae'], 'last_day': series['dates'][-1]}
+        return {'model': model, 'state': state, 'metrics': metrics, 'scaled': scaled,
+                'actual': val_outputs * std + mean, 'predicted': predicted,
+                'mode': 'full', 'reason': reason}
+
+    def _train_incremental(self, state: Dict[str, Any], series: Dict[str, Any],
+                           new_days: int) -> Optional[Dict[str, Any]]:
+        """Fine-tuned result, or None when the saved model predicts the new days too poorly"""
+        mean, std = state['mean'], state['std']
+        scaled = (series['values'] - mean) / std
+        model = self._build_model(self.fine_tune_learning_rate)
+        model.set_weights(state['weights'])
+
+        # Score the saved model on the new days before it has seen them
+        new_inputs, new_outputs = _windows(scaled, self.lookback, slice(-new_days, None))
+        predicted = self._predict(model, new_inputs) * std + mean
+        actual = new_outputs * std + mean
+        metrics = forecast_errors(actual, predicted)
+        if metrics['mae'] > state['val_mae'] * (1 + self.error_tolerance) + 1e-9:
+            return None
+
+        # Fine-tune on the new days plus a short replay of the days before them
+        inputs, outputs = _windows(scaled, self.lookback, slice(-(new_days + self.replay_days), None))
+        model.fit(inputs, outputs, epochs=self.fine_tune_epochs, batch_size=32, verbose=0)
+
+        weight = new_days / (new_days + self.validation_days)
+        state = dict(state, weights=model.get_weights(), last_day=series['dates'][-1],
+                     val_mae=(1 - weight) * state['val_mae'] + weight * metrics['mae'])
+        return {'model': model, 'state': state, 'metrics': metrics, 'scaled': scaled,
+                'actual': actual, 'predicted': predicted,
+                'mode': 'incremental', 'reason': f'{new_days} new days'}
+
+    def train(self, forecast_days: int = 30, mode: str = 'auto') -> Optional[Dict[str, Any]]:
+        """
+        Train (or reuse) and forecast `forecast_days` ahead
+
+        mode is 'auto' or 'full'. Returns the page's LSTM results shape
+        (mae, rmse, mape, future_pred, ...) plus 'training_mode',
+        'training_reason' and 'training_seconds', or None with under 30 days
+        of consumption history.
+        """
+        started = time.perf_counter()
+        series = daily_consumption_series(self.db, self.history_days)
+        if np.count_nonzero(series['values']) < 30:
+            return None
+
+        stored = self.registry.load(STATE_KIND, self.params)
+        state = stored['results'] if stored else None
+        decision = self.plan(state, series) if mode == 'auto' else {'mode': 'full', 'reason': 'requested'}
+
+        if decision['mode'] == 'reuse':
+            mean, std = state['mean'], state['std']
+            model = self._build_model(self.fine_tune_learning_rate)
+            model.set_weights(state['weights'])
+            outcome = {'model': model, 'state': state,
+                       'metrics': {name: stored['metrics'][name] for name in ('mae', 'rmse', 'mape')},
+                       'scaled': (series['values'] - mean) / std, 'actual': np.empty(0),
+                       'predicted': np.empty(0), 'mode': 'reuse', 'reason': decision['reason']}
+        else:
+            outcome = None
+            if decision['mode'] == 'incremental':
+                outcome = self._train_incremental(state, series, decision['new_days'])
+                if outcome is None:
+                    decision['reason'] = 'saved model error on new days above tolerance'
+            if outcome is None:
+                outcome = self._train_full(series, decision['reason'])
+            self.registry.save(STATE_KIND, dict(outcome['state'], **outcome['metrics']),
+                               self.params, data_fingerprint(self.db, STATE_KIND))
+
+        state = outcome['state']
+        future = np.maximum(self._forecast(outcome['model'], outcome['scaled'], forecast_days)
+                            * state['std'] + state['mean'], 0)
+        last = date.fromisoformat(series['dates'][-1])
+        return dict(
+            outcome['metrics'],
+            future_pred=future,
+            future_dates=[(last + timedelta(days=offset)).isoformat() for offset in range(1, forecast_days + 1)],
+            dates=series['dates'],
+            history=series['values'],
+            actual=outcome['actual'],
+            predicted=outcome['predicted'],
+            training_mode=outcome['mode'],
+            training_reason=outcome['reason'],
+            training_seconds=time.perf_counter() - started,
+        )
+
+
+def lstm_backend(db, params: Dict[str, Any], report: Callable[[float, str], None]) -> Optional[Dict[str, Any]]:
+    """Forecasting-backend entry point: warm-started training for params['forecast_days']"""
+    report(0.1, 'Updating LSTM')
+    return IncrementalLSTMTrainer(db).train(params.get('forecast_days', 30))
@@ -0,0 +1,349 @@
+"""
+Model Registry
+On-disk store for trained forecasting models. Each entry keeps the pickled
+training results with their metrics, hyperparameters and a fingerprint of
+the data they were trained on, so every dashboard process (and every
+replica sharing the database directory) can reuse a model until the data
+changes instead of retraining it.
+
+Layout: <root>/registry.db indexes the entries, <root>/<kind>-<uuid>.pkl
+holds each model's results.
+"""
+
+import hashlib
+import json
+import numbers
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict
+from contextlib import closing
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from db_connection import connection, get_pool
+from query_profiler import record_swallowed_exception
+from recommendation_cache import get_recommendation_cache
+from table_versions import dependency_counters
+
+REGISTRY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS models (
+    model_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    data_rows INTEGER NOT NULL,
+    data_max_date TEXT,
+    data_checksum TEXT NOT NULL,
+    metrics TEXT NOT NULL,
+    artifact TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    valid INTEGER NOT NULL DEFAULT 1
+);
+
+CREATE INDEX IF NOT EXISTS idx_models_lookup ON models (kind, params, valid, data_checksum, model_id);
+"""
+
+
+# Columns each model kind trains on, beyond the consumption rollup's
+# (drug_id, day, total_quantity). The statistical forecasts and the backtest
+# have a matrix row per inventory id; the regression also reads stock levels,
+# prices and minimums, so stock movements only make its models stale.
+INVENTORY_COLUMNS = {
+    'sku_stock_regression': ('id', 'current_stock', 'unit_price', 'minimum_stock'),
+    'statistical': ('id',),
+    'backtest': ('id',),
+}
+CONSUMPTION_COLUMNS = ('drug_id', 'day', 'total_quantity')
+# Counters of the source columns behind CONSUMPTION_COLUMNS
+CONSUMPTION_DEPENDENCIES = {'consumption_patterns': ('drug_id', 'date', 'quantity_consumed')}
+
+# Prime modulus of the row hashes, and the bases of two independent hash
+# families; a product of two reduced values stays within SQLite's 64 bits
+_HASH_MODULUS = 2147483647
+_HASH_BASES = (48271, 16807)
+
+
+def _encoded(column: str) -> str:
+    """SQL for a column as an integer in [0, _HASH_MODULUS): ISO dates as YYYYMMDD, numbers to 6 decimals"""
+    if column == 'day':
+        value = "CAST(replace(day, '-', '') AS INTEGER)"
+    else:
+        value = f"CAST(ROUND(IFNULL({column}, -0.5) * 1000000) AS INTEGER)"
+    return f"(({value}) % {_HASH_MODULUS} + {_HASH_MODULUS}) % {_HASH_MODULUS}"
+
+
+def table_hash_sql(table: str, columns) -> str:
+    """
+    Query for (rows, hash, hash) of a table's columns, independent of row order
+
+    Each row is mixed into one value per hash family (a polynomial over the
+    encoded columns) and the families sum its cube as an exact integer, so
+    unlike a weighted column total, edits that cancel out across rows (stock
+    moved between two SKUs) still change the hash.
+    """
+    mixed = []
+    for family, base in enumerate(_HASH_BASES):
+        expression = str(family + 1)
+        for position, column in enumerate(columns):
+            expression = (f"(({expression}) + {_encoded(column)} * {pow(base, position + 1, _HASH_MODULUS)})"
+                          f" % {_HASH_MODULUS}")
+        mixed.append(f"{expression} AS h{family}")
+    cubes = ', '.join(f"SUM(h{family} * h{family} % {_HASH_MODULUS} * h{family} % {_HASH_MODULUS})"
+                      for family in range(len(_HASH_BASES)))
+    # LIMIT -1 keeps SQLite from flattening the subquery, which would mix
+    # each row three times over
+    return f"SELECT COUNT(*), {cubes} FROM (SELECT {', '.join(mixed)} FROM {table} LIMIT -1)"
+
+
+def data_fingerprint(db, kind: str) -> Dict[str, Any]:
+    """
+    Row count, latest consumption date and checksum of the data a model of
+    this kind trains on
+
+    The checksum hashes every row of the consumption rollup and, for the
+    kinds in INVENTORY_COLUMNS, the inventory columns they read; the other
+    kinds only read consumption, so stock movements do not make their models
+    stale. The result is cached against the change counters of the columns
+    it reads, so it is only recomputed after one of those is written.
+    """
+    inventory_columns = INVENTORY_COLUMNS.get(kind, ())
+    dependencies = dict(CONSUMPTION_DEPENDENCIES)
+    if inventory_columns:
+        dependencies['inventory'] = inventory_columns
+    cache = get_recommendation_cache(db)
+    key = None
+    if cache is not None:
+        versions = cache.versions()
+        key = ('data_fingerprint', inventory_columns,
+               tuple(versions.get(counter) for counter in dependency_counters(dependencies)))
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    with connection(db) as conn:
+        rows, max_date = conn.execute(
+            "SELECT TOTAL(row_count), MAX(day) FROM consumption_daily_rollup"
+        ).fetchone()
+        hashes = [conn.execute(table_hash_sql('consumption_daily_rollup', CONSUMPTION_COLUMNS)).fetchone()]
+        if inventory_columns:
+            hashes.append(conn.execute(table_hash_sql('inventory', inventory_columns)).fetchone())
+
+    fingerprint = {
+        'rows': int(rows),
+        'max_date': max_date,
+        'checksum': hashlib.sha256(repr((rows, max_date, inventory_columns, hashes)).encode()).hexdigest(),
+    }
+    if key is not None:
+        cache.put(key, fingerprint)
+    return fingerprint
+
+
+def params_key(params: Dict[str, Any]) -> str:
+    """Canonical JSON for a hyperparameter dict, the form models are indexed by"""
+    return json.dumps(params, sort_keys=True, default=str)
+
+
+def _metrics(results: Dict[str, Any]) -> Dict[str, Any]:
+    """Scalar metrics from a results dict, one level of nesting deep"""
+    def scalar(value):
+        return isinstance(value, numbers.Real) and not isinstance(value, bool)
+
+    metrics = {}
+    for key, value in results.items():
+        if scalar(value):
+            metrics[key] = float(value)
+        elif isinstance(value, str) and key.startswith('best'):
+            metrics[key] = value
+        elif isinstance(value, dict):
+            nested = {name: float(item) for name, item in value.items() if scalar(item)}
+            if nested:
+                metrics[key] = nested
+    return metrics
+
+
+def _picklable(results: Dict[str, Any]) -> Dict[str, Any]:
+    """Results without the entries that cannot be pickled (e.g. live framework models)"""
+    kept = {}
+    for key, value in results.items():
+        try:
+            pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            record_swallowed_exception(e)
+            continue
+        kept[key] = value
+    return kept
+
+
+class ModelRegistry:
+    """
+    Trained models indexed by kind, hyperparameters and data fingerprint
+
+    Loaded results are kept in a small in-process LRU, so page reruns do
+    not unpickle the same model again.
+    """
+
+    def __init__(self, root: str, keep: int = 5, memory_entries: int = 8):
+        self.root = root
+        self.keep = keep
+        self.memory_entries = memory_entries
+        self._loaded = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        with closing(self.connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(REGISTRY_SCHEMA)
+
+    def connect(self) -> sqlite3.Connection:
+        """Connection to the registry index, closed by the caller"""
+        return sqlite3.connect(os.path.join(self.root, 'registry.db'), timeout=30.0)
+
+    def save(self, kind: str, results: Dict[str, Any], params: Dict[str, Any],
+             fingerprint: Dict[str, Any]) -> int:
+        """Store trained results; returns the new model_id"""
+        artifact = f"{kind}-{uuid.uuid4().hex}.pkl"
+        # Write to a temporary name first so readers never see a partial file
+        fd, temp_path = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as handle:
+                pickle.dump(_picklable(results), handle, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, os.path.join(self.root, artifact))
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        with closing(self.connect()) as conn, conn:
+            cursor = conn.execute("""
+                INSERT INTO models (kind, params, data_rows, data_max_date, data_checksum,
+                                    metrics, artifact, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (
+                kind, params_key(params), fingerprint['rows'], fingerprint['max_date'],
+                fingerprint['checksum'], json.dumps(_metrics(results)), artifact,
+                datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            ))
+            model_id = cursor.lastrowid
+        self.prune(kind, params)
+        return model_id
+
+    def load(self, kind: str, params: Dict[str, Any],
+             fingerprint: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """
+        Latest valid model of this kind and hyperparameters, or None
+
+        With a fingerprint only models trained on identical data qualify.
+        Entries whose artifact is missing or unreadable are marked invalid
+        and skipped. Returns the index row as a dict plus 'results'.
+        """
+        query = "SELECT * FROM models WHERE kind = ? AND params = ? AND valid = 1"
+        args = [kind, params_key(params)]
+        if fingerprint is not None:
+            query += " AND data_checksum = ?"
+            args.append(fingerprint['checksum'])
+        query += " ORDER BY model_id DESC"
+
+        return self._first_readable(query, args)
+
+    def get(self, model_id: int) -> Optional[Dict[str, Any]]:
+        """One model by id, or None when it is gone or unreadable"""
+        return self._first_readable("SELECT * FROM models WHERE model_id = ? AND valid = 1", [model_id])
+
+    def _first_readable(self, query: str, args) -> Optional[Dict[str, Any]]:
+        with closing(self.connect()) as conn:
+            conn.row_factory = sqlite3.Row
+            candidates = [dict(row) for row in conn.execute(query, args)]
+
+        for entry in candidates:
+            results = self._read_artifact(entry)
+            if results is not None:
+                entry['metrics'] = json.loads(entry['metrics'])
+                entry['params'] = json.loads(entry['params'])
+                entry['results'] = results
+                return entry
+        return None
+
+    def _read_artifact(self, entry: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            if entry['model_id'] in self._loaded:
+                self._loaded.move_to_end(entry['model_id'])
+                return self._loaded[entry['model_id']]
+        try:
+            with open(os.path.join(self.root, entry['artifact']), 'rb') as handle:
+                results = pickle.load(handle)
+        except Exception as e:
+            record_swallowed_exception(e)
+            with closing(self.connect()) as conn, conn:
+                conn.execute("UPDATE models SET valid = 0 WHERE model_id = ?", (entry['model_id'],))
+            return None
+        with self._lock:
+            self._loaded[entry['model_id']] = results
+            while len(self._loaded) > self.memory_entries:
+                self._loaded.popitem(last=False)
+        return results
+
+    def get_or_train(self, kind: str, params: Dict[str, Any], fingerprint: Dict[str, Any],
+                     train: Callable[[], Optional[Dict[str, Any]]]) -> Tuple[Optional[Dict[str, Any]], bool]:
+        """
+        Results for the current data, training only when no stored model matches
+
+        Returns (results, trained). A model that trains but cannot be stored
+        is still returned.
+        """
+        stored = self.load(kind, params, fingerprint)
+        if stored is not None:
+            return stored['results'], False
+
+        results = train()
+        if results is not None:
+            try:
+                self.save(kind, results, params, fingerprint)
+            except (OSError, sqlite3.Error, pickle.PicklingError) as e:
+                record_swallowed_exception(e)
+        return results, True
+
+    def prune(self, kind: str, params: Dict[str, Any]) -> int:
+        """Delete all but the newest `keep` models of this kind and hyperparameters"""
+        with closing(self.connect()) as conn, conn:
+            stale = conn.execute("""
+                SELECT model_id, artifact FROM models WHERE kind = ? AND params = ?
+                ORDER BY model_id DESC LIMIT -1 OFFSET ?
+            """, (kind, params_key(params), self.keep)).fetchall()
+            conn.executemany("DELETE FROM models WHERE model_id = ?", [(model_id,) for model_id, _ in stale])
+
+        for model_id, artifact in stale:
+            with self._lock:
+                self._loaded.pop(model_id, None)
+            try:
+                os.remove(os.path.join(self.root, artifact))
+            except FileNotFoundError:
+                pass
+        return len(stale)
+
+
+_registries: Dict[str, ModelRegistry] = {}
+_registries_lock = threading.Lock()
+
+
+def get_model_registry(db) -> ModelRegistry:
+    """
+    Shared registry for db's database
+
+    Lives in PHARMA_MODEL_REGISTRY if set, otherwise in a model_registry
+    directory next to the database file (the temp directory for in-memory
+    databases), so replicas on one database share their models.
+    """
+    root = os.environ.get('PHARMA_MODEL_REGISTRY')
+    if not root:
+        pool = get_pool(db)
+        base = os.path.dirname(os.path.abspath(pool.db_path)) if pool is not None else tempfile.gettempdir()
+        root = os.path.join(base, 'model_registry')
+
+    with _registries_lock:
+        registry = _registries.get(root)
+        if registry is None:
+            registry = ModelRegistry(root)
+            _registries[root] = registry
+    return registry
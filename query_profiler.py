@@ -0,0 +1,315 @@
+"""
+Query Profiler
+Low-overhead instrumentation for SQLite connections: per-statement timing,
+rows returned and calling function, aggregated by a normalized fingerprint
+of the SQL with rolling p50/p95/p99, plus a record of exceptions that
+callers catch and turn into empty results.
+
+Pooled connections (db_connection.get_pool) are profiled by default; set
+PHARMA_SQL_PROFILE=0 to turn it off.
+"""
+
+import concurrent.futures
+import contextlib
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=4096)
+def fingerprint(sql: str) -> str:
+    """SQL with literals replaced by ? and whitespace collapsed, so repeats of one query group together"""
+    normalized = _STRING_LITERAL.sub('?', sql)
+    normalized = _NUMBER_LITERAL.sub('?', normalized)
+    normalized = _WHITESPACE.sub(' ', normalized).strip()
+    return _IN_LIST.sub('(?+)', normalized)
+
+
+# Frames from these files are plumbing, not the caller we want to blame
+_PLUMBING_FILES = {
+    os.path.abspath(__file__),
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'db_connection.py'),
+    os.path.abspath(contextlib.__file__),
+}
+_PLUMBING_DIRS = (
+    os.path.dirname(os.path.abspath(sqlite3.__file__)) + os.sep,
+    os.path.dirname(os.path.abspath(concurrent.futures.__file__)) + os.sep,
+)
+
+
+@lru_cache(maxsize=4096)
+def _is_plumbing(filename: str) -> bool:
+    path = os.path.abspath(filename)
+    return (path in _PLUMBING_FILES or path.startswith(_PLUMBING_DIRS)
+            or os.sep + 'pandas' + os.sep in path)
+
+
+def calling_function(depth: int = 2) -> str:
+    """module.qualname of the nearest frame outside sqlite3, pandas and this module"""
+    frame = sys._getframe(depth)
+    while frame is not None and _is_plumbing(frame.f_code.co_filename):
+        frame = frame.f_back
+    if frame is None:
+        return '<unknown>'
+    code = frame.f_code
+    module = frame.f_globals.get('__name__', '?')
+    return f"{module}.{getattr(code, 'co_qualname', code.co_name)}"
+
+
+def _percentile(ordered: List[float], fraction: float) -> float:
+    if not ordered:
+        return 0.0
+    position = fraction * (len(ordered) - 1)
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+class _FingerprintStats:
+    __slots__ = ('sql', 'calls', 'total_ms', 'max_ms', 'rows', 'errors', 'last_error',
+                 'callers', 'recent')
+
+    def __init__(self, sql: str, window: int):
+        self.sql = sql
+        self.calls = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.rows = 0
+        self.errors = 0
+        self.last_error = None
+        self.callers = Counter()
+        self.recent = deque(maxlen=window)
+
+
+class QueryProfiler:
+    """
+    Thread-safe statement statistics
+
+    Percentiles cover the last `window` executions of each fingerprint, so
+    they track current behaviour rather than the whole process lifetime.
+    """
+
+    def __init__(self, window: int = 1000, max_exceptions: int = 200, enabled: bool = True):
+        self.window = window
+        self.enabled = enabled
+        self._stats: Dict[str, _FingerprintStats] = {}
+        self._exceptions = deque(maxlen=max_exceptions)
+        self._lock = threading.Lock()
+
+    def record(self, sql: str, duration_ms: float, rows: int, caller: str,
+               error: Optional[BaseException] = None) -> None:
+        """Add one finished statement"""
+        key = fingerprint(sql)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = _FingerprintStats(key, self.window)
+            stats.calls += 1
+            stats.total_ms += duration_ms
+            if duration_ms > stats.max_ms:
+                stats.max_ms = duration_ms
+            stats.rows += rows
+            stats.callers[caller] += 1
+            stats.recent.append(duration_ms)
+            if error is not None:
+                stats.errors += 1
+                stats.last_error = f"{type(error).__name__}: {error}"
+
+    def record_exception(self, error: BaseException, caller: Optional[str] = None) -> None:
+        """Note an exception a caller handled by returning a fallback value"""
+        frames = traceback.extract_tb(error.__traceback__)
+        with self._lock:
+            self._exceptions.append({
+                'time': time.time(),
+                'caller': caller or calling_function(3),
+                'error': f"{type(error).__name__}: {error}",
+                'raised_at': f"{frames[-1].filename}:{frames[-1].lineno}" if frames else None,
+            })
+
+    def swallowed_exceptions(self) -> List[Dict[str, Any]]:
+        """Recorded handled exceptions, oldest first"""
+        with self._lock:
+            return list(self._exceptions)
+
+    def report(self, top: int = 10, sort_by: str = 'total_ms') -> List[Dict[str, Any]]:
+        """
+        Top offenders by sort_by: total_ms, p95_ms, p99_ms, mean_ms, calls, rows or errors
+        """
+        with self._lock:
+            snapshot = [
+                (stats.sql, stats.calls, stats.total_ms, stats.max_ms, stats.rows, stats.errors,
+                 stats.last_error, stats.callers.most_common(3), sorted(stats.recent))
+                for stats in self._stats.values()
+            ]
+
+        entries = []
+        for sql, calls, total_ms, max_ms, rows, errors, last_error, callers, recent in snapshot:
+            entries.append({
+                'fingerprint': sql,
+                'calls': calls,
+                'total_ms': total_ms,
+                'mean_ms': total_ms / calls if calls else 0.0,
+                'p50_ms': _percentile(recent, 0.50),
+                'p95_ms': _percentile(recent, 0.95),
+                'p99_ms': _percentile(recent, 0.99),
+                'max_ms': max_ms,
+                'rows': rows,
+                'rows_per_call': rows / calls if calls else 0.0,
+                'errors': errors,
+                'last_error': last_error,
+                'callers': [caller for caller, _ in callers],
+            })
+        entries.sort(key=lambda entry: entry[sort_by], reverse=True)
+        return entries[:top]
+
+    def format_report(self, top: int = 10, sort_by: str = 'total_ms') -> str:
+        """Plain-text version of report() plus recent swallowed exceptions"""
+        lines = [f"{'total ms':>10} {'calls':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'rows/call':>10} {'err':>4}  caller / query"]
+        for entry in self.report(top, sort_by):
+            lines.append(
+                f"{entry['total_ms']:>10.1f} {entry['calls']:>7} {entry['p50_ms']:>8.2f} "
+                f"{entry['p95_ms']:>8.2f} {entry['p99_ms']:>8.2f} {entry['rows_per_call']:>10.1f} "
+                f"{entry['errors']:>4}  {', '.join(entry['callers'])}"
+            )
+            lines.append(f"{'':>61}{entry['fingerprint'][:120]}")
+        exceptions = self.swallowed_exceptions()
+        if exceptions:
+            lines.append(f"\n{len(exceptions)} swallowed exceptions (latest last):")
+            for item in exceptions[-10:]:
+                lines.append(f"  {item['caller']}: {item['error']} ({item['raised_at']})")
+        return '\n'.join(lines)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+            self._exceptions.clear()
+
+
+profiler = QueryProfiler(enabled=os.environ.get('PHARMA_SQL_PROFILE', '1') != '0')
+
+
+def record_swallowed_exception(error: BaseException) -> None:
+    """Call from an except block that returns a fallback, so the failure stays visible"""
+    if profiler.enabled:
+        profiler.record_exception(error, calling_function(2))
+
+
+class ProfiledCursor(sqlite3.Cursor):
+    """
+    Cursor that reports each statement once it is finished: when its rows
+    are exhausted, when fetchone() returns a row, or when the cursor runs
+    another statement, is closed or is garbage collected. Fetch time counts
+    toward the statement's duration; rows fetched after fetchone() has
+    reported the statement are not counted.
+    """
+
+    _pending = None
+
+    def _finish(self, error: Optional[BaseException] = None) -> None:
+        pending = self._pending
+        if pending is not None:
+            self._pending = None
+            sql, caller, elapsed, rows = pending
+            profiler.record(sql, elapsed * 1000, rows, caller, error)
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        caller = calling_function(2)
+        started = time.perf_counter()
+        try:
+            super().execute(sql, parameters)
+        except Exception as e:
+            self._pending = (sql, caller, time.perf_counter() - started, 0)
+            self._finish(e)
+            raise
+        elapsed = time.perf_counter() - started
+        if self.description is None:
+            # No result set: DDL or DML, finished already
+            self._pending = (sql, caller, elapsed, max(self.rowcount, 0))
+            self._finish()
+        else:
+            self._pending = (sql, caller, elapsed, 0)
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._finish()
+        caller = calling_function(2)
+        started = time.perf_counter()
+        try:
+            super().executemany(sql, seq_of_parameters)
+        except Exception as e:
+            self._pending = (sql, caller, time.perf_counter() - started, 0)
+            self._finish(e)
+            raise
+        self._pending = (sql, caller, time.perf_counter() - started, max(self.rowcount, 0))
+        self._finish()
+        return self
+
+    def _fetched(self, started: float, count: int, exhausted: bool) -> None:
+        pending = self._pending
+        if pending is not None:
+            sql, caller, elapsed, rows = pending
+            self._pending = (sql, caller, elapsed + time.perf_counter() - started, rows + count)
+            if exhausted:
+                self._finish()
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        # execute().fetchone() point lookups drop the cursor right after this
+        self._fetched(started, row is not None, True)
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(started, len(rows), len(rows) < (self.arraysize if size is None else size))
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(started, len(rows), True)
+        return rows
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(started, 0, True)
+            raise
+        self._fetched(started, 1, False)
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        self._finish()
+
+
+class ProfiledConnection(sqlite3.Connection):
+    """Connection whose cursors, including those behind execute(), are profiled"""
+
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
@@ -0,0 +1,109 @@
+"""
+Recommendation Cache
+LRU cache with TTL for recommendation results, keyed on the versions of the
+tables each result was computed from. A write to a table only invalidates
+the entries that read it; everything else keeps hitting.
+"""
+
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+from db_connection import get_pool
+from table_versions import read_table_versions
+
+_MISSING = object()
+
+
+class RecommendationCache:
+    """
+    Version-keyed LRU cache for one database
+
+    versions() costs one PRAGMA data_version on a dedicated read-only
+    connection when nothing was committed since the last call, so a hit
+    stays in the microseconds; the counters themselves are only reread
+    after another connection commits.
+    """
+
+    def __init__(self, pool, ttl: float = 300.0, max_entries: int = 64):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._pool = pool
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._watch = None
+        self._data_version = None
+        self._versions: Dict[str, int] = {}
+
+    def versions(self) -> Dict[str, int]:
+        """Current per-table change counters"""
+        with self._lock:
+            try:
+                if self._watch is None:
+                    self._watch = self._pool.connect(readonly=True)
+                data_version = self._watch.execute("PRAGMA data_version").fetchone()[0]
+                if data_version != self._data_version:
+                    self._versions = read_table_versions(self._watch)
+                    self._data_version = data_version
+            except sqlite3.Error:
+                # Drop the connection so the next call starts fresh, and force a miss
+                if self._watch is not None:
+                    self._watch.close()
+                self._watch = None
+                self._data_version = None
+                self._versions = {'unavailable': time.monotonic_ns()}
+            return self._versions
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Cached value for key, or default when missing or older than the TTL"""
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is _MISSING or time.monotonic() - entry[0] > self.ttl:
+                if entry is not _MISSING:
+                    del self._entries[key]
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """Store value, evicting the least recently used entries beyond max_entries"""
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self) -> None:
+        """Drop every entry"""
+        with self._lock:
+            self._entries.clear()
+
+    def close(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            if self._watch is not None:
+                self._watch.close()
+                self._watch = None
+
+
+_caches: Dict[str, RecommendationCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_recommendation_cache(db) -> Optional[RecommendationCache]:
+    """Shared cache for the database behind db, or None when it cannot be pooled"""
+    pool = get_pool(db)
+    if pool is None:
+        return None
+    with _caches_lock:
+        cache = _caches.get(pool.db_path)
+        if cache is None:
+            cache = RecommendationCache(pool)
+            _caches[pool.db_path] = cache
+    return cache
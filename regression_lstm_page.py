@@ -1,6 +1,116 @@
 import streamlit as st
 import plotly.graph_objects as go
-from inventory_forecasting import InventoryForecaster
+from forecasting_backends import DEFAULT_BACKEND, available_backends
+from model_registry import data_fingerprint, get_model_registry
+from training_jobs import ACTIVE_STATUSES, ensure_worker
+
+# Registry kind of the per-SKU stock-level regression. It replaced
+# InventoryForecaster's regression under a new name, so models and labels of
+# the old one are not shown as this one.
+REGRESSION_KIND = 'sku_stock_regression'
+# Hyperparameters the registry keys regression models on
+REGRESSION_PARAMS = {'models': ['linear', 'polynomial', 'ridge'], 'polynomial_degree': 2,
+                     'features': 'consumption-30d-90d-price-minimum'}
+
+
+@st.fragment(run_every=2)
+def _job_progress(queue, job_id):
+    """Progress bar that refreshes on its own and reruns the page once the job finishes"""
+    job = queue.status(job_id)
+    if job is None or job['status'] not in ACTIVE_STATUSES:
+        st.rerun()
+    st.progress(job['progress'], text=f"⏳ {job['message']} (job #{job_id}, {job['status']})")
+
+
+def _inventory_forecaster(db):
+    """InventoryForecaster, imported on first use because it loads TensorFlow"""
+    from inventory_forecasting import InventoryForecaster
+    return InventoryForecaster(db)
+
+
+def _regression_figure(results):
+    """Actual vs predicted scatter per model, or None when results lack the test split"""
+    models = [name for name in ('linear', 'polynomial', 'ridge') if 'y_test' in results.get(name, {})]
+    if not models:
+        return None
+    fig = go.Figure()
+    for name in models:
+        fig.add_trace(go.Scatter(x=results[name]['y_test'], y=results[name]['y_pred'],
+                                 mode='markers', name=name.title(), opacity=0.6))
+    upper = max(float(max(results[name]['y_test'].max(), results[name]['y_pred'].max())) for name in models)
+    fig.add_trace(go.Scatter(x=[0, upper], y=[0, upper], mode='lines', name='Perfect prediction',
+                             line=dict(dash='dash', color='gray')))
+    fig.update_layout(xaxis_title='Actual stock', yaxis_title='Predicted stock', height=500)
+    return fig
+
+
+def _forecast_figure(results, history_days=90):
+    """Recent history plus forecast, or None when results lack the dated series"""
+    if not all(key in results for key in ('dates', 'history', 'future_dates', 'future_pred')):
+        return None
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(x=results['dates'][-history_days:], y=results['history'][-history_days:],
+                             mode='lines', name='Daily consumption'))
+    fig.add_trace(go.Scatter(x=results['future_dates'], y=results['future_pred'],
+                             mode='lines', name='Forecast', line=dict(dash='dash')))
+    fig.update_layout(xaxis_title='Date', yaxis_title='Units', height=500)
+    return fig
+
+
+def _collect_job(queue, job_key):
+    """(job, results) for this session's training job; results only once it finished"""
+    job_id = st.session_state.get(job_key)
+    if job_id is None:
+        return None, None
+    job = queue.status(job_id)
+    if job is not None and job['status'] in ACTIVE_STATUSES:
+        _job_progress(queue, job_id)
+        return job, None
+    del st.session_state[job_key]
+    if job is None or job['status'] != 'done':
+        return job, None
+    return job, queue.result(job_id)
+
+
+def _backtest_section(queue, registry, fingerprint, forecast_days):
+    """
+    Catalog-wide backtest leaderboard for the horizon; returns the
+    forecaster it selected for the statistical backend, or None
+    """
+    params = {'forecast_days': forecast_days}
+    with st.expander("🧪 Catalog-wide backtest", expanded=False):
+        st.caption("Walk-forward evaluation of every statistical forecaster over every SKU "
+                   "at several past cutoffs; the statistical backend uses the winner.")
+        stored = registry.load('backtest', params, fingerprint)
+        backtest = stored['results'] if stored else None
+
+        if st.button("Run Backtest", key="run_backtest"):
+            try:
+                st.session_state['backtest_job'] = queue.submit('backtest', params, fingerprint)['job_id']
+            except Exception as e:
+                st.error(f"Error submitting backtest: {str(e)}")
+
+        job, finished = _collect_job(queue, 'backtest_job')
+        if job is not None and job['status'] == 'failed':
+            st.error(f"Error during backtest: {job['error']}")
+        elif finished is not None:
+            backtest = finished
+
+        if backtest is None:
+            st.info("No backtest on the current data yet.")
+            return None
+
+        st.dataframe([
+            {'Forecaster': name, 'MAE': metrics['mae'], 'RMSE': metrics['rmse'], 'Bias': metrics['bias'],
+             'MAPE %': metrics['mape'], 'SKUs won': metrics.get('wins')}
+            for name, metrics in sorted(backtest['forecasters'].items(), key=lambda item: item[1]['mae'])
+        ], use_container_width=True, hide_index=True)
+        st.caption(f"{backtest['sku_count']} SKUs, cutoffs {', '.join(backtest['cutoffs'])}, "
+                   f"{backtest['horizon']}-day horizon. Best: {backtest['best_forecaster']}.")
+        if backtest['failed']:
+            st.warning(f"{len(backtest['failed'])} backtest fits failed; forecasters missing a cutoff are not ranked.")
+        return backtest['best_forecaster']
+
 
 def regression_lstm_analysis_page(db):
     """Page for regression and LSTM analysis"""
@@ -19,40 +129,55 @@ def regression_lstm_analysis_page(db):
         if 'regression_results' not in st.session_state and 'lstm_results' not in st.session_state:
             st.info("📊 **Inventory data has been updated!** Click the buttons below to generate fresh forecasts based on the latest data.")
     
-    forecaster = InventoryForecaster(db)
+    registry = get_model_registry(db)
+    # Training runs on a background worker; the buttons only submit jobs
+    queue = ensure_worker(db)
     
     # Tabs for different analyses
-    tab1, tab2 = st.tabs(["📊 Regression Analysis", "🧠 LSTM Forecasting"])
+    tab1, tab2 = st.tabs(["📊 SKU Stock Regression", "🧠 LSTM Forecasting"])
     
     with tab1:
-        st.subheader("Multi-Model Regression Comparison")
+        st.subheader("Per-SKU Stock Level Regression")
         st.markdown("""
         Compare **Linear Regression**, **Polynomial Regression**, and **Ridge Regression** models side-by-side.
-        Each model predicts inventory stock levels based on consumption patterns and pricing data.
+        Each model is fitted across SKUs: it predicts a SKU's **current stock** from its average daily
+        consumption over the last 30 and 90 days, its days with consumption, unit price and minimum stock.
+        It explains today's stocking levels; it does not forecast stock over time.
         """)
         
+        fingerprint = data_fingerprint(db, REGRESSION_KIND)
+        
         # Auto-display cached results if available
         if 'regression_results' in st.session_state and st.session_state['regression_results'] is not None:
             results = st.session_state['regression_results']
             st.info("📊 **Showing cached results.** Click 'Train & Compare' button to refresh with latest data.")
         else:
-            results = None
+            stored = registry.load(REGRESSION_KIND, REGRESSION_PARAMS, fingerprint)
+            results = stored['results'] if stored else None
+            if results is not None:
+                st.session_state['regression_results'] = results
+                st.info(f"📦 **Loaded saved models** trained {stored['created_at']} on the current data.")
         
         if st.button("🔄 Train & Compare All Regression Models", key="train_regression"):
-            with st.spinner("Training all regression models on complete dataset..."):
-                try:
-                    results = forecaster.train_regression_models()
-                    
-                    if results is None:
-                        st.warning("⚠️ Insufficient data for regression analysis. Need at least 10 items with consumption history.")
-                        if 'regression_results' in st.session_state:
-                            del st.session_state['regression_results']
-                    else:
-                        # Cache results in session state
-                        st.session_state['regression_results'] = results
-                except Exception as e:
-                    st.error(f"Error during regression analysis: {str(e)}")
-                    results = None
+            try:
+                # Joins an identical queued or finished job instead of training again
+                job = queue.submit(REGRESSION_KIND, REGRESSION_PARAMS, fingerprint)
+                st.session_state['regression_job'] = job['job_id']
+            except Exception as e:
+                st.error(f"Error submitting regression training: {str(e)}")
+        
+        job, trained = _collect_job(queue, 'regression_job')
+        if job is not None and job['status'] == 'failed':
+            st.error(f"Error during regression analysis: {job['error']}")
+        elif job is not None and job['status'] == 'done':
+            if trained is None:
+                st.warning("⚠️ Insufficient data for regression analysis. Need at least 10 items with consumption history.")
+                if 'regression_results' in st.session_state:
+                    del st.session_state['regression_results']
+                results = None
+            else:
+                # Cache results in session state
+                st.session_state['regression_results'] = results = trained
         
         # Display results if available
         if results is not None:
@@ -92,7 +217,7 @@ def regression_lstm_analysis_page(db):
                 
                 # Display plots
                 st.markdown("### 📈 Visual Comparison: Actual vs Predicted")
-                fig = forecaster.create_regression_plots(results)
+                fig = _regression_figure(results)
                 if fig:
                     st.plotly_chart(fig, use_container_width=True)
                 
@@ -125,7 +250,7 @@ def regression_lstm_analysis_page(db):
                         <li><strong>Mean Absolute Error:</strong> {best_mae:.2f} units</li>
                         <li><strong>Root Mean Squared Error:</strong> {best_rmse:.2f} units</li>
                     </ul>
-                    <p><em>This model shows the best performance for predicting stock levels based on historical data.</em></p>
+                    <p><em>This model best explains each SKU's current stock from its consumption, price and minimum stock.</em></p>
                 </div>
                 """, unsafe_allow_html=True)
             except Exception as e:
@@ -152,29 +277,53 @@ def regression_lstm_analysis_page(db):
         """)
         
         forecast_days = st.slider("Forecast Horizon (days)", min_value=7, max_value=90, value=30, step=7)
+        backends = {name: description for name, description in available_backends().items()
+                    if name not in (REGRESSION_KIND, 'backtest')}
+        backend = st.selectbox(
+            "Forecasting backend", list(backends), index=list(backends).index(DEFAULT_BACKEND),
+            format_func=lambda name: f"{name} — {backends[name]}",
+            help="The statistical backend needs only NumPy; the LSTM backends load TensorFlow when they train"
+        )
+        best_forecaster = _backtest_section(queue, registry, data_fingerprint(db, 'backtest'), forecast_days)
+        fingerprint = data_fingerprint(db, backend)
+        forecast_params = {'forecast_days': forecast_days}
+        if backend == 'statistical' and best_forecaster not in (None, 'auto'):
+            forecast_params['method'] = best_forecaster
+            st.caption(f"Statistical backend fits {best_forecaster} for every SKU, as selected by the backtest.")
         
         # Auto-display cached results if available
         if 'lstm_results' in st.session_state and st.session_state['lstm_results'] is not None:
             lstm_results = st.session_state['lstm_results']
             st.info("📊 **Showing cached results.** Click 'Train LSTM' button to refresh with latest data.")
         else:
-            lstm_results = None
+            stored = registry.load(backend, forecast_params, fingerprint)
+            lstm_results = stored['results'] if stored else None
+            if lstm_results is not None:
+                st.session_state['lstm_results'] = lstm_results
+                st.info(f"📦 **Loaded saved forecast** trained {stored['created_at']} on the current data.")
         
         if st.button("🚀 Train LSTM & Generate Forecast", key="train_lstm"):
-            with st.spinner(f"Training LSTM model and forecasting next {forecast_days} days..."):
-                try:
-                    lstm_results = forecaster.train_lstm_model(forecast_days=forecast_days)
-                    
-                    if lstm_results is None:
-                        st.warning("⚠️ Insufficient data for LSTM forecasting. Need at least 30 days of consumption history.")
-                        if 'lstm_results' in st.session_state:
-                            del st.session_state['lstm_results']
-                    else:
-                        # Cache results in session state
-                        st.session_state['lstm_results'] = lstm_results
-                except Exception as e:
-                    st.error(f"Error during LSTM forecasting: {str(e)}")
-                    lstm_results = None
+            try:
+                job = queue.submit(backend, forecast_params, fingerprint)
+                st.session_state['lstm_job'] = job['job_id']
+            except Exception as e:
+                st.error(f"Error submitting LSTM training: {str(e)}")
+        
+        job, trained = _collect_job(queue, 'lstm_job')
+        if job is not None and job['status'] == 'failed':
+            st.error(f"Error during LSTM forecasting: {job['error']}")
+        elif job is not None and job['status'] == 'done':
+            if trained is None:
+                st.warning("⚠️ Insufficient data for LSTM forecasting. Need at least 30 days of consumption history.")
+                if 'lstm_results' in st.session_state:
+                    del st.session_state['lstm_results']
+                lstm_results = None
+            else:
+                # Cache results in session state
+                st.session_state['lstm_results'] = lstm_results = trained
+                if 'training_mode' in trained:
+                    st.caption(f"Training mode: {trained['training_mode']} "
+                               f"({trained['training_reason']}, {trained['training_seconds']:.1f}s)")
         
         # Display results if available
         if lstm_results is not None:
@@ -205,7 +354,9 @@ def regression_lstm_analysis_page(db):
                 
                 # Display plot
                 st.markdown("### 📈 LSTM Forecast Visualization")
-                fig = forecaster.create_lstm_plot(results)
+                fig = _forecast_figure(results)
+                if fig is None:
+                    fig = _inventory_forecaster(db).create_lstm_plot(results)
                 if fig:
                     st.plotly_chart(fig, use_container_width=True)
                 
@@ -0,0 +1,175 @@
+"""
+Replenishment
+Order quantity and timing for the whole catalog in one vectorized pass, then
+the order set that fits a purchasing budget.
+
+Every SKU gets a reorder point (lead-time demand plus safety stock, with the
+supplier's lead time), an economic order quantity and the number of days
+until it reaches its reorder point. SKUs at or below it order now, in whole
+packs. Under a budget, orders are funded most urgent first (fewest days of
+stock left): first the part that brings each SKU back to its reorder point,
+then the top-ups to a full EOQ with what is left. An order that does not fit
+is skipped and the next, cheaper one is tried.
+
+The catalog inputs are cached on the change counters of the columns they
+read, so planning again under another budget only repeats the NumPy pass.
+"""
+
+from typing import Any, Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from consumption_rollups import days_ago
+from recommendation_cache import get_recommendation_cache
+from table_versions import dependency_counters
+from utils import (
+    HOLDING_COST_RATE, ORDERING_COST, calculate_eoq_array, calculate_order_quantity_array,
+    get_catalog_safety_stock,
+)
+
+# Columns get_catalog_safety_stock reads, directly or through the demand
+# statistics store and the stored forecasts
+CATALOG_DEPENDENCIES = {
+    'inventory': ('id', 'drug_name', 'current_stock', 'minimum_stock', 'unit_price',
+                  'tablets_per_sheet', 'supplier_name'),
+    'consumption_patterns': ('drug_id', 'date', 'quantity_consumed'),
+    'suppliers': ('name', 'lead_time_days'),
+    'forecast_runs': (),
+}
+
+
+def _first_fit(cost: np.ndarray, budget: float) -> np.ndarray:
+    """
+    Mask of the items a greedy pass in the given order can pay for, skipping
+    items that no longer fit
+
+    Each round drops the items dearer than what is left, takes the prefix
+    that fits with one cumulative sum and skips the item after it, so the
+    number of rounds is the number of skipped items still affordable at the
+    time, not the number of items.
+    """
+    taken = np.zeros(len(cost), dtype=bool)
+    left = budget
+    candidates = np.arange(len(cost))
+    while len(candidates):
+        candidates = candidates[cost[candidates] <= left]
+        if not len(candidates):
+            break
+        cumulative = np.cumsum(cost[candidates])
+        fits = int(np.searchsorted(cumulative, left, side='right'))
+        taken[candidates[:fits]] = True
+        left -= cumulative[fits - 1]
+        candidates = candidates[fits + 1:]
+    return taken
+
+
+def allocate_budget(order_quantity: np.ndarray, essential_quantity: np.ndarray,
+                    unit_price: np.ndarray, urgency: np.ndarray,
+                    budget: Optional[float] = None) -> np.ndarray:
+    """
+    Units to order per SKU within budget
+
+    essential_quantity (at most order_quantity) is funded first for every
+    SKU, lowest urgency value first, then the rest of order_quantity in the
+    same order. Without a budget every order is funded in full.
+    """
+    if budget is None:
+        return order_quantity.copy()
+    order = np.argsort(urgency, kind='stable')
+    essential_cost = (essential_quantity * unit_price)[order]
+    funded = _first_fit(essential_cost, budget)
+    left = budget - essential_cost[funded].sum()
+
+    # Top-ups only for SKUs whose essential part was funded (or had none)
+    top_up = order_quantity[order] - essential_quantity[order]
+    top_up_cost = np.where(funded | (essential_quantity[order] == 0), top_up * unit_price[order], np.inf)
+    topped_up = _first_fit(top_up_cost, left) & (top_up > 0)
+
+    planned = np.zeros_like(order_quantity)
+    planned[order] = (np.where(funded, essential_quantity[order], 0)
+                      + np.where(topped_up, top_up, 0))
+    return planned
+
+
+def plan_replenishment(plan: pd.DataFrame, budget: Optional[float] = None,
+                       ordering_cost: float = ORDERING_COST,
+                       holding_cost_rate: float = HOLDING_COST_RATE) -> pd.DataFrame:
+    """
+    Add order sizing, timing and budget allocation to a
+    get_catalog_safety_stock() frame
+
+    Adds eoq, days_of_stock (inf without demand), days_until_order (0 when
+    due now, NaN for SKUs without demand that are above their minimum),
+    order_by, order_quantity and order_cost (what is due now), and
+    planned_quantity and planned_cost (what the budget funds).
+    """
+    current_stock = plan['current_stock'].to_numpy(dtype=np.float64)
+    minimum_stock = plan['minimum_stock'].to_numpy(dtype=np.float64)
+    usage = plan['avg_daily_usage'].to_numpy(dtype=np.float64)
+    unit_price = plan['unit_price'].to_numpy(dtype=np.float64)
+    pack_size = np.maximum(plan['pack_size'].to_numpy(dtype=np.float64), 1)
+    trigger = np.maximum(plan['reorder_point'].to_numpy(dtype=np.float64), minimum_stock)
+
+    eoq = calculate_eoq_array(usage, unit_price, ordering_cost, holding_cost_rate)
+    order_quantity = calculate_order_quantity_array(current_stock, minimum_stock, trigger, eoq, pack_size)
+    essential_quantity = np.minimum(
+        order_quantity,
+        (np.ceil(np.maximum(trigger - current_stock, 0) / pack_size) * pack_size).astype(np.int64)
+    )
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        days_until_order = np.where(usage > 0, np.floor(np.maximum(current_stock - trigger, 0) / usage),
+                                    np.where(current_stock <= trigger, 0, np.nan))
+        days_of_stock = np.where(usage > 0, current_stock / usage, np.inf)
+    due_in = np.where(np.isnan(days_until_order), 0, days_until_order).astype('timedelta64[D]')
+    order_by = (np.datetime64(days_ago(0), 'D') + due_in).astype(object)
+
+    plan = plan.copy()
+    plan['eoq'] = np.round(eoq, 1)
+    plan['days_of_stock'] = days_of_stock
+    plan['days_until_order'] = days_until_order
+    plan['order_by'] = np.where(np.isnan(days_until_order), None, order_by)
+    plan['order_quantity'] = order_quantity
+    plan['order_cost'] = order_quantity * unit_price
+    plan['planned_quantity'] = allocate_budget(order_quantity, essential_quantity, unit_price,
+                                               days_of_stock, budget)
+    plan['planned_cost'] = plan['planned_quantity'] * unit_price
+    return plan
+
+
+def _catalog(db, service_level: float, window_days: int) -> pd.DataFrame:
+    """get_catalog_safety_stock(), reused while today's inputs are unchanged"""
+    cache = get_recommendation_cache(db)
+    if cache is None:
+        return get_catalog_safety_stock(db, service_level, window_days=window_days)
+    versions = cache.versions()
+    key = ('replenishment_catalog', service_level, window_days, days_ago(0),
+           tuple(versions.get(counter) for counter in dependency_counters(CATALOG_DEPENDENCIES)))
+    catalog = cache.get(key)
+    if catalog is None:
+        catalog = get_catalog_safety_stock(db, service_level, window_days=window_days)
+        cache.put(key, catalog)
+    return catalog
+
+
+def get_replenishment_plan(db, budget: Optional[float] = None, service_level: float = 0.95,
+                           window_days: int = 90, ordering_cost: float = ORDERING_COST,
+                           holding_cost_rate: float = HOLDING_COST_RATE) -> Dict[str, Any]:
+    """
+    Replenishment plan for every SKU
+
+    Returns {'plan': one row per inventory item (see plan_replenishment),
+    'orders': the funded orders, most urgent first, 'budget', 'planned_cost',
+    'unfunded_cost': cost of the orders due now that the budget left out}.
+    """
+    plan = plan_replenishment(_catalog(db, service_level, window_days), budget, ordering_cost, holding_cost_rate)
+    orders = plan[plan['planned_quantity'] > 0].sort_values('days_of_stock', kind='stable')
+    planned_cost = float(plan['planned_cost'].sum())
+    return {
+        'plan': plan,
+        'orders': orders,
+        'budget': budget,
+        'planned_cost': planned_cost,
+        'unfunded_cost': float(plan['order_cost'].sum()) - planned_cost,
+    }
@@ -0,0 +1,252 @@
+"""
+SKU Classification
+ABC classes by share of inventory value and XYZ classes by demand
+variability, kept per SKU in sku_classes.
+
+ABC ranks SKUs by stock value (current_stock * unit_price): A up to 70% of
+the cumulative value, B up to 90%, C the rest. XYZ bins the coefficient of
+variation (std / mean) of daily demand over the last 90 days, from the
+demand statistics store: X up to 0.5, Y up to 1.0, Z above that or without
+demand. Both bin with np.searchsorted over the whole catalog at once.
+
+Triggers note every SKU whose stock value or demand statistics change in
+sku_class_dirty. refresh_sku_classes() does nothing while that is empty.
+Otherwise it reads just the noted SKUs into the catalog arrays it keeps in
+memory from the previous run, rebins, and writes only the SKUs whose class
+moved across a boundary. A process without those arrays, or whose arrays
+another process has since superseded, loads the whole catalog once.
+"""
+
+import threading
+import uuid
+from datetime import datetime
+from typing import Any, Dict, Optional, Sequence
+
+import numpy as np
+
+from demand_stats import DEFAULT_WINDOWS, refresh_demand_stats
+
+ABC_CLASSES = ('A', 'B', 'C')
+XYZ_CLASSES = ('X', 'Y', 'Z')
+# Upper bounds (inclusive) of every class but the last
+ABC_THRESHOLDS = (70.0, 90.0)  # cumulative share of inventory value, %
+XYZ_THRESHOLDS = (0.5, 1.0)  # coefficient of variation of daily demand
+
+# Window of the demand statistics XYZ is computed from
+DEMAND_WINDOW_DAYS = 90
+# Above this share of dirty SKUs, rereading the catalog beats lookups by key
+FULL_RELOAD_SHARE = 0.2
+LOOKUP_CHUNK = 500
+
+SKU_CLASS_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS sku_classes (
+    drug_id INTEGER PRIMARY KEY,
+    abc_class TEXT NOT NULL,
+    xyz_class TEXT NOT NULL,
+    changed_at TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_sku_classes_class ON sku_classes (abc_class, xyz_class);
+
+CREATE TABLE IF NOT EXISTS sku_class_state (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    token TEXT NOT NULL,
+    bounds TEXT NOT NULL,
+    sku_count INTEGER NOT NULL,
+    classified_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS sku_class_dirty (
+    drug_id INTEGER PRIMARY KEY
+);
+
+CREATE TRIGGER IF NOT EXISTS trg_sku_class_dirty_insert
+AFTER INSERT ON inventory
+BEGIN
+    INSERT OR IGNORE INTO sku_class_dirty (drug_id) VALUES (NEW.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_sku_class_dirty_delete
+AFTER DELETE ON inventory
+BEGIN
+    INSERT OR IGNORE INTO sku_class_dirty (drug_id) VALUES (OLD.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_sku_class_dirty_value
+AFTER UPDATE OF current_stock, unit_price ON inventory
+WHEN OLD.current_stock IS NOT NEW.current_stock OR OLD.unit_price IS NOT NEW.unit_price
+BEGIN
+    INSERT OR IGNORE INTO sku_class_dirty (drug_id) VALUES (NEW.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_sku_class_dirty_demand
+AFTER INSERT ON demand_stats
+WHEN NEW.window_days = {DEMAND_WINDOW_DAYS}
+BEGIN
+    INSERT OR IGNORE INTO sku_class_dirty (drug_id) VALUES (NEW.drug_id);
+END;
+"""
+
+BOUNDS = repr((ABC_THRESHOLDS, XYZ_THRESHOLDS))
+
+
+def abc_class_index(cumulative_percentage: np.ndarray) -> np.ndarray:
+    """0 (A), 1 (B) or 2 (C) per cumulative value share in %; NaN is C"""
+    return np.searchsorted(ABC_THRESHOLDS, cumulative_percentage, side='left')
+
+
+def cumulative_value_share(values: np.ndarray) -> np.ndarray:
+    """
+    Cumulative share (%) of total value at each SKU, ranked by value,
+    highest first, in input order
+
+    Ties keep their input order, so the ranking is stable between runs.
+    """
+    order = np.argsort(-values, kind='stable')
+    cumulative = np.cumsum(values[order])
+    total = cumulative[-1] if len(cumulative) else 0.0
+    share = np.empty(len(values))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        share[order] = cumulative / total * 100
+    return share
+
+
+def xyz_class_index(mean: np.ndarray, std: np.ndarray) -> np.ndarray:
+    """0 (X), 1 (Y) or 2 (Z) per SKU from daily demand; SKUs without demand are Z"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cv = np.where(mean > 0, std / mean, np.inf)
+    return np.searchsorted(XYZ_THRESHOLDS, cv, side='left')
+
+
+class _Catalog:
+    """Classification inputs and classes of every SKU, aligned on ascending drug_ids"""
+
+    __slots__ = ('token', 'drug_ids', 'values', 'mean', 'std', 'codes')
+
+    def __init__(self, drug_ids, values, mean, std):
+        self.token = None
+        self.drug_ids, self.values, self.mean, self.std = drug_ids, values, mean, std
+        self.codes = np.full(len(drug_ids), -1)
+
+    def classify(self) -> np.ndarray:
+        """3 * ABC index + XYZ index per SKU"""
+        return (3 * abc_class_index(cumulative_value_share(self.values))
+                + xyz_class_index(self.mean, self.std))
+
+
+_catalogs: Dict[str, _Catalog] = {}
+_catalogs_lock = threading.Lock()
+
+
+def _database_path(conn) -> str:
+    return next(row[2] for row in conn.execute("PRAGMA database_list") if row[1] == 'main')
+
+
+def _stats_for(drug_ids: np.ndarray, mean: np.ndarray, std: np.ndarray, rows) -> None:
+    """Fill mean and std (aligned on drug_ids) from (drug_id, mean, std) rows"""
+    data = np.array(rows, dtype=np.float64).reshape(-1, 3)
+    position = np.searchsorted(drug_ids, data[:, 0].astype(np.int64))
+    known = position < len(drug_ids)
+    known[known] = drug_ids[position[known]] == data[known, 0]
+    mean[position[known]], std[position[known]] = data[known, 1], data[known, 2]
+
+
+def _load_catalog(conn) -> _Catalog:
+    """Every SKU's inputs, with the classes stored for it"""
+    data = np.array(conn.execute(
+        "SELECT id, COALESCE(current_stock * unit_price, 0) FROM inventory ORDER BY id"
+    ).fetchall(), dtype=np.float64).reshape(-1, 2)
+    drug_ids = data[:, 0].astype(np.int64)
+    catalog = _Catalog(drug_ids, data[:, 1], np.zeros(len(drug_ids)), np.zeros(len(drug_ids)))
+    _stats_for(drug_ids, catalog.mean, catalog.std, conn.execute(
+        "SELECT drug_id, mean, std FROM demand_stats WHERE window_days = ?", (DEMAND_WINDOW_DAYS,)
+    ).fetchall())
+
+    codes = {f'{abc}{xyz}': 3 * i + j for i, abc in enumerate(ABC_CLASSES) for j, xyz in enumerate(XYZ_CLASSES)}
+    stored = conn.execute("SELECT drug_id, abc_class || xyz_class FROM sku_classes").fetchall()
+    stored_ids = np.fromiter((row[0] for row in stored), dtype=np.int64, count=len(stored))
+    position = np.searchsorted(drug_ids, stored_ids)
+    known = position < len(drug_ids)
+    known[known] = drug_ids[position[known]] == stored_ids[known]
+    stored_codes = np.fromiter((codes[row[1]] for row in stored), dtype=np.int64, count=len(stored))
+    catalog.codes[position[known]] = stored_codes[known]
+    return catalog
+
+
+def _update_catalog(conn, catalog: _Catalog, dirty: np.ndarray) -> np.ndarray:
+    """Reread the dirty SKUs by key into catalog; returns the ids no longer in inventory"""
+    current, stats = [], []
+    for start in range(0, len(dirty), LOOKUP_CHUNK):
+        chunk = dirty[start:start + LOOKUP_CHUNK].tolist()
+        placeholders = ', '.join('?' * len(chunk))
+        current += conn.execute(f"""
+            SELECT id, COALESCE(current_stock * unit_price, 0) FROM inventory WHERE id IN ({placeholders})
+        """, chunk).fetchall()
+        stats += conn.execute(f"""
+            SELECT drug_id, mean, std FROM demand_stats WHERE window_days = ? AND drug_id IN ({placeholders})
+        """, [DEMAND_WINDOW_DAYS] + chunk).fetchall()
+    present = np.array(sorted(row[0] for row in current), dtype=np.int64)
+
+    removed = np.setdiff1d(dirty, present, assume_unique=True)
+    keep = ~np.isin(catalog.drug_ids, removed)
+    added = np.setdiff1d(present, catalog.drug_ids, assume_unique=True)
+    at = np.searchsorted(catalog.drug_ids[keep], added)
+    catalog.drug_ids = np.insert(catalog.drug_ids[keep], at, added)
+    catalog.values = np.insert(catalog.values[keep], at, 0.0)
+    catalog.mean = np.insert(catalog.mean[keep], at, 0.0)
+    catalog.std = np.insert(catalog.std[keep], at, 0.0)
+    catalog.codes = np.insert(catalog.codes[keep], at, -1)
+
+    position = np.searchsorted(catalog.drug_ids, present)
+    catalog.values[position] = [value for _, value in sorted(current)]
+    catalog.mean[position] = 0.0
+    catalog.std[position] = 0.0
+    _stats_for(catalog.drug_ids, catalog.mean, catalog.std, stats)
+    return removed
+
+
+def refresh_sku_classes(conn, windows: Sequence[int] = DEFAULT_WINDOWS) -> Dict[str, Any]:
+    """
+    Bring sku_classes up to date, refreshing the demand statistics first
+
+    Returns {'mode': 'current' | 'incremental' | 'full', 'dirty': SKUs
+    reread, 'changed': SKUs whose class was written, 'removed': SKUs no
+    longer in inventory}. Run it inside one write transaction.
+    """
+    refresh_demand_stats(conn, sorted(set(windows) | {DEMAND_WINDOW_DAYS}))
+    state = conn.execute("SELECT token, bounds FROM sku_class_state").fetchone()
+    dirty = np.array([row[0] for row in conn.execute("SELECT drug_id FROM sku_class_dirty ORDER BY drug_id")],
+                     dtype=np.int64)
+    if state is not None and state[1] == BOUNDS and not len(dirty):
+        return {'mode': 'current', 'dirty': 0, 'changed': 0, 'removed': 0}
+
+    key = _database_path(conn)
+    with _catalogs_lock:
+        catalog: Optional[_Catalog] = _catalogs.pop(key, None)
+    if (catalog is not None and state is not None and catalog.token == state[0]
+            and len(dirty) <= FULL_RELOAD_SHARE * len(catalog.drug_ids)):
+        mode = 'incremental'
+        removed = _update_catalog(conn, catalog, dirty)
+    else:
+        mode = 'full'
+        catalog = _load_catalog(conn)
+        stored = [row[0] for row in conn.execute("SELECT drug_id FROM sku_classes")]
+        removed = np.setdiff1d(np.array(stored, dtype=np.int64), catalog.drug_ids)
+
+    codes = catalog.classify()
+    changed = np.flatnonzero(codes != catalog.codes)
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    conn.executemany("DELETE FROM sku_classes WHERE drug_id = ?", ((drug_id,) for drug_id in removed.tolist()))
+    conn.executemany(
+        "INSERT OR REPLACE INTO sku_classes (drug_id, abc_class, xyz_class, changed_at) VALUES (?, ?, ?, ?)",
+        ((drug_id, ABC_CLASSES[code // 3], XYZ_CLASSES[code % 3], now)
+         for drug_id, code in zip(catalog.drug_ids[changed].tolist(), codes[changed].tolist()))
+    )
+    conn.execute("DELETE FROM sku_class_dirty")
+    # A fresh token on every run, so arrays from a rolled-back run never match
+    catalog.token, catalog.codes = uuid.uuid4().hex, codes
+    conn.execute("INSERT OR REPLACE INTO sku_class_state VALUES (1, ?, ?, ?, ?)",
+                 (catalog.token, BOUNDS, len(catalog.drug_ids), now))
+    with _catalogs_lock:
+        _catalogs[key] = catalog
+    return {'mode': mode, 'dirty': len(dirty), 'changed': len(changed), 'removed': len(removed)}
@@ -3,16 +3,89 @@ Enhanced Smart Recommendation Engine
 AI-powered intelligent recommendations with user behavior tracking and trend analysis
 """
 
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
 from scipy import stats
 
+from consumption_rollups import rollup_periods_sql, rollup_window_sql, days_ago
+from db_connection import connection, get_pool
+from expiry_calendar import epoch_day
+from forecast_store import forecast_daily_demand_sql
+from query_profiler import record_swallowed_exception
+from recommendation_cache import get_recommendation_cache
+from table_versions import dependency_counters
+from utils import (
+    DEFAULT_LEAD_TIME_DAYS, DEMAND_STD_WINDOW_DAYS, calculate_eoq_array, calculate_order_quantity_array,
+    calculate_reorder_point_array, calculate_safety_stock_array, _refresh_demand_std,
+)
+
 class SmartRecommendationEngine:
     """Enhanced intelligent recommendation system with ML-driven insights"""
     
-    def __init__(self, db_manager):
+    # (analysis, candidate builder, describer) triples, in the order candidates are ranked
+    ANALYSES = (
+        ('_analyze_low_stock_items', '_stock_candidates', '_describe_stock'),
+        ('_analyze_expiring_items', '_expiry_candidates', '_describe_expiry'),
+        ('_analyze_overstock_items', '_overstock_candidates', '_describe_overstock'),
+        ('_analyze_slow_moving_items', '_slow_mover_candidates', '_describe_slow_mover'),
+        ('_analyze_high_demand_items', '_demand_candidates', '_describe_demand'),
+        ('_analyze_seasonal_opportunities', '_seasonal_candidates', '_describe_seasonal'),
+        ('_analyze_supplier_performance', '_supplier_candidates', '_describe_supplier'),
+    )
+    
+    # Columns each analysis reads; an update to any other column, or a write to
+    # another table, leaves its cached result valid
+    _CONSUMPTION = ('drug_id', 'date', 'quantity_consumed')
+    ANALYSIS_DEPENDENCIES = {
+        '_analyze_low_stock_items': {
+            'inventory': ('id', 'drug_name', 'category', 'current_stock', 'minimum_stock', 'unit_price',
+                          'tablets_per_sheet', 'supplier_name'),
+            'consumption_patterns': _CONSUMPTION,
+            'forecast_runs': (),
+            'suppliers': ('name', 'lead_time_days')
+        },
+        '_analyze_expiring_items': {
+            'inventory': ('id', 'drug_name', 'category', 'current_stock', 'expiry_date', 'unit_price'),
+            'consumption_patterns': _CONSUMPTION
+        },
+        '_analyze_overstock_items': {
+            'inventory': ('id', 'drug_name', 'category', 'current_stock', 'minimum_stock', 'unit_price'),
+            'consumption_patterns': _CONSUMPTION
+        },
+        '_analyze_slow_moving_items': {
+            'inventory': ('id', 'drug_name', 'category', 'current_stock', 'unit_price'),
+            'consumption_patterns': _CONSUMPTION
+        },
+        '_analyze_high_demand_items': {
+            'inventory': ('id', 'drug_name', 'category', 'current_stock', 'minimum_stock', 'unit_price'),
+            'consumption_patterns': _CONSUMPTION
+        },
+        '_analyze_seasonal_opportunities': {
+            'inventory': ('id', 'drug_name', 'category'),
+            'consumption_patterns': _CONSUMPTION
+        },
+        '_analyze_supplier_performance': {
+            'suppliers': ('name', 'reliability_score', 'quality_score', 'cost_rating', 'lead_time_days')
+        },
+    }
+    
+    TOP_K = 20
+    
+    LEVELS = ('Critical', 'High', 'Medium', 'Low')
+    IMPACT_MULTIPLIERS = np.array([1.5, 1.3, 1.0, 0.7])
+    URGENCY_MULTIPLIERS = np.array([1.6, 1.3, 1.0, 0.6])
+    
+    def __init__(self, db_manager, parallel=True, max_workers=4, use_cache=True):
         self.db = db_manager
+        self.parallel = parallel
+        self.max_workers = max_workers
+        self.use_cache = use_cache
+        # Wall time in ms of each analysis query run by the last call
+        self.last_timings = {}
         
     def get_personalized_recommendations(self, user_role='pharmacist', user_id=None):
         """
@@ -20,378 +93,520 @@ class SmartRecommendationEngine:
         
         Integrates multiple data sources and applies intelligent priority scoring
         """
-        recommendations = []
+        cache = get_recommendation_cache(self.db) if self.use_cache else None
+        if cache is None:
+            return self._rank(self._score_analyses(self._run_analyses()))
         
-        low_stock = self._analyze_low_stock_items()
-        expiring_items = self._analyze_expiring_items()
-        overstock = self._analyze_overstock_items()
-        slow_movers = self._analyze_slow_moving_items()
-        high_demand = self._analyze_high_demand_items()
-        seasonal_opportunities = self._analyze_seasonal_opportunities()
-        supplier_issues = self._analyze_supplier_performance()
+        # Results computed today from the same column versions are still exact
+        versions = cache.versions()
+        today = days_ago(0)
+        analysis_keys = {
+            analysis: ('analysis', analysis, today, tuple(
+                versions.get(counter) for counter in dependency_counters(self.ANALYSIS_DEPENDENCIES[analysis])
+            ))
+            for analysis, _, _ in self.ANALYSES
+        }
+        key = ('recommendations', user_role, tuple(analysis_keys.values()))
+        recommendations = cache.get(key)
+        if recommendations is None:
+            recommendations = self._rank(self._update_analyses(cache, analysis_keys))
+            cache.put(key, recommendations)
+        else:
+            self.last_timings = {}
+        
+        return [dict(recommendation) for recommendation in recommendations]
+    
+    def _update_analyses(self, cache, analysis_keys):
+        """
+        (frame, scored candidates) per analysis, rerunning only those whose inputs changed
         
-        recommendations.extend(self._generate_stock_recommendations(low_stock))
-        recommendations.extend(self._generate_expiry_recommendations(expiring_items))
-        recommendations.extend(self._generate_overstock_recommendations(overstock))
-        recommendations.extend(self._generate_slow_mover_recommendations(slow_movers))
-        recommendations.extend(self._generate_demand_recommendations(high_demand))
-        recommendations.extend(self._generate_seasonal_recommendations(seasonal_opportunities))
-        recommendations.extend(self._generate_supplier_recommendations(supplier_issues))
+        Unaffected analyses keep their previously scored candidates, which are
+        merged with the recomputed ones by _rank.
+        """
+        entries = {}
+        for analysis, analysis_key in analysis_keys.items():
+            entry = cache.get(analysis_key)
+            if entry is not None:
+                entries[analysis] = entry
         
-        scored_recommendations = self._score_recommendations(recommendations)
+        stale = [analysis for analysis in analysis_keys if analysis not in entries]
+        recomputed = self._score_analyses(self._run_analyses(stale))
+        for analysis, entry in recomputed.items():
+            cache.put(analysis_keys[analysis], entry)
+        entries.update(recomputed)
+        return entries
+    
+    def _score_analyses(self, results):
+        """Pair each analysis frame with its scored top candidates"""
+        indexes = {analysis: index for index, (analysis, _, _) in enumerate(self.ANALYSES)}
+        return {
+            analysis: (df, self._scored_candidates(indexes[analysis], df))
+            for analysis, df in results.items()
+        }
+    
+    def _rank(self, entries):
+        """Top recommendations over the scored candidates of every analysis"""
+        merged = pd.concat([entries[analysis][1] for analysis, _, _ in self.ANALYSES], ignore_index=True)
+        top = self._top_k(merged['priority_score'].to_numpy(), self.TOP_K)
         
-        return sorted(scored_recommendations, key=lambda x: x['priority_score'], reverse=True)[:20]
+        return [self._materialize(entries, candidate) for candidate in merged.iloc[top].to_dict('records')]
+    
+    def _timed_analysis(self, analysis):
+        started = time.perf_counter()
+        df = getattr(self, analysis)()
+        return df, (time.perf_counter() - started) * 1000
+    
+    def _run_analyses(self, names=None):
+        """
+        Run the named analysis queries (all by default), concurrently when parallel is set
+        
+        Each worker borrows its own read-only connection from the pool, so the
+        total latency is that of the slowest query rather than the sum.
+        """
+        if names is None:
+            names = [analysis for analysis, _, _ in self.ANALYSES]
+        started = time.perf_counter()
+        if '_analyze_low_stock_items' in names:
+            # Once, before the workers start, so they all stay on read-only connections
+            _refresh_demand_std(self.db)
+        
+        if self.parallel and self.max_workers > 1 and len(names) > 1:
+            # Create the shared pool once here rather than racing in the workers
+            get_pool(self.db)
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(names)),
+                                    thread_name_prefix='recommendation-analysis') as executor:
+                outcomes = list(executor.map(self._timed_analysis, names))
+        else:
+            outcomes = [self._timed_analysis(name) for name in names]
+        
+        self.last_timings = {name: elapsed for name, (_, elapsed) in zip(names, outcomes)}
+        self.last_timings['total_ms'] = (time.perf_counter() - started) * 1000
+        return {name: df for name, (df, _) in zip(names, outcomes)}
     
     def _analyze_low_stock_items(self):
-        """Identify items with critical stock levels"""
-        conn = self.db.get_connection()
-        query = """
-            SELECT i.drug_name, i.category, i.current_stock, i.minimum_stock,
-                   i.unit_price, (i.minimum_stock - i.current_stock) as shortage,
-                   COALESCE(AVG(cp.quantity_consumed), 0) as avg_daily_consumption
-            FROM inventory i
-            LEFT JOIN consumption_patterns cp ON i.id = cp.drug_id
-              AND cp.date >= DATE('now', '-30 days')
-            WHERE i.current_stock < i.minimum_stock
-            GROUP BY i.drug_name, i.category, i.current_stock, i.minimum_stock, i.unit_price
-            ORDER BY shortage DESC
-            LIMIT 20
         """
-        df = pd.read_sql_query(query, conn)
-        conn.close()
-        return df
+        Identify items with critical stock levels
+        
+        Daily demand is the stored forecast over the next 30 days where there
+        is one, else the last 30 days' average consumption. order_quantity is
+        sized with the supplier's lead time and the demand std from
+        demand_stats (refreshed by _run_analyses), as in
+        utils.get_reorder_alerts.
+        """
+        with connection(self.db) as conn:
+            window_sql, params = rollup_window_sql(days_ago(30))
+            forecast_sql, forecast_params = forecast_daily_demand_sql('i.id', days_ago(0), 30)
+            query = f"""
+                SELECT i.drug_name, i.category, i.current_stock, i.minimum_stock,
+                       i.unit_price, (i.minimum_stock - i.current_stock) as shortage,
+                       COALESCE(SUM(cw.total_quantity) * 1.0 / SUM(cw.row_count), 0) as avg_daily_consumption,
+                       MAX({forecast_sql}) as forecast_daily_demand,
+                       MAX(COALESCE(s.lead_time_days, ?)) as lead_time_days,
+                       MAX(COALESCE(i.tablets_per_sheet, 1)) as pack_size,
+                       MAX(ds.std) as demand_std
+                FROM inventory i
+                LEFT JOIN ({window_sql}) cw ON i.id = cw.drug_id
+                LEFT JOIN suppliers s ON s.name = i.supplier_name
+                LEFT JOIN demand_stats ds ON ds.window_days = ? AND ds.drug_id = i.id
+                WHERE i.minimum_stock - i.current_stock > 0
+                GROUP BY i.drug_name, i.category, i.current_stock, i.minimum_stock, i.unit_price
+                ORDER BY shortage DESC
+            """
+            df = pd.read_sql_query(query, conn, params=forecast_params + [DEFAULT_LEAD_TIME_DAYS] + params
+                                   + [DEMAND_STD_WINDOW_DAYS])
+        forecasted = df['forecast_daily_demand'].notna()
+        df['demand_source'] = np.where(forecasted, 'forecast', 'history')
+        df['avg_daily_consumption'] = df['forecast_daily_demand'].where(forecasted, df['avg_daily_consumption'])
+        
+        # Same sizing as the reorder alerts and the replenishment planner
+        usage = self._column(df, 'avg_daily_consumption')
+        lead_time = self._column(df, 'lead_time_days')
+        demand_std = self._column(df, 'demand_std')
+        safety_stock = calculate_safety_stock_array(usage, np.where(np.isnan(demand_std), usage * 0.2, demand_std),
+                                                    lead_time)
+        df['order_quantity'] = calculate_order_quantity_array(
+            self._column(df, 'current_stock'), self._column(df, 'minimum_stock'),
+            calculate_reorder_point_array(usage, lead_time, safety_stock),
+            calculate_eoq_array(usage, self._column(df, 'unit_price').clip(min=0)),
+            self._column(df, 'pack_size')
+        )
+        return df.drop(columns=['forecast_daily_demand', 'lead_time_days', 'pack_size', 'demand_std'])
     
     def _analyze_expiring_items(self):
         """Identify items with expiry risks and potential wastage"""
-        conn = self.db.get_connection()
-        query = """
-            SELECT i.drug_name, i.category, i.current_stock, i.expiry_date, i.unit_price,
-                   CAST(JULIANDAY(i.expiry_date) - JULIANDAY('now') AS INTEGER) as days_to_expiry,
-                   (i.current_stock * i.unit_price) as potential_loss,
-                   COALESCE(AVG(cp.quantity_consumed), 0) as avg_daily_consumption
-            FROM inventory i
-            LEFT JOIN consumption_patterns cp ON i.id = cp.drug_id
-              AND cp.date >= DATE('now', '-30 days')
-            WHERE i.expiry_date IS NOT NULL
-              AND JULIANDAY(i.expiry_date) - JULIANDAY('now') BETWEEN 0 AND 90
-              AND i.current_stock > 0
-            GROUP BY i.drug_name, i.category, i.current_stock, i.expiry_date, i.unit_price
-            ORDER BY days_to_expiry
-            LIMIT 20
-        """
-        df = pd.read_sql_query(query, conn)
-        conn.close()
+        with connection(self.db) as conn:
+            window_sql, params = rollup_window_sql(days_ago(30))
+            today = epoch_day()
+            query = f"""
+                SELECT i.drug_name, i.category, i.current_stock, i.expiry_date, i.unit_price,
+                       i.expiry_day - ? as days_to_expiry,
+                       (i.current_stock * i.unit_price) as potential_loss,
+                       COALESCE(SUM(cw.total_quantity) * 1.0 / SUM(cw.row_count), 0) as avg_daily_consumption
+                FROM inventory i
+                LEFT JOIN ({window_sql}) cw ON i.id = cw.drug_id
+                WHERE i.expiry_day BETWEEN ? AND ?
+                  AND i.current_stock > 0
+                GROUP BY i.drug_name, i.category, i.current_stock, i.expiry_date, i.unit_price
+                ORDER BY days_to_expiry
+            """
+            df = pd.read_sql_query(query, conn, params=[today] + params + [today + 1, today + 90])
         return df
     
     def _analyze_overstock_items(self):
         """Identify overstocked items with tied capital"""
-        conn = self.db.get_connection()
-        query = """
-            SELECT i.drug_name, i.category, i.current_stock, i.minimum_stock,
-                   (i.current_stock - i.minimum_stock) as excess_stock,
-                   (i.current_stock * i.unit_price) as tied_capital,
-                   COALESCE(AVG(cp.quantity_consumed), 0) as avg_daily_consumption
-            FROM inventory i
-            LEFT JOIN consumption_patterns cp ON i.id = cp.drug_id
-              AND cp.date >= DATE('now', '-30 days')
-            WHERE i.current_stock > i.minimum_stock * 3
-            GROUP BY i.drug_name, i.category, i.current_stock, i.minimum_stock
-            HAVING avg_daily_consumption < (i.current_stock / 90)
-            ORDER BY tied_capital DESC
-            LIMIT 15
-        """
-        df = pd.read_sql_query(query, conn)
-        conn.close()
+        with connection(self.db) as conn:
+            window_sql, params = rollup_window_sql(days_ago(30))
+            query = f"""
+                SELECT i.drug_name, i.category, i.current_stock, i.minimum_stock,
+                       (i.current_stock - i.minimum_stock) as excess_stock,
+                       (i.current_stock * i.unit_price) as tied_capital,
+                       COALESCE(SUM(cw.total_quantity) * 1.0 / SUM(cw.row_count), 0) as avg_daily_consumption
+                FROM inventory i
+                LEFT JOIN ({window_sql}) cw ON i.id = cw.drug_id
+                WHERE i.current_stock - i.minimum_stock * 3 > 0
+                GROUP BY i.drug_name, i.category, i.current_stock, i.minimum_stock
+                HAVING avg_daily_consumption < (i.current_stock / 90)
+                ORDER BY tied_capital DESC
+            """
+            df = pd.read_sql_query(query, conn, params=params)
         return df
     
     def _analyze_slow_moving_items(self):
         """Identify slow-moving inventory with low turnover"""
-        conn = self.db.get_connection()
-        query = """
-            SELECT i.drug_name, i.category, i.current_stock,
-                   COALESCE(SUM(cp.quantity_consumed), 0) as total_consumed_90d,
-                   (i.current_stock * i.unit_price) as inventory_value
-            FROM inventory i
-            LEFT JOIN consumption_patterns cp ON i.id = cp.drug_id
-              AND cp.date >= DATE('now', '-90 days')
-            WHERE i.current_stock > 0
-            GROUP BY i.drug_name, i.category, i.current_stock, i.unit_price
-            HAVING total_consumed_90d < 10 OR total_consumed_90d IS NULL
-            ORDER BY inventory_value DESC
-            LIMIT 15
-        """
-        df = pd.read_sql_query(query, conn)
-        conn.close()
+        with connection(self.db) as conn:
+            window_sql, params = rollup_window_sql(days_ago(90))
+            query = f"""
+                SELECT i.drug_name, i.category, i.current_stock,
+                       COALESCE(SUM(cw.total_quantity), 0) as total_consumed_90d,
+                       (i.current_stock * i.unit_price) as inventory_value
+                FROM inventory i
+                LEFT JOIN ({window_sql}) cw ON i.id = cw.drug_id
+                WHERE i.current_stock > 0
+                GROUP BY i.drug_name, i.category, i.current_stock, i.unit_price
+                HAVING total_consumed_90d < 10 OR total_consumed_90d IS NULL
+                ORDER BY inventory_value DESC
+            """
+            df = pd.read_sql_query(query, conn, params=params)
         return df
     
     def _analyze_high_demand_items(self):
         """Identify high-demand items with growth trends"""
-        conn = self.db.get_connection()
-        query = """
-            SELECT i.drug_name, i.category, i.current_stock, i.minimum_stock, i.unit_price,
-                   SUM(CASE WHEN cp.date >= DATE('now', '-30 days') THEN cp.quantity_consumed ELSE 0 END) as last_30d,
-                   SUM(CASE WHEN cp.date >= DATE('now', '-60 days') AND cp.date < DATE('now', '-30 days') 
-                       THEN cp.quantity_consumed ELSE 0 END) as prev_30d
-            FROM inventory i
-            JOIN consumption_patterns cp ON i.id = cp.drug_id
-            WHERE cp.date >= DATE('now', '-60 days')
-            GROUP BY i.drug_name, i.category, i.current_stock, i.minimum_stock, i.unit_price
-            HAVING last_30d > prev_30d * 1.2 AND last_30d > 10
-            ORDER BY (last_30d - prev_30d) DESC
-            LIMIT 15
-        """
-        df = pd.read_sql_query(query, conn)
-        conn.close()
+        with connection(self.db) as conn:
+            recent_start, previous_start = days_ago(30), days_ago(60)
+            # With inventory statistics SQLite walks inventory and searches each
+            # drug's rollup rows by primary key, which is as fast as driving from
+            # the day index
+            query = """
+                SELECT i.drug_name, i.category, i.current_stock, i.minimum_stock, i.unit_price,
+                       SUM(CASE WHEN cd.day >= ? THEN cd.total_quantity ELSE 0 END) as last_30d,
+                       SUM(CASE WHEN cd.day >= ? AND cd.day < ? 
+                           THEN cd.total_quantity ELSE 0 END) as prev_30d
+                FROM inventory i
+                JOIN consumption_daily_rollup cd ON i.id = cd.drug_id
+                WHERE cd.day >= ?
+                GROUP BY i.drug_name, i.category, i.current_stock, i.minimum_stock, i.unit_price
+                HAVING last_30d > prev_30d * 1.2 AND last_30d > 10
+                ORDER BY (last_30d - prev_30d) DESC
+            """
+            df = pd.read_sql_query(query, conn, params=(recent_start, previous_start, recent_start, previous_start))
         return df
     
     def _analyze_seasonal_opportunities(self):
         """Identify seasonal demand patterns and opportunities"""
-        conn = self.db.get_connection()
-        current_month = datetime.now().month
-        current_month_str = str(current_month).zfill(2)
+        with connection(self.db) as conn:
+            current_month = datetime.now().month
+            current_month_str = str(current_month).zfill(2)
         
-        query = """
-            SELECT i.drug_name, i.category,
-                   AVG(CASE WHEN strftime('%m', cp.date) = ? THEN cp.quantity_consumed ELSE 0 END) as current_month_avg,
-                   AVG(cp.quantity_consumed) as overall_avg
-            FROM inventory i
-            JOIN consumption_patterns cp ON i.id = cp.drug_id
-            WHERE cp.date >= DATE('now', '-365 days')
-            GROUP BY i.drug_name, i.category
-            HAVING current_month_avg > overall_avg * 1.3
-            ORDER BY (current_month_avg - overall_avg) DESC
-            LIMIT 10
-        """
-        df = pd.read_sql_query(query, conn, params=(current_month_str,))
-        conn.close()
+            # Per-period rows so the month-of-year split works on both daily and monthly rollups
+            periods_sql, params = rollup_periods_sql(days_ago(365))
+            query = f"""
+                SELECT i.drug_name, i.category,
+                       SUM(CASE WHEN substr(cp.period, 6, 2) = ? THEN cp.total_quantity ELSE 0 END) * 1.0
+                           / SUM(cp.row_count) as current_month_avg,
+                       SUM(cp.total_quantity) * 1.0 / SUM(cp.row_count) as overall_avg
+                FROM inventory i
+                JOIN ({periods_sql}) cp ON i.id = cp.drug_id
+                GROUP BY i.drug_name, i.category
+                HAVING current_month_avg > overall_avg * 1.3
+                ORDER BY (current_month_avg - overall_avg) DESC
+            """
+            df = pd.read_sql_query(query, conn, params=[current_month_str] + params)
         return df
     
     def _analyze_supplier_performance(self):
         """Analyze supplier performance issues"""
-        conn = self.db.get_connection()
-        query = """
-            SELECT s.name, s.reliability_score, s.quality_score, s.cost_rating,
-                   s.lead_time_days
-            FROM suppliers s
-            WHERE s.reliability_score < 3.5 OR s.quality_score < 3.5 OR s.lead_time_days > 10
-            ORDER BY (s.reliability_score + s.quality_score) / 2
-            LIMIT 10
-        """
-        try:
-            df = pd.read_sql_query(query, conn)
-        except:
-            df = pd.DataFrame()
-        conn.close()
+        with connection(self.db) as conn:
+            query = """
+                SELECT s.name, s.reliability_score, s.quality_score, s.cost_rating,
+                       s.lead_time_days
+                FROM suppliers s
+                WHERE s.reliability_score < 3.5 OR s.quality_score < 3.5 OR s.lead_time_days > 10
+                ORDER BY (s.reliability_score + s.quality_score) / 2
+            """
+            try:
+                df = pd.read_sql_query(query, conn)
+            except Exception as e:
+                record_swallowed_exception(e)
+                df = pd.DataFrame()
         return df
     
-    def _generate_stock_recommendations(self, low_stock_df):
-        """Generate critical stock recommendations with urgency scoring"""
-        recommendations = []
-        for _, row in low_stock_df.iterrows():
-            days_until_stockout = row['current_stock'] / row['avg_daily_consumption'] if row['avg_daily_consumption'] > 0 else 999
-            
-            if days_until_stockout < 3:
-                urgency = 'Critical'
-                priority = 98
-            elif days_until_stockout < 7:
-                urgency = 'High'
-                priority = 92
-            else:
-                urgency = 'Medium'
-                priority = 85
-            
-            recommendations.append({
-                'type': 'RESTOCK',
-                'category': 'Inventory Management',
-                'title': f'⚠️ URGENT: Restock {row["drug_name"]}',
-                'description': f'Critical shortage: Current stock ({row["current_stock"]} units) is {row["shortage"]} units below minimum. Daily consumption: {row["avg_daily_consumption"]:.1f} units. Stockout in {days_until_stockout:.0f} days.',
-                'action': f'Place immediate purchase order for {row["shortage"] * 2} units',
-                'impact': 'Critical',
-                'urgency': urgency,
-                'estimated_cost': row['unit_price'] * row['shortage'] * 2,
-                'estimated_savings': row['unit_price'] * row['shortage'] * 3,
-                'priority_score': priority,
-                'days_until_impact': int(days_until_stockout)
-            })
-        return recommendations
-    
-    def _generate_expiry_recommendations(self, expiring_df):
-        """Generate wastage prevention recommendations"""
-        recommendations = []
-        for _, row in expiring_df.iterrows():
-            days_to_expiry = row['days_to_expiry']
-            consumption_rate = row['avg_daily_consumption']
-            can_sell = consumption_rate * days_to_expiry if consumption_rate > 0 else 0
-            expected_wastage = max(0, row['current_stock'] - can_sell)
-            
-            if days_to_expiry <= 15:
-                urgency = 'Critical'
-                priority = 96
-                action = f'IMMEDIATE: Discount 30-40% or transfer to high-demand location'
-            elif days_to_expiry <= 30:
-                urgency = 'High'
-                priority = 88
-                action = 'Implement promotional pricing (20-25% discount)'
-            elif days_to_expiry <= 60:
-                urgency = 'Medium'
-                priority = 70
-                action = 'Monitor closely and plan promotional activities'
-            else:
-                urgency = 'Low'
-                priority = 55
-                action = 'Continue normal operations with regular monitoring'
-            
-            recommendations.append({
-                'type': 'EXPIRY_ALERT',
-                'category': 'Wastage Prevention',
-                'title': f'⏰ {row["drug_name"]} expiring in {days_to_expiry} days',
-                'description': f'{row["current_stock"]} units will expire. Daily consumption: {consumption_rate:.1f} units. Expected wastage: {expected_wastage:.0f} units (₹{expected_wastage * row["unit_price"]:.2f})',
-                'action': action,
-                'impact': 'High' if row['potential_loss'] > 1000 else 'Medium',
-                'urgency': urgency,
-                'estimated_cost': 0,
-                'estimated_savings': expected_wastage * row['unit_price'] * 0.7,
-                'priority_score': priority,
-                'days_until_impact': days_to_expiry
-            })
-        return recommendations
-    
-    def _generate_overstock_recommendations(self, overstock_df):
-        """Generate cost optimization recommendations for overstock"""
-        recommendations = []
-        for _, row in overstock_df.iterrows():
-            monthly_holding_cost = row['tied_capital'] * 0.015
-            
-            recommendations.append({
-                'type': 'REDUCE_STOCK',
-                'category': 'Cost Optimization',
-                'title': f'💰 Optimize stock levels for {row["drug_name"]}',
-                'description': f'Excess inventory of {row["excess_stock"]} units (₹{row["tied_capital"]:.2f} tied up). Daily consumption: {row["avg_daily_consumption"]:.1f} units. Holding cost: ₹{monthly_holding_cost:.2f}/month.',
-                'action': f'Reduce stock by {int(row["excess_stock"] * 0.6)} units via supplier returns or branch transfers',
-                'impact': 'Medium',
-                'urgency': 'Low',
-                'estimated_cost': row['tied_capital'] * 0.02,
-                'estimated_savings': monthly_holding_cost * 6,
-                'priority_score': 60,
-                'days_until_impact': 90
-            })
-        return recommendations
-    
-    def _generate_slow_mover_recommendations(self, slow_movers_df):
-        """Generate recommendations for slow-moving items"""
-        recommendations = []
-        for _, row in slow_movers_df.iterrows():
-            recommendations.append({
-                'type': 'SLOW_MOVER',
-                'category': 'Inventory Optimization',
-                'title': f'📉 Review slow-moving item: {row["drug_name"]}',
-                'description': f'Low turnover: Only {row["total_consumed_90d"]:.0f} units in 90 days. Stock value: ₹{row["inventory_value"]:.2f}. Consider product review.',
-                'action': 'Reduce minimum stock levels or consider discontinuation. Implement clearance promotion.',
-                'impact': 'Medium',
-                'urgency': 'Low',
-                'estimated_cost': row['inventory_value'] * 0.1,
-                'estimated_savings': row['inventory_value'] * 0.15,
-                'priority_score': 45,
-                'days_until_impact': 120
-            })
-        return recommendations
-    
-    def _generate_demand_recommendations(self, high_demand_df):
-        """Generate growth opportunity recommendations"""
-        recommendations = []
-        for _, row in high_demand_df.iterrows():
-            growth_rate = ((row['last_30d'] - row['prev_30d']) / (row['prev_30d'] + 1)) * 100
-            revenue_opportunity = row['last_30d'] * row['unit_price'] * (growth_rate / 100) * 3
-            
-            recommendations.append({
-                'type': 'INCREASE_STOCK',
-                'category': 'Growth Opportunity',
-                'title': f'📈 Capitalize on growing demand: {row["drug_name"]}',
-                'description': f'Strong growth: +{growth_rate:.1f}% demand increase (from {row["prev_30d"]:.0f} to {row["last_30d"]:.0f} units). Revenue opportunity: ₹{revenue_opportunity:.2f} over next quarter.',
-                'action': f'Increase minimum stock from {row["minimum_stock"]} to {int(row["minimum_stock"] * 1.5)} units. Secure additional supply.',
-                'impact': 'High',
-                'urgency': 'Medium',
-                'estimated_cost': row['minimum_stock'] * row['unit_price'] * 0.5,
-                'estimated_savings': revenue_opportunity * 0.25,
-                'priority_score': 78,
-                'days_until_impact': 30
-            })
-        return recommendations
-    
-    def _generate_seasonal_recommendations(self, seasonal_df):
-        """Generate seasonal opportunity recommendations"""
-        recommendations = []
-        for _, row in seasonal_df.iterrows():
-            seasonal_factor = row['current_month_avg'] / row['overall_avg'] if row['overall_avg'] > 0 else 1
-            
-            recommendations.append({
-                'type': 'SEASONAL',
-                'category': 'Seasonal Opportunity',
-                'title': f'🌟 Seasonal peak for {row["drug_name"]}',
-                'description': f'Current month shows {seasonal_factor:.1f}x higher demand. Historical average: {row["overall_avg"]:.1f} units, Current month: {row["current_month_avg"]:.1f} units.',
-                'action': f'Increase inventory by {int((seasonal_factor - 1) * 100)}% to meet seasonal demand.',
-                'impact': 'Medium',
-                'urgency': 'Medium',
-                'estimated_cost': row['current_month_avg'] * 5,
-                'estimated_savings': row['current_month_avg'] * 8,
-                'priority_score': 68,
-                'days_until_impact': 15
-            })
-        return recommendations
-    
-    def _generate_supplier_recommendations(self, supplier_df):
-        """Generate supplier performance recommendations"""
-        recommendations = []
-        for _, row in supplier_df.iterrows():
-            issues = []
-            if row['reliability_score'] < 3.5:
-                issues.append(f'Low reliability ({row["reliability_score"]:.1f}/5)')
-            if row['quality_score'] < 3.5:
-                issues.append(f'Quality concerns ({row["quality_score"]:.1f}/5)')
-            if row['lead_time_days'] > 10:
-                issues.append(f'Slow delivery ({row["lead_time_days"]:.0f} days)')
-            
-            recommendations.append({
-                'type': 'SUPPLIER_REVIEW',
-                'category': 'Supplier Management',
-                'title': f'🔍 Review supplier: {row["name"]}',
-                'description': f'Performance issues: {", ".join(issues)}. Consider alternative suppliers.',
-                'action': 'Evaluate alternative suppliers and negotiate performance improvements',
-                'impact': 'Medium',
-                'urgency': 'Low',
-                'estimated_cost': 500,
-                'estimated_savings': 2000,
-                'priority_score': 50,
-                'days_until_impact': 60
-            })
-        return recommendations
-    
-    def _score_recommendations(self, recommendations):
-        """Apply intelligent scoring with multiple factors"""
-        for rec in recommendations:
-            impact_multiplier = {'Critical': 1.5, 'High': 1.3, 'Medium': 1.0, 'Low': 0.7}.get(rec['impact'], 1.0)
-            urgency_multiplier = {'Critical': 1.6, 'High': 1.3, 'Medium': 1.0, 'Low': 0.6}.get(rec['urgency'], 1.0)
-            
-            roi = 0
-            if rec.get('estimated_cost', 0) > 0:
-                roi = (rec.get('estimated_savings', 0) - rec.get('estimated_cost', 0)) / rec.get('estimated_cost', 1)
-            
-            roi_multiplier = min(1.5, max(0.5, 1.0 + roi * 0.1))
-            
-            time_urgency = 1.0
-            if rec.get('days_until_impact', 999) < 7:
-                time_urgency = 1.4
-            elif rec.get('days_until_impact', 999) < 30:
-                time_urgency = 1.2
-            
-            rec['priority_score'] = (
-                rec['priority_score'] * 
-                impact_multiplier * 
-                urgency_multiplier * 
-                roi_multiplier * 
+    def _candidate_frame(self, df, impact, urgency, estimated_cost, estimated_savings,
+                         priority_score, days_until_impact):
+        """Columnar candidates, one per row of an analysis frame; scalars are broadcast"""
+        n = len(df)
+        return pd.DataFrame({
+            'position': np.arange(n, dtype=np.int64),
+            'impact': pd.Categorical(np.broadcast_to(np.asarray(impact, dtype=object), n),
+                                     categories=self.LEVELS),
+            'urgency': pd.Categorical(np.broadcast_to(np.asarray(urgency, dtype=object), n),
+                                      categories=self.LEVELS),
+            'estimated_cost': np.broadcast_to(np.asarray(estimated_cost, dtype=np.float64), n),
+            'estimated_savings': np.broadcast_to(np.asarray(estimated_savings, dtype=np.float64), n),
+            'priority_score': np.broadcast_to(np.asarray(priority_score, dtype=np.float64), n),
+            'days_until_impact': np.broadcast_to(np.asarray(days_until_impact, dtype=np.int64), n)
+        })
+    
+    @staticmethod
+    def _column(df, name):
+        return df[name].to_numpy(dtype=np.float64)
+    
+    @staticmethod
+    def _days_until_stockout(current_stock, avg_daily_consumption):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(avg_daily_consumption > 0, current_stock / avg_daily_consumption, 999.0)
+    
+    def _stock_candidates(self, low_stock_df):
+        """Critical stock candidates with urgency from days until stockout"""
+        current_stock = self._column(low_stock_df, 'current_stock')
+        shortage = self._column(low_stock_df, 'shortage')
+        unit_price = self._column(low_stock_df, 'unit_price')
+        days_until_stockout = self._days_until_stockout(
+            current_stock, self._column(low_stock_df, 'avg_daily_consumption'))
+        
+        urgency = np.select([days_until_stockout < 3, days_until_stockout < 7],
+                            ['Critical', 'High'], 'Medium')
+        priority = np.select([days_until_stockout < 3, days_until_stockout < 7], [98, 92], 85)
+        return self._candidate_frame(
+            low_stock_df, 'Critical', urgency,
+            unit_price * self._column(low_stock_df, 'order_quantity'), unit_price * shortage * 3,
+            priority, np.trunc(days_until_stockout)
+        )
+    
+    def _expiry_candidates(self, expiring_df):
+        """Wastage prevention candidates bucketed by days to expiry"""
+        days_to_expiry = self._column(expiring_df, 'days_to_expiry')
+        consumption_rate = self._column(expiring_df, 'avg_daily_consumption')
+        can_sell = np.where(consumption_rate > 0, consumption_rate * days_to_expiry, 0)
+        expected_wastage = np.maximum(0, self._column(expiring_df, 'current_stock') - can_sell)
+        
+        buckets = [days_to_expiry <= 15, days_to_expiry <= 30, days_to_expiry <= 60]
+        return self._candidate_frame(
+            expiring_df,
+            np.where(self._column(expiring_df, 'potential_loss') > 1000, 'High', 'Medium'),
+            np.select(buckets, ['Critical', 'High', 'Medium'], 'Low'),
+            0, expected_wastage * self._column(expiring_df, 'unit_price') * 0.7,
+            np.select(buckets, [96, 88, 70], 55), days_to_expiry
+        )
+    
+    def _overstock_candidates(self, overstock_df):
+        """Cost optimization candidates for overstocked items"""
+        tied_capital = self._column(overstock_df, 'tied_capital')
+        return self._candidate_frame(
+            overstock_df, 'Medium', 'Low', tied_capital * 0.02, tied_capital * 0.015 * 6, 60, 90
+        )
+    
+    def _slow_mover_candidates(self, slow_movers_df):
+        """Candidates for slow-moving items"""
+        inventory_value = self._column(slow_movers_df, 'inventory_value')
+        return self._candidate_frame(
+            slow_movers_df, 'Medium', 'Low', inventory_value * 0.1, inventory_value * 0.15, 45, 120
+        )
+    
+    def _demand_candidates(self, high_demand_df):
+        """Growth opportunity candidates"""
+        last_30d = self._column(high_demand_df, 'last_30d')
+        prev_30d = self._column(high_demand_df, 'prev_30d')
+        unit_price = self._column(high_demand_df, 'unit_price')
+        growth_rate = ((last_30d - prev_30d) / (prev_30d + 1)) * 100
+        revenue_opportunity = last_30d * unit_price * (growth_rate / 100) * 3
+        return self._candidate_frame(
+            high_demand_df, 'High', 'Medium',
+            self._column(high_demand_df, 'minimum_stock') * unit_price * 0.5,
+            revenue_opportunity * 0.25, 78, 30
+        )
+    
+    def _seasonal_candidates(self, seasonal_df):
+        """Seasonal opportunity candidates"""
+        current_month_avg = self._column(seasonal_df, 'current_month_avg')
+        return self._candidate_frame(
+            seasonal_df, 'Medium', 'Medium', current_month_avg * 5, current_month_avg * 8, 68, 15
+        )
+    
+    def _supplier_candidates(self, supplier_df):
+        """Supplier performance candidates"""
+        return self._candidate_frame(supplier_df, 'Medium', 'Low', 500, 2000, 50, 60)
+    
+    def _describe_stock(self, row):
+        days_until_stockout = row['current_stock'] / row['avg_daily_consumption'] if row['avg_daily_consumption'] > 0 else 999
+        demand_label = 'Forecast daily demand' if row.get('demand_source') == 'forecast' else 'Daily consumption'
+        return {
+            'type': 'RESTOCK',
+            'category': 'Inventory Management',
+            'title': f'⚠️ URGENT: Restock {row["drug_name"]}',
+            'description': f'Critical shortage: Current stock ({row["current_stock"]} units) is {row["shortage"]} units below minimum. {demand_label}: {row["avg_daily_consumption"]:.1f} units. Stockout in {days_until_stockout:.0f} days.',
+            'action': f'Place immediate purchase order for {row["order_quantity"]} units'
+        }
+    
+    def _describe_expiry(self, row):
+        days_to_expiry = row['days_to_expiry']
+        consumption_rate = row['avg_daily_consumption']
+        can_sell = consumption_rate * days_to_expiry if consumption_rate > 0 else 0
+        expected_wastage = max(0, row['current_stock'] - can_sell)
+        
+        if days_to_expiry <= 15:
+            action = f'IMMEDIATE: Discount 30-40% or transfer to high-demand location'
+        elif days_to_expiry <= 30:
+            action = 'Implement promotional pricing (20-25% discount)'
+        elif days_to_expiry <= 60:
+            action = 'Monitor closely and plan promotional activities'
+        else:
+            action = 'Continue normal operations with regular monitoring'
+        
+        return {
+            'type': 'EXPIRY_ALERT',
+            'category': 'Wastage Prevention',
+            'title': f'⏰ {row["drug_name"]} expiring in {days_to_expiry} days',
+            'description': f'{row["current_stock"]} units will expire. Daily consumption: {consumption_rate:.1f} units. Expected wastage: {expected_wastage:.0f} units (₹{expected_wastage * row["unit_price"]:.2f})',
+            'action': action
+        }
+    
+    def _describe_overstock(self, row):
+        monthly_holding_cost = row['tied_capital'] * 0.015
+        return {
+            'type': 'REDUCE_STOCK',
+            'category': 'Cost Optimization',
+            'title': f'💰 Optimize stock levels for {row["drug_name"]}',
+            'description': f'Excess inventory of {row["excess_stock"]} units (₹{row["tied_capital"]:.2f} tied up). Daily consumption: {row["avg_daily_consumption"]:.1f} units. Holding cost: ₹{monthly_holding_cost:.2f}/month.',
+            'action': f'Reduce stock by {int(row["excess_stock"] * 0.6)} units via supplier returns or branch transfers'
+        }
+    
+    def _describe_slow_mover(self, row):
+        return {
+            'type': 'SLOW_MOVER',
+            'category': 'Inventory Optimization',
+            'title': f'📉 Review slow-moving item: {row["drug_name"]}',
+            'description': f'Low turnover: Only {row["total_consumed_90d"]:.0f} units in 90 days. Stock value: ₹{row["inventory_value"]:.2f}. Consider product review.',
+            'action': 'Reduce minimum stock levels or consider discontinuation. Implement clearance promotion.'
+        }
+    
+    def _describe_demand(self, row):
+        growth_rate = ((row['last_30d'] - row['prev_30d']) / (row['prev_30d'] + 1)) * 100
+        revenue_opportunity = row['last_30d'] * row['unit_price'] * (growth_rate / 100) * 3
+        return {
+            'type': 'INCREASE_STOCK',
+            'category': 'Growth Opportunity',
+            'title': f'📈 Capitalize on growing demand: {row["drug_name"]}',
+            'description': f'Strong growth: +{growth_rate:.1f}% demand increase (from {row["prev_30d"]:.0f} to {row["last_30d"]:.0f} units). Revenue opportunity: ₹{revenue_opportunity:.2f} over next quarter.',
+            'action': f'Increase minimum stock from {row["minimum_stock"]} to {int(row["minimum_stock"] * 1.5)} units. Secure additional supply.'
+        }
+    
+    def _describe_seasonal(self, row):
+        seasonal_factor = row['current_month_avg'] / row['overall_avg'] if row['overall_avg'] > 0 else 1
+        return {
+            'type': 'SEASONAL',
+            'category': 'Seasonal Opportunity',
+            'title': f'🌟 Seasonal peak for {row["drug_name"]}',
+            'description': f'Current month shows {seasonal_factor:.1f}x higher demand. Historical average: {row["overall_avg"]:.1f} units, Current month: {row["current_month_avg"]:.1f} units.',
+            'action': f'Increase inventory by {int((seasonal_factor - 1) * 100)}% to meet seasonal demand.'
+        }
+    
+    def _describe_supplier(self, row):
+        issues = []
+        if row['reliability_score'] < 3.5:
+            issues.append(f'Low reliability ({row["reliability_score"]:.1f}/5)')
+        if row['quality_score'] < 3.5:
+            issues.append(f'Quality concerns ({row["quality_score"]:.1f}/5)')
+        if row['lead_time_days'] > 10:
+            issues.append(f'Slow delivery ({row["lead_time_days"]:.0f} days)')
+        return {
+            'type': 'SUPPLIER_REVIEW',
+            'category': 'Supplier Management',
+            'title': f'🔍 Review supplier: {row["name"]}',
+            'description': f'Performance issues: {", ".join(issues)}. Consider alternative suppliers.',
+            'action': 'Evaluate alternative suppliers and negotiate performance improvements'
+        }
+    
+    def _scored_candidates(self, index, df):
+        """
+        Scored candidates of one analysis, cut to those that can still reach the overall top
+        
+        Ranking is by score, then ANALYSES order, then row order, so a candidate
+        outside its own analysis' top TOP_K can never make the overall list.
+        """
+        analysis, builder, _ = self.ANALYSES[index]
+        if df.empty:
+            candidates = self._candidate_frame(df, 'Medium', 'Medium', 0, 0, 0, 0)
+        else:
+            candidates = getattr(self, builder)(df)
+        scored = self._score_recommendations(candidates.assign(analysis=index))
+        keep = np.sort(self._top_k(scored['priority_score'].to_numpy(), self.TOP_K))
+        return scored.iloc[keep].reset_index(drop=True)
+    
+    def _score_recommendations(self, candidates):
+        """Apply intelligent scoring with multiple factors, for every candidate at once"""
+        # Code -1 (a level outside LEVELS) picks the trailing neutral 1.0
+        impact_multiplier = np.append(self.IMPACT_MULTIPLIERS, 1.0)[candidates['impact'].cat.codes.to_numpy()]
+        urgency_multiplier = np.append(self.URGENCY_MULTIPLIERS, 1.0)[candidates['urgency'].cat.codes.to_numpy()]
+        
+        cost = candidates['estimated_cost'].to_numpy()
+        savings = candidates['estimated_savings'].to_numpy()
+        has_cost = cost > 0
+        roi = np.zeros(len(candidates))
+        np.divide(savings - cost, cost, out=roi, where=has_cost)
+        
+        roi_multiplier = np.minimum(1.5, np.maximum(0.5, 1.0 + roi * 0.1))
+        
+        days_until_impact = candidates['days_until_impact'].to_numpy()
+        time_urgency = np.select([days_until_impact < 7, days_until_impact < 30], [1.4, 1.2], 1.0)
+        
+        return candidates.assign(
+            priority_score=(
+                candidates['priority_score'].to_numpy() *
+                impact_multiplier *
+                urgency_multiplier *
+                roi_multiplier *
                 time_urgency
-            )
-            
-            rec['roi_ratio'] = roi if roi > 0 else 0
+            ),
+            roi_ratio=np.where(roi > 0, roi, 0)
+        )
+    
+    @staticmethod
+    def _top_k(scores, k):
+        """
+        Positions of the k highest scores, highest first
         
-        return recommendations
+        Ties keep candidate order, as a stable descending sort would, so only
+        the candidates at or above the k-th score are ever sorted.
+        """
+        if len(scores) > k:
+            threshold = -np.partition(-scores, k - 1)[k - 1]
+            positions = np.flatnonzero(scores >= threshold)
+        else:
+            positions = np.arange(len(scores))
+        return positions[np.lexsort((positions, -scores[positions]))][:k]
+    
+    def _materialize(self, entries, candidate):
+        """Recommendation dict for one scored candidate"""
+        analysis, _, describer = self.ANALYSES[candidate['analysis']]
+        row = entries[analysis][0].iloc[candidate['position']]
+        recommendation = getattr(self, describer)(row)
+        recommendation.update({
+            'impact': candidate['impact'],
+            'urgency': candidate['urgency'],
+            'estimated_cost': float(candidate['estimated_cost']),
+            'estimated_savings': float(candidate['estimated_savings']),
+            'priority_score': float(candidate['priority_score']),
+            'days_until_impact': int(candidate['days_until_impact']),
+            'roi_ratio': float(candidate['roi_ratio'])
+        })
+        return recommendation
@@ -0,0 +1,110 @@
+"""
+Table Versions
+Change counters bumped by triggers, so caches can tell which data changed
+since they last looked without rereading the tables themselves. Each tracked
+table has a counter for any write ('inventory'), one for inserts and deletes
+('inventory:rows') and one per tracked column for updates that actually
+change its value ('inventory.current_stock').
+"""
+
+from typing import Dict, Iterable, Mapping, Tuple
+
+TRACKED_TABLES = ('inventory', 'consumption_patterns', 'suppliers')
+
+# Forecasts are replaced a run at a time, so the run log stands in for
+# demand_forecasts; counting per forecast row would slow every save
+FORECAST_TRACKED_COLUMNS = {'forecast_runs': ()}
+
+# Columns read by the recommendation analyses
+TRACKED_COLUMNS = {
+    'inventory': ('id', 'drug_name', 'category', 'current_stock', 'minimum_stock',
+                  'unit_price', 'expiry_date', 'tablets_per_sheet', 'supplier_name'),
+    'consumption_patterns': ('drug_id', 'date', 'quantity_consumed'),
+    'suppliers': ('name', 'reliability_score', 'quality_score', 'cost_rating', 'lead_time_days'),
+}
+
+
+def _version_schema(tables=TRACKED_TABLES) -> str:
+    statements = ["""
+CREATE TABLE IF NOT EXISTS table_versions (
+    name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+"""]
+    for table in tables:
+        statements.append(f"INSERT OR IGNORE INTO table_versions (name, version) VALUES ('{table}', 0);\n")
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            statements.append(f"""
+CREATE TRIGGER IF NOT EXISTS trg_{table}_version_{event.lower()}
+AFTER {event} ON {table}
+BEGIN
+    UPDATE table_versions SET version = version + 1 WHERE name = '{table}';
+END;
+""")
+    return ''.join(statements)
+
+
+TABLE_VERSION_SCHEMA = _version_schema()
+
+
+def _column_version_schema(tracked_columns=TRACKED_COLUMNS) -> str:
+    statements = []
+    for table, columns in tracked_columns.items():
+        names = [f'{table}:rows'] + [f'{table}.{column}' for column in columns]
+        statements.extend(f"INSERT OR IGNORE INTO table_versions (name, version) VALUES ('{name}', 0);\n"
+                          for name in names)
+        for event in ('INSERT', 'DELETE'):
+            statements.append(f"""
+CREATE TRIGGER IF NOT EXISTS trg_{table}_rows_version_{event.lower()}
+AFTER {event} ON {table}
+BEGIN
+    UPDATE table_versions SET version = version + 1 WHERE name = '{table}:rows';
+END;
+""")
+        if not columns:
+            continue
+        bumps = ''.join(
+            f"    UPDATE table_versions SET version = version + 1 "
+            f"WHERE name = '{table}.{column}' AND OLD.{column} IS NOT NEW.{column};\n"
+            for column in columns
+        )
+        statements.append(f"""
+CREATE TRIGGER IF NOT EXISTS trg_{table}_column_versions
+AFTER UPDATE OF {', '.join(columns)} ON {table}
+BEGIN
+{bumps}END;
+""")
+    return ''.join(statements)
+
+
+# TRACKED_COLUMNS as migration 4 installed it. Applied migrations never
+# change, so columns tracked since then only reach COLUMN_VERSION_REFRESH.
+MIGRATION_4_TRACKED_COLUMNS = {
+    'inventory': ('id', 'drug_name', 'category', 'current_stock', 'minimum_stock',
+                  'unit_price', 'expiry_date'),
+    'consumption_patterns': ('drug_id', 'date', 'quantity_consumed'),
+    'suppliers': ('name', 'reliability_score', 'quality_score', 'cost_rating', 'lead_time_days'),
+}
+
+COLUMN_VERSION_SCHEMA = _column_version_schema(MIGRATION_4_TRACKED_COLUMNS)
+
+# Recreates the column triggers for the current TRACKED_COLUMNS
+COLUMN_VERSION_REFRESH = ''.join(f"DROP TRIGGER IF EXISTS trg_{table}_column_versions;\n"
+                                 for table in TRACKED_COLUMNS) + _column_version_schema()
+
+FORECAST_VERSION_SCHEMA = (_version_schema(tuple(FORECAST_TRACKED_COLUMNS))
+                           + _column_version_schema(FORECAST_TRACKED_COLUMNS))
+
+
+def dependency_counters(dependencies: Mapping[str, Iterable[str]]) -> Tuple[str, ...]:
+    """Counter names covering reads of the given {table: columns}"""
+    counters = []
+    for table, columns in dependencies.items():
+        counters.append(f'{table}:rows')
+        counters.extend(f'{table}.{column}' for column in columns)
+    return tuple(counters)
+
+
+def read_table_versions(conn) -> Dict[str, int]:
+    """Map counter name -> version; every write to a tracked table bumps its counter"""
+    return dict(conn.execute("SELECT name, version FROM table_versions"))
@@ -0,0 +1,39 @@
+import sqlite3
+
+import pytest
+
+from generate_synthetic_data import generate_dataset
+
+
+class SeededDatabase:
+    """Minimal stand-in for the app's database manager"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+
+    def get_connection(self):
+        return sqlite3.connect(self.db_path)
+
+
+@pytest.fixture(scope='session')
+def seeded_db_path(tmp_path_factory):
+    """Synthetic database of the shipped dataset's shape, migrated to the latest version"""
+    db_path = str(tmp_path_factory.mktemp('data') / 'pharma_inventory.db')
+    generate_dataset(db_path, seed=7)
+    return db_path
+
+
+@pytest.fixture(scope='session')
+def seeded_db(seeded_db_path):
+    return SeededDatabase(seeded_db_path)
+
+
+@pytest.fixture
+def scratch_db(seeded_db_path, tmp_path):
+    """Copy of the seeded database that a test may write to"""
+    db_path = str(tmp_path / 'scratch.db')
+    source, target = sqlite3.connect(seeded_db_path), sqlite3.connect(db_path)
+    source.backup(target)
+    source.close()
+    target.close()
+    return SeededDatabase(db_path)
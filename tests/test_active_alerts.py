@@ -0,0 +1,76 @@
+from contextlib import closing
+
+import pytest
+
+import utils
+
+
+def _dirty(conn):
+    return [row[0] for row in conn.execute("SELECT drug_id FROM alert_dirty ORDER BY drug_id")]
+
+
+def _alerts(conn):
+    return conn.execute("""
+        SELECT drug_id, category, rank, type, priority, message, raised_at
+        FROM active_alerts ORDER BY drug_id, category
+    """).fetchall()
+
+
+@pytest.fixture
+def alerts_db(scratch_db):
+    """Scratch database whose active alerts are current"""
+    assert utils.refresh_active_alerts(scratch_db)['mode'] == 'full'
+    return scratch_db
+
+
+@pytest.mark.parametrize('write', [
+    "INSERT INTO transactions (drug_id, transaction_type, quantity) VALUES (42, 'sale', 3)",
+    "INSERT INTO consumption_patterns (drug_id, date, quantity_consumed) VALUES (42, date('now'), 3)",
+    "UPDATE consumption_patterns SET quantity_consumed = quantity_consumed + 1 "
+    "WHERE id = (SELECT MAX(id) FROM consumption_patterns WHERE drug_id = 42)",
+    "UPDATE inventory SET current_stock = 0 WHERE id = 42",
+])
+def test_a_write_marks_only_its_sku_dirty(alerts_db, write):
+    with closing(alerts_db.get_connection()) as conn, conn:
+        assert _dirty(conn) == []
+        conn.execute(write)
+        assert _dirty(conn) == [42]
+
+
+def test_incremental_refresh_matches_a_full_evaluation(alerts_db):
+    with closing(alerts_db.get_connection()) as conn, conn:
+        conn.execute("UPDATE inventory SET current_stock = 0 WHERE id IN (3, 400)")
+        conn.execute("UPDATE inventory SET current_stock = minimum_stock * 10 + 100 WHERE id IN "
+                     "(SELECT drug_id FROM active_alerts WHERE category = 'stock' LIMIT 5)")
+        conn.executemany("INSERT INTO consumption_patterns (drug_id, date, quantity_consumed) "
+                         "VALUES (?, date('now', '-1 day'), 400)", [(9,), (10,), (1500,)])
+        conn.execute("INSERT INTO transactions (drug_id, transaction_type, quantity) VALUES (11, 'sale', 5)")
+
+    refreshed = utils.refresh_active_alerts(alerts_db)
+    assert refreshed['mode'] == 'incremental'
+    with closing(alerts_db.get_connection()) as conn, conn:
+        incremental = _alerts(conn)
+        conn.execute("UPDATE active_alert_state SET evaluated_day = ''")
+
+    assert utils.refresh_active_alerts(alerts_db)['mode'] == 'full'
+    with closing(alerts_db.get_connection()) as conn:
+        assert _alerts(conn) == incremental
+
+
+def test_raised_at_survives_re_evaluation(alerts_db):
+    with closing(alerts_db.get_connection()) as conn, conn:
+        drug_id, category = conn.execute("SELECT drug_id, category FROM active_alerts LIMIT 1").fetchone()
+        conn.execute("UPDATE active_alerts SET raised_at = '2000-01-01 00:00:00'")
+        conn.execute("INSERT INTO transactions (drug_id, transaction_type, quantity) VALUES (?, 'sale', 0)",
+                     (drug_id,))
+
+    assert utils.refresh_active_alerts(alerts_db)['mode'] == 'incremental'
+    with closing(alerts_db.get_connection()) as conn, conn:
+        assert conn.execute("SELECT raised_at FROM active_alerts WHERE drug_id = ? AND category = ?",
+                            (drug_id, category)).fetchone() == ('2000-01-01 00:00:00',)
+        conn.execute("UPDATE active_alert_state SET evaluated_day = ''")
+
+    assert utils.refresh_active_alerts(alerts_db)['mode'] == 'full'
+    with closing(alerts_db.get_connection()) as conn:
+        assert {row[0] for row in conn.execute("SELECT DISTINCT raised_at FROM active_alerts")} == \
+            {'2000-01-01 00:00:00'}
@@ -0,0 +1,62 @@
+from contextlib import closing
+
+import pytest
+
+import utils
+from anomaly_detection import detect_anomalies
+
+
+@pytest.fixture
+def expired_db(scratch_db):
+    """Copy of the seeded database with several items already expired"""
+    with closing(scratch_db.get_connection()) as conn, conn:
+        conn.execute("""
+            UPDATE inventory SET expiry_date = date('now', '-' || (id % 30 + 1) || ' days')
+            WHERE id IN (SELECT id FROM inventory ORDER BY id LIMIT 12)
+        """)
+    return scratch_db
+
+
+def test_snapshot_low_stock_matches_helper(seeded_db):
+    assert utils.get_alert_snapshot(seeded_db)['low_stock'] == utils.get_low_stock_items(seeded_db)
+
+
+def test_snapshot_high_value_matches_helper(seeded_db):
+    snapshot = utils.get_alert_snapshot(seeded_db)
+    assert snapshot['high_value_expiring'] == utils.get_high_value_expiring_items(seeded_db)
+
+
+def test_snapshot_expiring_matches_helper_with_expired_items(expired_db):
+    expiring = utils.get_expiring_items(expired_db)
+    assert sum(item['days_until_expiry'] == 0 for item in expiring) > 1
+
+    assert utils.get_alert_snapshot(expired_db)['expiring'] == expiring
+
+
+def test_snapshot_anomalies_come_from_the_engine(seeded_db):
+    snapshot = utils.get_alert_snapshot(seeded_db)
+    assert snapshot['consumption_anomalies'] == utils.detect_consumption_anomalies(seeded_db, 5)
+
+
+def test_consumption_alerts_follow_the_engine_ranking(scratch_db):
+    anomalies = detect_anomalies(scratch_db)
+    assert anomalies
+
+    alerts = utils.get_active_alerts(scratch_db, 'consumption')
+    assert [alert['drug_id'] for alert in alerts] == [anomaly['drug_id'] for anomaly in anomalies]
+    assert [alert['priority'] for alert in alerts] == [
+        utils.ANOMALY_ALERT_LEVELS[anomaly['severity']][1] for anomaly in anomalies
+    ]
+
+
+def test_incremental_consumption_alerts_match_a_full_refresh(scratch_db):
+    full = utils.get_active_alerts(scratch_db, 'consumption')
+    flagged = [alert['drug_id'] for alert in full[:20]]
+    with closing(scratch_db.get_connection()) as conn, conn:
+        conn.executemany("INSERT OR IGNORE INTO alert_dirty (drug_id) VALUES (?)",
+                         [(drug_id,) for drug_id in flagged + list(range(1, 40))])
+
+    assert utils.refresh_active_alerts(scratch_db)['mode'] == 'incremental'
+    incremental = utils.get_active_alerts(scratch_db, 'consumption')
+    assert [(alert['drug_id'], alert['priority'], alert['message']) for alert in incremental] == \
+        [(alert['drug_id'], alert['priority'], alert['message']) for alert in full]
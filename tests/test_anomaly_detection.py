@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+
+import anomaly_detection
+from anomaly_detection import (
+    MAD_SCALE, MIN_SCALE, SEVERITY_THRESHOLDS, anomaly_scores, ewma_zscores, rank_anomalies, robust_zscores,
+    rolling_zscores, severity,
+)
+
+WINDOW = 7
+
+
+@pytest.fixture(scope='module')
+def matrix():
+    rng = np.random.default_rng(11)
+    demand = rng.poisson(rng.uniform(0, 30, (300, 1)), (300, 40)).astype(float)
+    # Spikes and drops in the scored days, an old spike, and SKUs without demand
+    demand[::7, -3] *= 6
+    demand[3::11, -1] = 0
+    demand[5::13, 10] += 200
+    demand[::17] = 0
+    return demand
+
+
+def test_rolling_zscores_match_a_loop(matrix):
+    mean, z = rolling_zscores(matrix, WINDOW)
+    for t in range(WINDOW, matrix.shape[1]):
+        previous = matrix[:, t - WINDOW:t]
+        expected_mean = previous.mean(axis=1)
+        scale = np.maximum(previous.std(axis=1, ddof=1), MIN_SCALE)
+        np.testing.assert_allclose(mean[:, t - WINDOW], expected_mean, atol=1e-9)
+        np.testing.assert_allclose(z[:, t - WINDOW], (matrix[:, t] - expected_mean) / scale, atol=1e-6)
+
+
+def test_ewma_zscores_match_the_recurrence(matrix):
+    means, z = ewma_zscores(matrix, WINDOW, alpha=0.2)
+    for row in (0, 5, 42):
+        mean, variance = matrix[row, :WINDOW].mean(), matrix[row, :WINDOW].var(ddof=1)
+        for t in range(WINDOW, matrix.shape[1]):
+            assert means[row, t - WINDOW] == pytest.approx(mean)
+            assert z[row, t - WINDOW] == pytest.approx((matrix[row, t] - mean) / max(np.sqrt(variance), MIN_SCALE))
+            deviation = matrix[row, t] - mean
+            mean += 0.2 * deviation
+            variance = 0.8 * (variance + 0.2 * deviation ** 2)
+
+
+def test_robust_zscores_match_numpy_medians(matrix):
+    median, z = robust_zscores(matrix, WINDOW)
+    for t in range(WINDOW, matrix.shape[1]):
+        previous = matrix[:, t - WINDOW:t]
+        expected = np.median(previous, axis=1)
+        mad = np.median(np.abs(previous - expected[:, None]), axis=1)
+        np.testing.assert_array_equal(median[:, t - WINDOW], expected)
+        scale = np.maximum(MAD_SCALE * mad, MIN_SCALE)
+        np.testing.assert_allclose(z[:, t - WINDOW], (matrix[:, t] - expected) / scale)
+
+
+def test_robust_zscores_even_window():
+    values = np.array([[1.0, 9.0, 3.0, 5.0, 100.0]])
+    median, z = robust_zscores(values, 4)
+    assert median.tolist() == [[4.0]]
+    assert z[0, 0] == pytest.approx(96.0 / (MAD_SCALE * 2.0))
+
+
+def test_steady_demand_is_not_scored_on_a_zero_scale():
+    _, z = rolling_zscores(np.array([[5.0] * WINDOW + [6.0]]), WINDOW)
+    assert z.tolist() == [[1.0 / MIN_SCALE]]
+
+
+@pytest.mark.parametrize('chunk', [16, 4096])
+def test_rank_anomalies_matches_scoring_the_whole_matrix(matrix, monkeypatch, chunk):
+    monkeypatch.setattr(anomaly_detection, 'CHUNK_SKUS', chunk)
+    recent_days = 5
+    ranked = rank_anomalies(matrix, recent_days, WINDOW)
+
+    # Unpruned reference: every SKU's most anomalous recent day
+    scores = anomaly_scores(matrix[:, -(WINDOW + recent_days):], WINDOW)
+    best = np.abs(scores['score']).argmax(axis=1)
+    rows = np.arange(len(matrix))
+    lowest = SEVERITY_THRESHOLDS[-1][1]
+    flagged = np.flatnonzero(np.abs(scores['score'][rows, best]) >= lowest)
+    order = flagged[np.argsort(-np.abs(scores['score'][flagged, best[flagged]]), kind='stable')]
+
+    assert len(order) > 10
+    assert ranked['sku'].tolist() == order.tolist()
+    assert ranked['day'].tolist() == (matrix.shape[1] - recent_days + best[order]).tolist()
+    np.testing.assert_array_equal(ranked['quantity'], matrix[order, ranked['day']])
+    for key in ('expected', 'rolling', 'ewma', 'robust', 'score'):
+        np.testing.assert_allclose(ranked[key], scores[key][order, best[order]])
+    assert ranked['severity'].tolist() == severity(ranked['score']).tolist()
+
+
+def test_rank_anomalies_without_flags_returns_empty_arrays():
+    ranked = rank_anomalies(np.full((4, 40), 3.0), 5, WINDOW)
+    assert all(len(values) == 0 for values in ranked.values())
@@ -0,0 +1,48 @@
+import pytest
+
+from backtesting import run_backtest
+from training_orchestrator import TrainingOrchestrator
+
+FORECASTERS = ('ses', 'holt_winters', 'croston', 'moving_average')
+BACKTEST = dict(forecasters=FORECASTERS, horizon=14, origins=2, step=7, train_days=112)
+
+
+def _fail():
+    raise RuntimeError('fit failed')
+
+
+class FailingOrchestrator(TrainingOrchestrator):
+    """Runs fits in-process, failing `forecaster` at its latest cutoff"""
+
+    def __init__(self, forecaster):
+        super().__init__(max_workers=1)
+        self.forecaster = forecaster
+
+    def run(self, tasks, on_complete=None):
+        latest = max(cutoff for _, cutoff in tasks)
+        tasks = {task: (_fail, ()) if task == (self.forecaster, latest) else fit for task, fit in tasks.items()}
+        return super().run(tasks, on_complete)
+
+
+@pytest.fixture(scope='module')
+def clean_backtest(seeded_db, tmp_path_factory):
+    output = str(tmp_path_factory.mktemp('backtest') / 'clean.db')
+    return run_backtest(seeded_db, output, orchestrator=TrainingOrchestrator(max_workers=1), **BACKTEST)
+
+
+def test_every_sku_is_won_once(clean_backtest):
+    wins = [metrics['wins'] for metrics in clean_backtest['forecasters'].values()]
+    assert sum(wins) == clean_backtest['sku_count']
+    assert all(metrics['cutoffs_scored'] == 2 for metrics in clean_backtest['forecasters'].values())
+
+
+def test_forecaster_with_a_failed_cutoff_is_not_ranked(seeded_db, tmp_path, clean_backtest):
+    best = clean_backtest['best_forecaster']
+    backtest = run_backtest(seeded_db, str(tmp_path / 'failing.db'), orchestrator=FailingOrchestrator(best),
+                            **BACKTEST)
+
+    assert backtest['best_forecaster'] not in (None, best)
+    assert list(backtest['failed']) == [f"{best}@{backtest['cutoffs'][-1]}"]
+    assert backtest['forecasters'][best]['cutoffs_scored'] == 1
+    assert 'wins' not in backtest['forecasters'][best]
+    assert sum(metrics.get('wins', 0) for metrics in backtest['forecasters'].values()) == backtest['sku_count']
@@ -0,0 +1,71 @@
+from contextlib import closing
+
+import numpy as np
+import pytest
+
+from consumption_rollups import days_ago
+from demand_stats import DEFAULT_WINDOWS, _changed_skus, demand_stats_current, refresh_demand_stats
+
+
+def _stored(conn):
+    return {row[:2]: row[2:] for row in conn.execute("SELECT * FROM demand_stats ORDER BY window_days, drug_id")}
+
+
+def _rebuilt(conn):
+    """demand_stats as a full rebuild leaves it, without keeping the rebuild"""
+    conn.execute("SAVEPOINT rebuild")
+    conn.execute("DELETE FROM demand_stats_state")
+    assert refresh_demand_stats(conn)['mode'] == 'full'
+    rows = _stored(conn)
+    conn.execute("ROLLBACK TO rebuild")
+    conn.execute("RELEASE rebuild")
+    return rows
+
+
+@pytest.fixture
+def stats_conn(scratch_db):
+    with closing(scratch_db.get_connection()) as conn:
+        refresh_demand_stats(conn)
+        conn.commit()
+        yield conn
+
+
+@pytest.mark.parametrize('write, path', [
+    ("INSERT INTO consumption_patterns (drug_id, date, quantity_consumed) VALUES (5, :yesterday, 40)", 'insert'),
+    ("UPDATE consumption_patterns SET quantity_consumed = quantity_consumed + 9 "
+     "WHERE id = (SELECT MAX(id) FROM consumption_patterns WHERE drug_id = 5 AND date < :today)", 'update'),
+    ("DELETE FROM consumption_patterns "
+     "WHERE id = (SELECT MAX(id) FROM consumption_patterns WHERE drug_id = 5 AND date < :today)", 'delete'),
+])
+def test_incremental_refresh_matches_a_full_rebuild(stats_conn, write, path):
+    stats_conn.execute(write, {'yesterday': days_ago(1), 'today': days_ago(0)})
+    assert not demand_stats_current(stats_conn)
+
+    refreshed = refresh_demand_stats(stats_conn)
+    assert refreshed == {'mode': 'incremental', 'skus': 1}
+    assert demand_stats_current(stats_conn)
+    assert _stored(stats_conn) == _rebuilt(stats_conn)
+
+
+def test_same_day_insert_outside_the_windows_recomputes_nothing(stats_conn):
+    stats_conn.execute("INSERT INTO consumption_patterns (drug_id, date, quantity_consumed) VALUES (5, ?, 40)",
+                       (days_ago(0),))
+
+    assert refresh_demand_stats(stats_conn) == {'mode': 'incremental', 'skus': 0}
+
+
+def test_sql_signatures_match_the_stored_numpy_sums(stats_conn):
+    # Fractional quantities make the float totals order-sensitive
+    stats_conn.executemany("INSERT INTO consumption_patterns (drug_id, date, quantity_consumed) VALUES (?, ?, ?)",
+                           [(drug_id, days_ago(days), quantity) for drug_id in (7, 8, 9)
+                            for days, quantity in ((3, 0.1), (3, 0.2), (40, 0.7), (200, 1e-3))])
+    stats_conn.execute("DELETE FROM demand_stats_state")
+    refresh_demand_stats(stats_conn)
+
+    as_of = days_ago(0)
+    longest = max(DEFAULT_WINDOWS)
+    start = (np.datetime64(as_of, 'D') - longest).astype(str)
+    assert _changed_skus(stats_conn, longest, start, as_of).tolist() == []
+    stats_conn.execute("UPDATE consumption_patterns SET quantity_consumed = 0.3 "
+                       "WHERE drug_id = 7 AND quantity_consumed = 0.1")
+    assert _changed_skus(stats_conn, longest, start, as_of).tolist() == [7]
@@ -0,0 +1,52 @@
+from contextlib import closing
+
+from model_registry import data_fingerprint
+
+
+def _execute(db, sql, params=()):
+    with closing(db.get_connection()) as conn, conn:
+        conn.execute(sql, params)
+
+
+def test_minimum_stock_edit_changes_only_the_regression_fingerprint(scratch_db):
+    regression, lstm = data_fingerprint(scratch_db, 'sku_stock_regression'), data_fingerprint(scratch_db, 'lstm')
+    _execute(scratch_db, "UPDATE inventory SET minimum_stock = minimum_stock + 5 WHERE id = 3")
+
+    assert data_fingerprint(scratch_db, 'sku_stock_regression')['checksum'] != regression['checksum']
+    assert data_fingerprint(scratch_db, 'lstm') == lstm
+
+
+def test_stock_moved_between_congruent_ids_changes_the_fingerprint(scratch_db):
+    before = data_fingerprint(scratch_db, 'sku_stock_regression')
+    # Ids 1 and 1010 have the same weight in a sum weighted by id % 1009
+    _execute(scratch_db, "UPDATE inventory SET current_stock = current_stock + 7 WHERE id = 1")
+    _execute(scratch_db, "UPDATE inventory SET current_stock = current_stock - 7 WHERE id = 1010")
+
+    assert data_fingerprint(scratch_db, 'sku_stock_regression')['checksum'] != before['checksum']
+
+
+def test_consumption_moved_between_congruent_ids_changes_the_fingerprint(scratch_db):
+    with closing(scratch_db.get_connection()) as conn:
+        first, second = conn.execute("""
+            SELECT a.rowid, b.rowid FROM consumption_patterns a
+            JOIN consumption_patterns b ON b.drug_id = 1010 AND b.date = a.date
+            WHERE a.drug_id = 1 AND a.quantity_consumed > 1
+            LIMIT 1
+        """).fetchone()
+    before = data_fingerprint(scratch_db, 'lstm')
+    _execute(scratch_db, "UPDATE consumption_patterns SET quantity_consumed = quantity_consumed - 1 WHERE rowid = ?",
+             (first,))
+    _execute(scratch_db, "UPDATE consumption_patterns SET quantity_consumed = quantity_consumed + 1 WHERE rowid = ?",
+             (second,))
+
+    after = data_fingerprint(scratch_db, 'lstm')
+    assert after['rows'] == before['rows']
+    assert after['checksum'] != before['checksum']
+
+
+def test_unchanged_data_keeps_the_fingerprint(scratch_db):
+    before = data_fingerprint(scratch_db, 'sku_stock_regression')
+    _execute(scratch_db, "UPDATE inventory SET current_stock = current_stock + 1 WHERE id = 5")
+    _execute(scratch_db, "UPDATE inventory SET current_stock = current_stock - 1 WHERE id = 5")
+
+    assert data_fingerprint(scratch_db, 'sku_stock_regression')['checksum'] == before['checksum']
@@ -0,0 +1,21 @@
+import sqlite3
+
+from db_migrations import FULL_SCAN_ALLOWLIST, check_query_plans, find_full_scans, query_key
+
+
+def test_hot_queries_use_indexes(seeded_db_path):
+    checked, problems = check_query_plans(seeded_db_path)
+
+    assert checked > 0
+    assert problems == [], [sql for sql, _ in problems]
+
+
+def test_unindexed_query_is_reported(seeded_db_path):
+    sql = "SELECT id FROM inventory WHERE description LIKE '%tablet%'"
+    assert query_key(sql) not in FULL_SCAN_ALLOWLIST
+
+    conn = sqlite3.connect(seeded_db_path)
+    try:
+        assert find_full_scans(conn, sql) == ['SCAN inventory']
+    finally:
+        conn.close()
@@ -0,0 +1,47 @@
+import sqlite3
+
+import pytest
+
+from query_profiler import ProfiledConnection, fingerprint, profiler
+
+
+@pytest.fixture
+def profiled_conn():
+    conn = sqlite3.connect(':memory:', factory=ProfiledConnection)
+    conn.execute("CREATE TABLE inventory (id INTEGER PRIMARY KEY, drug_name TEXT)")
+    conn.executemany("INSERT INTO inventory (drug_name) VALUES (?)", [('A',), ('B',), ('C',)])
+    profiler.reset()
+    yield conn
+    conn.close()
+    profiler.reset()
+
+
+def _entries():
+    return {entry['fingerprint']: entry for entry in profiler.report(top=100)}
+
+
+def test_point_lookup_fetchone_is_recorded(profiled_conn):
+    sql = "SELECT drug_name FROM inventory WHERE id = ?"
+    for drug_id in range(1, 11):
+        profiled_conn.execute(sql, (drug_id,)).fetchone()
+
+    entry = _entries()[fingerprint(sql)]
+    assert entry['calls'] == 10
+    assert entry['rows'] == 3
+
+
+def test_abandoned_cursor_is_recorded(profiled_conn):
+    sql = "SELECT id FROM inventory ORDER BY id"
+    cursor = profiled_conn.execute(sql)
+    next(cursor)
+    del cursor
+
+    assert _entries()[fingerprint(sql)]['calls'] == 1
+
+
+def test_fetchall_is_recorded_once(profiled_conn):
+    sql = "SELECT id FROM inventory"
+    assert len(profiled_conn.execute(sql).fetchall()) == 3
+
+    entry = _entries()[fingerprint(sql)]
+    assert (entry['calls'], entry['rows']) == (1, 3)
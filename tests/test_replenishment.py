@@ -0,0 +1,53 @@
+import numpy as np
+
+from replenishment import _first_fit, allocate_budget
+
+
+def _greedy(cost, budget):
+    taken, left = [], budget
+    for item in cost:
+        taken.append(item <= left)
+        if item <= left:
+            left -= item
+    return np.array(taken)
+
+
+def test_first_fit_skips_an_unaffordable_item_and_funds_cheaper_later_ones():
+    taken = _first_fit(np.array([40.0, 70.0, 20.0, 30.0, 15.0]), 100.0)
+    assert taken.tolist() == [True, False, True, True, False]
+
+
+def test_first_fit_matches_a_sequential_greedy():
+    rng = np.random.default_rng(3)
+    for _ in range(200):
+        cost = np.round(rng.exponential(20.0, rng.integers(0, 40)), 2)
+        budget = float(rng.uniform(0, 400))
+        assert _first_fit(cost, budget).tolist() == _greedy(cost, budget).tolist()
+
+
+def test_essential_quantities_are_funded_before_top_ups():
+    # The most urgent SKU's top-up would use the budget the second SKU's essential part needs
+    planned = allocate_budget(order_quantity=np.array([10.0, 4.0]), essential_quantity=np.array([2.0, 4.0]),
+                              unit_price=np.array([10.0, 10.0]), urgency=np.array([0.0, 1.0]), budget=60.0)
+    assert planned.tolist() == [2.0, 4.0]
+
+
+def test_top_up_is_refused_when_its_essential_part_was_unfunded():
+    # SKU 0's essential part does not fit, so its cheap top-up is not bought on its own
+    planned = allocate_budget(order_quantity=np.array([12.0, 3.0]), essential_quantity=np.array([10.0, 1.0]),
+                              unit_price=np.array([10.0, 10.0]), urgency=np.array([0.0, 1.0]), budget=50.0)
+    assert planned.tolist() == [0.0, 3.0]
+
+
+def test_sku_without_essential_quantity_can_be_topped_up():
+    planned = allocate_budget(order_quantity=np.array([5.0, 3.0]), essential_quantity=np.array([0.0, 3.0]),
+                              unit_price=np.array([1.0, 1.0]), urgency=np.array([0.0, 1.0]), budget=8.0)
+    assert planned.tolist() == [5.0, 3.0]
+
+
+def test_no_budget_orders_everything():
+    order_quantity = np.array([5.0, 0.0, 12.0])
+    planned = allocate_budget(order_quantity, np.array([5.0, 0.0, 3.0]), np.array([1.0, 2.0, 3.0]),
+                              np.array([2.0, 1.0, 0.0]), budget=None)
+    assert planned.tolist() == order_quantity.tolist()
+    assert planned is not order_quantity
@@ -0,0 +1,92 @@
+from contextlib import closing
+
+import numpy as np
+import pytest
+
+import sku_classification
+from sku_classification import ABC_CLASSES, XYZ_CLASSES, _database_path, _load_catalog, refresh_sku_classes
+
+
+def _stored_classes(conn):
+    return dict(conn.execute("SELECT drug_id, abc_class || xyz_class FROM sku_classes"))
+
+
+def _full_classes(conn):
+    """Every SKU's class as a full _load_catalog classification gives it"""
+    catalog = _load_catalog(conn)
+    return {drug_id: ABC_CLASSES[code // 3] + XYZ_CLASSES[code % 3]
+            for drug_id, code in zip(catalog.drug_ids.tolist(), catalog.classify().tolist())}
+
+
+def _assert_matches_full(conn):
+    assert _stored_classes(conn) == _full_classes(conn)
+    kept, loaded = sku_classification._catalogs[_database_path(conn)], _load_catalog(conn)
+    for name in ('drug_ids', 'values', 'mean', 'std'):
+        np.testing.assert_array_equal(getattr(kept, name), getattr(loaded, name))
+
+
+@pytest.fixture
+def classes_conn(scratch_db):
+    with closing(scratch_db.get_connection()) as conn:
+        refresh_sku_classes(conn)
+        conn.commit()
+        yield conn
+
+
+@pytest.mark.parametrize('write, removed', [
+    ("UPDATE inventory SET current_stock = current_stock * 50 + 1000 WHERE id IN (4, 300, 1200)", 0),
+    ("UPDATE inventory SET unit_price = 0 "
+     "WHERE id = (SELECT id FROM inventory ORDER BY current_stock * unit_price DESC LIMIT 1)", 0),
+    ("INSERT INTO inventory (drug_name, current_stock, minimum_stock, unit_price) "
+     "VALUES ('Test SKU', 100000, 10, 90)", 0),
+    ("DELETE FROM inventory WHERE id IN (12, 13)", 2),
+])
+def test_incremental_refresh_matches_a_full_classification(classes_conn, write, removed):
+    classes_conn.execute(write)
+    refreshed = refresh_sku_classes(classes_conn)
+    classes_conn.commit()
+
+    assert refreshed['mode'] == 'incremental'
+    assert refreshed['removed'] == removed
+    _assert_matches_full(classes_conn)
+
+
+def test_consumption_change_reclassifies_by_demand(classes_conn):
+    classes_conn.executemany("INSERT INTO consumption_patterns (drug_id, date, quantity_consumed) "
+                             "VALUES (20, date('now', ?), 500)", [(f'-{days} days',) for days in (2, 9, 30)])
+    refreshed = refresh_sku_classes(classes_conn)
+    classes_conn.commit()
+
+    assert refreshed['mode'] == 'incremental'
+    _assert_matches_full(classes_conn)
+
+
+def test_state_rewritten_by_another_process_forces_a_full_load(classes_conn):
+    # Another process ran a refresh since: its token supersedes this process's arrays
+    classes_conn.execute("UPDATE sku_class_state SET token = 'other-process'")
+    classes_conn.execute("UPDATE inventory SET current_stock = current_stock + 500 WHERE id = 8")
+    refreshed = refresh_sku_classes(classes_conn)
+    classes_conn.commit()
+
+    assert refreshed['mode'] == 'full'
+    _assert_matches_full(classes_conn)
+
+    classes_conn.execute("UPDATE inventory SET current_stock = current_stock + 500 WHERE id = 9")
+    assert refresh_sku_classes(classes_conn)['mode'] == 'incremental'
+
+
+def test_rolled_back_refresh_is_not_reused(classes_conn):
+    classes_conn.execute("UPDATE inventory SET current_stock = current_stock * 50 + 1000 WHERE id = 5")
+    refresh_sku_classes(classes_conn)
+    classes_conn.rollback()
+
+    classes_conn.execute("UPDATE inventory SET current_stock = current_stock + 1 WHERE id = 6")
+    refreshed = refresh_sku_classes(classes_conn)
+    classes_conn.commit()
+
+    assert refreshed['mode'] == 'full'
+    _assert_matches_full(classes_conn)
+
+
+def test_nothing_dirty_is_current(classes_conn):
+    assert refresh_sku_classes(classes_conn) == {'mode': 'current', 'dirty': 0, 'changed': 0, 'removed': 0}
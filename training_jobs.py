@@ -0,0 +1,274 @@
+"""
+Training Jobs
+Background queue for model training, so pages submit a job and poll it
+instead of training inside the request. The queue lives in the model
+registry's index database; a job for the same kind, hyperparameters and
+data fingerprint as one that is queued, running or already finished is not
+submitted again, and finished models land in the registry. A job's kind
+is the name of the forecasting backend that trains it.
+
+Run a worker next to the dashboard:
+    python training_jobs.py [db_path]
+or start worker threads inside the app process with ensure_worker(db).
+
+Each worker runs one job at a time from start to finish, so a long LSTM job
+holds its worker until it is done; with ensure_worker's default of two
+threads the statistical and backtest jobs keep moving past one LSTM job,
+but as many long jobs as there are threads fill them all. In-process
+workers also stop with the app process, leaving their job to be requeued
+once its heartbeat goes stale; a standalone worker (or several) avoids both.
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import closing
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from forecasting_backends import available_backends, get_backend
+from model_registry import ModelRegistry, data_fingerprint, get_model_registry, params_key
+from query_profiler import record_swallowed_exception
+
+JOB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS training_jobs (
+    job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    data_checksum TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    progress REAL NOT NULL DEFAULT 0,
+    message TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    model_id INTEGER,
+    error TEXT,
+    submitted_at TEXT NOT NULL,
+    started_at TEXT,
+    finished_at TEXT,
+    heartbeat REAL
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_training_jobs_active
+ON training_jobs (kind, params, data_checksum) WHERE status IN ('queued', 'running');
+
+CREATE INDEX IF NOT EXISTS idx_training_jobs_status ON training_jobs (status, job_id);
+"""
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+
+def _now() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+class TrainingJobQueue:
+    """
+    Job queue on the registry index
+
+    A running job's worker refreshes its heartbeat; a job whose heartbeat
+    is older than stale_after seconds (its worker died) is queued again, up
+    to max_attempts runs, then failed.
+    """
+
+    def __init__(self, registry: ModelRegistry, stale_after: float = 120.0, max_attempts: int = 2):
+        self.registry = registry
+        self.stale_after = stale_after
+        self.max_attempts = max_attempts
+        with closing(registry.connect()) as conn:
+            conn.executescript(JOB_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = self.registry.connect()
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def submit(self, kind: str, params: Dict[str, Any], fingerprint: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Queue a training job, or return the matching job that is queued,
+        running or finished with a model still in the registry
+        """
+        if kind not in available_backends():
+            raise ValueError(f"Unknown training job kind: {kind}")
+        key = (kind, params_key(params), fingerprint['checksum'])
+
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                existing = conn.execute("""
+                    SELECT j.* FROM training_jobs j
+                    LEFT JOIN models m ON m.model_id = j.model_id
+                    WHERE j.kind = ? AND j.params = ? AND j.data_checksum = ?
+                      AND (j.status IN ('queued', 'running') OR (j.status = 'done' AND m.valid = 1))
+                    ORDER BY j.job_id DESC LIMIT 1
+                """, key).fetchone()
+                if existing is None:
+                    cursor = conn.execute("""
+                        INSERT INTO training_jobs (kind, params, data_checksum, message, submitted_at)
+                        VALUES (?, ?, ?, 'Waiting for a worker', ?)
+                    """, key + (_now(),))
+                    existing = conn.execute("SELECT * FROM training_jobs WHERE job_id = ?",
+                                            (cursor.lastrowid,)).fetchone()
+                conn.commit()
+            except sqlite3.Error:
+                conn.rollback()
+                raise
+        return dict(existing)
+
+    def status(self, job_id: int) -> Optional[Dict[str, Any]]:
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM training_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def result(self, job_id: int) -> Optional[Dict[str, Any]]:
+        """Results of a finished job's model, or None"""
+        job = self.status(job_id)
+        if job is None or job['status'] != 'done' or job['model_id'] is None:
+            return None
+        entry = self.registry.get(job['model_id'])
+        return entry['results'] if entry else None
+
+    def claim(self, worker: str) -> Optional[Dict[str, Any]]:
+        """Take the oldest queued job, first requeueing or failing abandoned ones"""
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                stale = time.time() - self.stale_after
+                conn.execute("""
+                    UPDATE training_jobs SET status = 'failed', finished_at = ?,
+                           error = 'Worker stopped responding'
+                    WHERE status = 'running' AND heartbeat < ? AND attempts >= ?
+                """, (_now(), stale, self.max_attempts))
+                conn.execute("""
+                    UPDATE training_jobs SET status = 'queued', message = 'Requeued after worker loss'
+                    WHERE status = 'running' AND heartbeat < ?
+                """, (stale,))
+                job = conn.execute(
+                    "SELECT * FROM training_jobs WHERE status = 'queued' ORDER BY job_id LIMIT 1"
+                ).fetchone()
+                if job is not None:
+                    conn.execute("""
+                        UPDATE training_jobs SET status = 'running', worker = ?, started_at = ?,
+                               heartbeat = ?, attempts = attempts + 1, progress = 0, message = 'Starting'
+                        WHERE job_id = ?
+                    """, (worker, _now(), time.time(), job['job_id']))
+                conn.commit()
+            except sqlite3.Error:
+                conn.rollback()
+                raise
+        return dict(job) if job else None
+
+    def _update(self, job_id: int, **fields) -> None:
+        assignments = ', '.join(f"{name} = ?" for name in fields)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(f"UPDATE training_jobs SET {assignments} WHERE job_id = ?",
+                         list(fields.values()) + [job_id])
+
+    def run_once(self, db, worker: Optional[str] = None) -> bool:
+        """Run the next queued job, if any; returns whether one ran"""
+        worker = worker or f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+        job = self.claim(worker)
+        if job is None:
+            return False
+
+        job_id = job['job_id']
+        stop = threading.Event()
+
+        def heartbeat():
+            while not stop.wait(self.stale_after / 4):
+                try:
+                    self._update(job_id, heartbeat=time.time())
+                except sqlite3.Error as e:
+                    record_swallowed_exception(e)
+
+        def report(progress: float, message: str) -> None:
+            self._update(job_id, progress=progress, message=message, heartbeat=time.time())
+
+        beating = threading.Thread(target=heartbeat, name=f'training-job-{job_id}-heartbeat', daemon=True)
+        beating.start()
+        try:
+            params = json.loads(job['params'])
+            fingerprint = data_fingerprint(db, job['kind'])
+            results = get_backend(job['kind'])(db, params, report)
+            if results is None:
+                self._update(job_id, status='done', progress=1.0, finished_at=_now(),
+                             message='Not enough data to train')
+            else:
+                report(0.9, 'Saving model')
+                model_id = self.registry.save(job['kind'], results, params, fingerprint)
+                self._update(job_id, status='done', progress=1.0, model_id=model_id,
+                             finished_at=_now(), message='Finished')
+        except Exception as e:
+            self._update(job_id, status='failed', finished_at=_now(),
+                         error=f"{type(e).__name__}: {e}", message='Failed')
+        finally:
+            stop.set()
+            beating.join()
+        return True
+
+    def run_worker(self, db, poll_interval: float = 1.0, stop: Optional[threading.Event] = None) -> None:
+        """Process jobs until stop is set"""
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            try:
+                if self.run_once(db):
+                    continue
+            except sqlite3.Error as e:
+                record_swallowed_exception(e)
+            stop.wait(poll_interval)
+
+
+_queues: Dict[str, TrainingJobQueue] = {}
+_workers: Dict[str, List[threading.Thread]] = {}
+_queues_lock = threading.Lock()
+
+
+def get_job_queue(db) -> TrainingJobQueue:
+    """Shared queue on db's model registry"""
+    registry = get_model_registry(db)
+    with _queues_lock:
+        queue = _queues.get(registry.root)
+        if queue is None:
+            queue = TrainingJobQueue(registry)
+            _queues[registry.root] = queue
+    return queue
+
+
+def ensure_worker(db, workers: int = 2) -> TrainingJobQueue:
+    """
+    Queue for db, with `workers` background worker threads running in this
+    process (daemon threads: they end with the process)
+    """
+    queue = get_job_queue(db)
+    with _queues_lock:
+        threads = [thread for thread in _workers.get(queue.registry.root, []) if thread.is_alive()]
+        while len(threads) < workers:
+            thread = threading.Thread(target=queue.run_worker, args=(db,),
+                                      name=f'training-jobs-{len(threads)}', daemon=True)
+            thread.start()
+            threads.append(thread)
+        _workers[queue.registry.root] = threads
+    return queue
+
+
+class _WorkerDatabase:
+    """Minimal stand-in for the app's database manager in a standalone worker"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+
+    def get_connection(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path)
+
+
+if __name__ == "__main__":
+    database = _WorkerDatabase(sys.argv[1] if len(sys.argv) > 1 else "pharma_inventory.db")
+    print(f"Training worker on {database.db_path}, registry in {get_model_registry(database).root}")
+    try:
+        get_job_queue(database).run_worker(database)
+    except KeyboardInterrupt:
+        pass
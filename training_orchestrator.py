@@ -0,0 +1,285 @@
+"""
+Training Orchestrator
+Runs independent model fits (one regression model, one block of SKUs) in
+separate processes: at most max_workers at a time, each killed when it
+exceeds its timeout and each limited to memory_limit_mb of address space,
+so one runaway fit cannot stall or starve the others.
+
+train_regression_models() fans the Linear, Polynomial and Ridge fits out
+this way and returns the results dict regression_lstm_page renders. Its
+target is each SKU's current stock (see regression_dataset), which is not
+what InventoryForecaster's regression fitted, so the page and the model
+registry call it 'sku_stock_regression'.
+"""
+
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from multiprocessing.connection import wait
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+from consumption_rollups import days_ago
+from db_connection import connection
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# Keep BLAS/OpenMP single-threaded inside workers so N workers use N cores
+_THREAD_VARIABLES = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'NUMEXPR_NUM_THREADS')
+_environment_lock = threading.Lock()
+
+
+@contextmanager
+def _single_threaded_children():
+    with _environment_lock:
+        saved = {name: os.environ.get(name) for name in _THREAD_VARIABLES}
+        os.environ.update({name: '1' for name in _THREAD_VARIABLES})
+        try:
+            yield
+        finally:
+            for name, value in saved.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+
+
+def _run_fit(pipe, fn: Callable, args: tuple, kwargs: dict, memory_limit_mb: Optional[int]) -> None:
+    """Worker entry point: apply the memory limit, run one fit, send back its outcome"""
+    if memory_limit_mb and resource is not None:
+        limit = int(memory_limit_mb) * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    pipe.send('started')
+    started = time.perf_counter()
+    try:
+        outcome = {'status': 'ok', 'result': fn(*args, **kwargs), 'error': None}
+    except MemoryError:
+        outcome = {'status': 'memory', 'result': None, 'error': f'MemoryError (limit {memory_limit_mb} MB)'}
+    except Exception as e:
+        outcome = {'status': 'error', 'result': None, 'error': f"{type(e).__name__}: {e}"}
+    outcome['seconds'] = time.perf_counter() - started
+    pipe.send(outcome)
+    pipe.close()
+
+
+class TrainingOrchestrator:
+    """
+    Process-per-fit scheduler
+
+    run() takes {name: (fn, args[, kwargs])} with picklable module-level
+    functions and returns {name: {'status', 'result', 'error', 'seconds'}},
+    status being 'ok', 'error', 'memory' or 'timeout'. The timeout counts
+    from when the fit starts; process start-up has its own startup_timeout.
+    With one worker the fits run in this process, without timeout or memory
+    enforcement. on_complete(name, outcome), if given, is called as each fit
+    finishes, in completion order; it may pop 'result' to avoid holding
+    every result until the run ends.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, timeout: Optional[float] = 300.0,
+                 memory_limit_mb: Optional[int] = 2048, start_method: str = 'spawn',
+                 startup_timeout: float = 120.0):
+        self.max_workers = max(1, max_workers or os.cpu_count() or 1)
+        self.timeout = timeout
+        self.startup_timeout = startup_timeout
+        self.memory_limit_mb = memory_limit_mb
+        self._context = multiprocessing.get_context(start_method)
+
+    def run(self, tasks: Dict[str, Tuple],
+            on_complete: Optional[Callable[[str, Dict[str, Any]], None]] = None) -> Dict[str, Dict[str, Any]]:
+        if self.max_workers == 1:
+            outcomes = {}
+            for name, task in tasks.items():
+                outcomes[name] = self._run_inline(*task)
+                if on_complete is not None:
+                    on_complete(name, outcomes[name])
+            return outcomes
+
+        pending = deque(tasks.items())
+        running = {}
+        outcomes = {}
+        try:
+            while pending or running:
+                while pending and len(running) < self.max_workers:
+                    name, task = pending.popleft()
+                    running[name] = self._start(*task)
+
+                now = time.monotonic()
+                for name, (process, pipe, deadline) in list(running.items()):
+                    if pipe.poll() or not process.is_alive():
+                        outcome = self._receive(process, pipe)
+                        if outcome == 'started':
+                            running[name] = (process, pipe, self._deadline(now, self.timeout))
+                            continue
+                        outcomes[name] = outcome
+                    elif now >= deadline:
+                        process.terminate()
+                        outcomes[name] = {'status': 'timeout', 'result': None, 'seconds': None,
+                                          'error': f'exceeded {self.timeout}s'}
+                    else:
+                        continue
+                    process.join()
+                    pipe.close()
+                    del running[name]
+                    if on_complete is not None:
+                        on_complete(name, outcomes[name])
+
+                if running:
+                    next_deadline = min(deadline for _, _, deadline in running.values())
+                    handles = [pipe for _, pipe, _ in running.values()]
+                    handles += [process.sentinel for process, _, _ in running.values()]
+                    wait(handles, timeout=max(0.0, next_deadline - time.monotonic()))
+        finally:
+            for process, pipe, _ in running.values():
+                process.terminate()
+                process.join()
+                pipe.close()
+        return {name: outcomes[name] for name in tasks}
+
+    @staticmethod
+    def _receive(process, pipe) -> Dict[str, Any]:
+        try:
+            return pipe.recv()
+        except EOFError:
+            # Died before reporting: killed by the OS (e.g. out of memory) or crashed
+            process.join()
+            return {'status': 'error', 'result': None, 'seconds': None,
+                    'error': f'worker exited with code {process.exitcode}'}
+
+    def _start(self, fn: Callable, args: tuple = (), kwargs: Optional[dict] = None):
+        receiver, sender = self._context.Pipe(duplex=False)
+        process = self._context.Process(
+            target=_run_fit, args=(sender, fn, args, kwargs or {}, self.memory_limit_mb), daemon=True
+        )
+        with _single_threaded_children():
+            process.start()
+        sender.close()
+        return process, receiver, self._deadline(time.monotonic(), self.startup_timeout)
+
+    @staticmethod
+    def _deadline(now: float, timeout: Optional[float]) -> float:
+        return now + timeout if timeout is not None else float('inf')
+
+    def _run_inline(self, fn: Callable, args: tuple = (), kwargs: Optional[dict] = None) -> Dict[str, Any]:
+        started = time.perf_counter()
+        try:
+            outcome = {'status': 'ok', 'result': fn(*args, **(kwargs or {})), 'error': None}
+        except MemoryError:
+            outcome = {'status': 'memory', 'result': None, 'error': 'MemoryError'}
+        except Exception as e:
+            outcome = {'status': 'error', 'result': None, 'error': f"{type(e).__name__}: {e}"}
+        outcome['seconds'] = time.perf_counter() - started
+        return outcome
+
+
+def regression_dataset(db) -> Optional[Dict[str, np.ndarray]]:
+    """
+    Per-SKU features (30/90-day consumption, price, minimum stock) and
+    current stock as the target, or None with fewer than 10 SKUs that have
+    consumption history
+    """
+    with connection(db) as conn:
+        rows = conn.execute("""
+            SELECT i.id, i.current_stock, i.unit_price, i.minimum_stock,
+                   TOTAL(CASE WHEN r.day >= ? THEN r.total_quantity END) / 30.0,
+                   TOTAL(r.total_quantity) / 90.0,
+                   COUNT(r.day)
+            FROM inventory i
+            JOIN consumption_daily_rollup r ON r.drug_id = i.id AND r.day >= ?
+            GROUP BY i.id
+        """, (days_ago(30), days_ago(90))).fetchall()
+    if len(rows) < 10:
+        return None
+
+    data = np.array([row[1:] for row in rows], dtype=float)
+    return {
+        'drug_ids': np.array([row[0] for row in rows]),
+        'features': np.nan_to_num(data[:, 1:]),
+        'target': np.nan_to_num(data[:, 0]),
+        'feature_names': ['unit_price', 'minimum_stock', 'daily_consumption_30d',
+                          'daily_consumption_90d', 'consumption_days_90d'],
+    }
+
+
+def _regression_model(name: str):
+    from sklearn.linear_model import LinearRegression, Ridge
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import PolynomialFeatures, StandardScaler
+
+    if name == 'linear':
+        return LinearRegression()
+    if name == 'polynomial':
+        return make_pipeline(StandardScaler(), PolynomialFeatures(degree=2), LinearRegression())
+    if name == 'ridge':
+        return make_pipeline(StandardScaler(), Ridge(alpha=1.0))
+    raise ValueError(f"Unknown regression model: {name}")
+
+
+def fit_regression(name: str, x_train: np.ndarray, x_test: np.ndarray,
+                   y_train: np.ndarray, y_test: np.ndarray) -> Dict[str, Any]:
+    """Fit one regression model and score it on the held-out split"""
+    from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
+
+    model = _regression_model(name)
+    model.fit(x_train, y_train)
+    predicted = model.predict(x_test)
+    return {
+        'model': model,
+        'r2': float(r2_score(y_test, predicted)),
+        'mae': float(mean_absolute_error(y_test, predicted)),
+        'rmse': float(np.sqrt(mean_squared_error(y_test, predicted))),
+        'y_test': y_test,
+        'y_pred': predicted,
+    }
+
+
+REGRESSION_MODELS = ('linear', 'polynomial', 'ridge')
+
+
+def train_regression_models(db, orchestrator: Optional[TrainingOrchestrator] = None,
+                            test_size: float = 0.2, seed: int = 42) -> Optional[Dict[str, Any]]:
+    """
+    Linear, Polynomial and Ridge regression fitted in parallel on one split
+
+    Returns {'linear': {...}, 'polynomial': {...}, 'ridge': {...},
+    'best_model': name with the highest R², 'failed': {name: error}}, or
+    None when there is too little data. Raises RuntimeError when every fit fails.
+    """
+    dataset = regression_dataset(db)
+    if dataset is None:
+        return None
+
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(len(dataset['target']))
+    cut = max(1, int(round(len(order) * test_size)))
+    test, train = order[:cut], order[cut:]
+    split = (dataset['features'][train], dataset['features'][test],
+             dataset['target'][train], dataset['target'][test])
+
+    orchestrator = orchestrator or TrainingOrchestrator(
+        max_workers=min(len(REGRESSION_MODELS), os.cpu_count() or 1), timeout=120
+    )
+    outcomes = orchestrator.run({name: (fit_regression, (name,) + split) for name in REGRESSION_MODELS})
+
+    results = {name: outcome['result'] for name, outcome in outcomes.items() if outcome['status'] == 'ok'}
+    failed = {name: outcome['error'] for name, outcome in outcomes.items() if outcome['status'] != 'ok'}
+    if not results:
+        raise RuntimeError(f"Every regression fit failed: {failed}")
+    results['failed'] = failed
+    results['best_model'] = max((name for name in REGRESSION_MODELS if name in results),
+                                key=lambda name: results[name]['r2'])
+    results['feature_names'] = dataset['feature_names']
+    return results
+
+
+def regression_backend(db, params: Dict[str, Any], report: Callable[[float, str], None]) -> Optional[Dict[str, Any]]:
+    """Forecasting-backend entry point for train_regression_models"""
+    report(0.1, 'Fitting regression models')
+    return train_regression_models(db)
@@ -1,8 +1,25 @@
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 import re
+import time
+from statistics import NormalDist
+from active_alerts import CATEGORIES as ALERT_CATEGORIES, pending_alert_skus, read_active_alerts, store_alerts
+from anomaly_detection import (
+    RECENT_DAYS as ANOMALY_RECENT_DAYS, WINDOW_DAYS as ANOMALY_WINDOW_DAYS, describe_change, detect_anomalies,
+    rank_anomalies,
+)
+from consumption_matrix import load_consumption_matrix
+from consumption_rollups import rollup_window_sql, days_ago
+from db_connection import connection
+from demand_stats import DEFAULT_WINDOWS, demand_stats_current, refresh_demand_stats
+from expiry_calendar import PERIODS as EXPIRY_PERIODS, calendar_rows, epoch_day, epoch_day_to_date
+from forecast_store import forecast_daily_demand_sql
+from query_profiler import record_swallowed_exception
+from sku_classification import (
+    ABC_CLASSES, DEMAND_WINDOW_DAYS, XYZ_CLASSES, abc_class_index, refresh_sku_classes,
+)
 
 def format_currency(amount: float, currency: str = "INR") -> str:
     """Format amount as currency string"""
@@ -63,24 +80,28 @@ def get_stock_status_color(status: str) -> str:
     return color_map.get(status, "#808080")  # Gray as default
 
 def generate_alerts(db) -> List[Dict[str, Any]]:
-    """Generate system alerts based on current data"""
+    """
+    Generate system alerts based on current data
+    
+    Stock, reorder and consumption alerts are read from active_alerts (see
+    refresh_active_alerts), expiry alerts from the expiry_day index.
+    """
     alerts = []
     
     try:
-        # Low stock alerts
-        low_stock_items = get_low_stock_items(db)
-        for item in low_stock_items:
-            alerts.append({
-                'type': 'warning' if item['current_stock'] > 0 else 'critical',
-                'category': 'stock',
-                'message': f"Low stock alert: {item['drug_name']} has only {item['current_stock']} units remaining (minimum: {item['minimum_stock']})",
-                'drug_id': item['id'],
-                'priority': 'high' if item['current_stock'] == 0 else 'medium'
-            })
+        # Low stock, reorder and consumption anomaly alerts
+        for category, limit in (('stock', 10), ('consumption', 5), ('reorder', 5)):
+            for alert in get_active_alerts(db, category, limit):
+                alerts.append({
+                    'type': alert['type'],
+                    'category': category,
+                    'message': alert['message'],
+                    'drug_id': alert['drug_id'],
+                    'priority': alert['priority']
+                })
         
         # Expiry alerts
-        expiring_items = get_expiring_items(db)
-        for item in expiring_items:
+        for item in get_expiring_items(db):
             days_until_expiry = item['days_until_expiry']
             if days_until_expiry <= 7:
                 alert_type = 'critical'
@@ -101,8 +122,7 @@ def generate_alerts(db) -> List[Dict[str, Any]]:
             })
         
         # High value at risk alerts
-        high_value_expiring = get_high_value_expiring_items(db)
-        for item in high_value_expiring:
+        for item in get_high_value_expiring_items(db):
             alerts.append({
                 'type': 'warning',
                 'category': 'financial',
@@ -110,30 +130,9 @@ def generate_alerts(db) -> List[Dict[str, Any]]:
                 'drug_id': item.get('id'),
                 'priority': 'medium'
             })
-        
-        # Unusual consumption pattern alerts
-        consumption_anomalies = detect_consumption_anomalies(db)
-        for anomaly in consumption_anomalies:
-            alerts.append({
-                'type': 'info',
-                'category': 'consumption',
-                'message': f"Consumption anomaly detected: {anomaly['drug_name']} usage {anomaly['change_description']}",
-                'drug_id': anomaly.get('drug_id'),
-                'priority': 'low'
-            })
-        
-        # Reorder suggestions
-        reorder_alerts = get_reorder_alerts(db)
-        for alert in reorder_alerts:
-            alerts.append({
-                'type': 'info',
-                'category': 'reorder',
-                'message': f"Reorder suggestion: {alert['drug_name']} - suggested quantity: {alert['suggested_quantity']}",
-                'drug_id': alert.get('drug_id'),
-                'priority': alert.get('priority', 'medium')
-            })
     
     except Exception as e:
+        record_swallowed_exception(e)
         alerts.append({
             'type': 'critical',
             'category': 'system',
@@ -147,231 +146,591 @@ def generate_alerts(db) -> List[Dict[str, Any]]:
     
     return alerts[:10]  # Return top 10 alerts
 
+def get_alert_snapshot(db, min_value: float = 1000.0) -> Dict[str, Any]:
+    """
+    Collect every alert class from a single connection.
+    
+    Runs one pass over inventory and one over the last 30 days of consumption
+    and returns the same lists as get_low_stock_items, get_expiring_items,
+    get_high_value_expiring_items and get_reorder_alerts, plus a 'timings'
+    breakdown in milliseconds. 'consumption_anomalies' is
+    detect_consumption_anomalies(db, 5), the engine the consumption alerts
+    are raised from. Reorder safety stock uses the demand std from
+    demand_stats, refreshed first.
+    """
+    snapshot = {
+        'low_stock': [],
+        'expiring': [],
+        'high_value_expiring': [],
+        'consumption_anomalies': [],
+        'reorder': [],
+        'timings': {}
+    }
+    timings = snapshot['timings']
+    started = time.perf_counter()
+    _refresh_demand_std(db)
+    timings['demand_stats_ms'] = (time.perf_counter() - started) * 1000
+    
+    phase = time.perf_counter()
+    with connection(db) as conn:
+        timings['connect_ms'] = (time.perf_counter() - phase) * 1000
+        cursor = conn.cursor()
+        
+        # Inventory pass: every row that can raise a stock or expiry alert
+        phase = time.perf_counter()
+        try:
+            today = epoch_day()
+            cursor.execute('''
+                SELECT id, drug_name, batch_number, current_stock, minimum_stock, unit_price,
+                       expiry_date, (current_stock * unit_price) as value_at_risk,
+                       MAX(expiry_day - ?, 0) as days_until_expiry,
+                       current_stock <= minimum_stock as is_low_stock,
+                       expiry_day <= ? as expires_in_90,
+                       expiry_day <= ? as expires_in_60,
+                       expiry_day
+                FROM inventory
+                WHERE minimum_stock - current_stock >= 0
+                   OR expiry_day <= ?
+            ''', (today, today + 90, today + 60, today + 90))
+            inventory_rows = cursor.fetchall()
+        except Exception as e:
+            record_swallowed_exception(e)
+            inventory_rows = []
+        timings['inventory_scan_ms'] = (time.perf_counter() - phase) * 1000
+        
+        phase = time.perf_counter()
+        low_stock = [row for row in inventory_rows if row[9]]
+        # SQLite yields NULL for a zero minimum and sorts NULLs first
+        low_stock.sort(key=lambda row: (1, row[3] / row[4]) if row[4] else (0, 0))
+        snapshot['low_stock'] = [{
+            'id': row[0],
+            'drug_name': row[1],
+            'current_stock': row[3],
+            'minimum_stock': row[4],
+            'unit_price': row[5]
+        } for row in low_stock[:10]]
+        
+        # Same order as get_expiring_items (days_until_expiry is clamped at 0,
+        # so it cannot order expired items); SQLite sorts NULLs first
+        expiring = sorted(
+            (row for row in inventory_rows if row[10]),
+            key=lambda row: (row[12], row[3] is not None, row[3] or 0, row[5] is not None, row[5] or 0, row[0])
+        )
+        snapshot['expiring'] = [{
+            'id': row[0],
+            'drug_name': row[1],
+            'batch_number': row[2],
+            'current_stock': row[3],
+            'expiry_date': row[6],
+            'unit_price': row[5],
+            'days_until_expiry': row[8]
+        } for row in expiring[:20]]
+        
+        high_value = sorted(
+            (row for row in inventory_rows
+             if row[11] and row[7] is not None and row[7] >= min_value),
+            key=lambda row: row[7],
+            reverse=True
+        )
+        snapshot['high_value_expiring'] = [{
+            'id': row[0],
+            'drug_name': row[1],
+            'batch_number': row[2],
+            'current_stock': row[3],
+            'expiry_date': row[6],
+            'unit_price': row[5],
+            'value_at_risk': row[7],
+            'days_until_expiry': row[8]
+        } for row in high_value[:10]]
+        timings['inventory_assemble_ms'] = (time.perf_counter() - phase) * 1000
+        
+        # Consumption pass: the reorder window and order terms of every consuming drug
+        phase = time.perf_counter()
+        try:
+            query, params = _reorder_terms_query()
+            cursor.execute(query, params)
+            consumption_rows = cursor.fetchall()
+        except Exception as e:
+            record_swallowed_exception(e)
+            consumption_rows = []
+        timings['consumption_scan_ms'] = (time.perf_counter() - phase) * 1000
+        
+        phase = time.perf_counter()
+        # Reorders for consuming drugs within 1.5x of their minimum, sized from
+        # the stored forecast where there is one, all at once
+        reorder = []
+        if consumption_rows:
+            data = np.array([row[2:] for row in consumption_rows], dtype=np.float64)
+            current_stock, minimum_stock, history_usage, forecast, demand_std, unit_price, lead_time, pack_size = data.T
+            forecasted = ~np.isnan(forecast)
+            usage = np.where(forecasted, forecast, history_usage)
+            order_quantity = _order_quantities(current_stock, minimum_stock, usage, demand_std,
+                                               unit_price, lead_time, pack_size)
+            eligible = (history_usage > 0) & (current_stock <= minimum_stock * 1.5) & (usage > 0) & (order_quantity > 0)
+            for index in np.flatnonzero(eligible)[:5].tolist():
+                drug_id, drug_name, current, minimum_units = consumption_rows[index][:4]
+                reorder.append({
+                    'drug_id': drug_id,
+                    'drug_name': drug_name,
+                    'current_stock': current,
+                    'minimum_stock': minimum_units,
+                    'suggested_quantity': int(order_quantity[index]),
+                    'avg_daily_consumption': float(usage[index]),
+                    'demand_source': 'forecast' if forecasted[index] else 'history',
+                    'priority': 'high' if current <= minimum_units else 'medium'
+                })
+        
+        snapshot['reorder'] = reorder
+        timings['consumption_assemble_ms'] = (time.perf_counter() - phase) * 1000
+    
+    # Cached on the consumption counters, so usually no scan at all
+    phase = time.perf_counter()
+    snapshot['consumption_anomalies'] = detect_consumption_anomalies(db, 5)
+    timings['anomalies_ms'] = (time.perf_counter() - phase) * 1000
+    
+    timings['total_ms'] = (time.perf_counter() - started) * 1000
+    return snapshot
+
+ALERT_LOOKUP_CHUNK = 500
+
+# Active-alert type and priority of each anomaly severity
+ANOMALY_ALERT_LEVELS = {
+    'critical': ('critical', 'high'),
+    'high': ('warning', 'medium'),
+    'medium': ('info', 'low'),
+}
+
+def _alert_windows(conn, drug_ids: Optional[List[int]]) -> np.ndarray:
+    """(drug_id, last 30 days' quantity, records) rows from the daily rollup, by drug_id"""
+    query = f'''
+        SELECT drug_id, SUM(total_quantity), SUM(row_count)
+        FROM consumption_daily_rollup
+        WHERE {f"drug_id IN ({', '.join('?' * len(drug_ids))}) AND " if drug_ids else ''}day >= ?
+        GROUP BY drug_id
+        ORDER BY drug_id
+    '''
+    return np.array(conn.execute(query, (drug_ids or []) + [days_ago(30)]).fetchall(),
+                    dtype=np.float64).reshape(-1, 3)
+
+def _evaluate_alert_rules(conn, drug_ids: Optional[List[int]] = None) -> Tuple[int, List[tuple]]:
+    """
+    (SKUs evaluated, active alert rows as active_alerts.store_alerts takes
+    them) for drug_ids, or for every SKU
+    
+    The same rules as get_alert_snapshot, for all the given SKUs at once:
+    low stock at or below the minimum, a consumption anomaly where
+    anomaly_detection.rank_anomalies flags one of the last week's days (its
+    severity sets the alert's type and priority), and a reorder for
+    consuming SKUs within 1.5x of their minimum, sized from the stored
+    forecast where there is one and with safety stock from the demand std in
+    demand_stats.
+    """
+    forecast_sql, forecast_params = forecast_daily_demand_sql('i.id', days_ago(0), 30)
+    rows = conn.execute(f'''
+        SELECT i.id, i.drug_name, i.current_stock, i.minimum_stock,
+               COALESCE(i.unit_price, 0), COALESCE(s.lead_time_days, ?), COALESCE(i.tablets_per_sheet, 1),
+               {forecast_sql}, ds.std
+        FROM inventory i
+        LEFT JOIN suppliers s ON s.name = i.supplier_name
+        LEFT JOIN demand_stats ds ON ds.window_days = ? AND ds.drug_id = i.id
+        {f"WHERE i.id IN ({', '.join('?' * len(drug_ids))})" if drug_ids else ''}
+        ORDER BY i.id
+    ''', [DEFAULT_LEAD_TIME_DAYS] + forecast_params + [DEMAND_STD_WINDOW_DAYS] + (drug_ids or [])).fetchall()
+    if not rows:
+        return 0, []
+    data = np.array([row[:1] + row[2:] for row in rows], dtype=np.float64)
+    ids, current_stock, minimum_stock, unit_price, lead_time, pack_size, forecast, demand_std = data.T
+    
+    windows = _alert_windows(conn, drug_ids)
+    recent_qty, recent_rows = np.zeros((2, len(ids)))
+    position = np.searchsorted(ids, windows[:, 0])
+    recent_qty[position], recent_rows[position] = windows[:, 1:].T
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        history_usage = np.where(recent_rows > 0, recent_qty / recent_rows, 0.0)
+        stock_ratio = np.where(minimum_stock > 0, current_stock / minimum_stock, -1.0)
+    low_stock = minimum_stock - current_stock >= 0
+    
+    # The matrix has a row per SKU read above, in the same id order
+    history = load_consumption_matrix(conn, ANOMALY_WINDOW_DAYS + ANOMALY_RECENT_DAYS, drug_ids=ids.astype(np.int64))
+    anomalies = rank_anomalies(history['matrix'])
+    first_day = datetime.strptime(history['start'], '%Y-%m-%d').date()
+    
+    usage = np.where(np.isnan(forecast), history_usage, forecast)
+    order_quantity = _order_quantities(current_stock, minimum_stock, usage, demand_std,
+                                       unit_price, lead_time, pack_size)
+    reorder = (history_usage > 0) & (current_stock <= minimum_stock * 1.5) & (usage > 0) & (order_quantity > 0)
+    
+    alerts = []
+    for index in np.flatnonzero(low_stock).tolist():
+        drug_id, drug_name, current, minimum_units = rows[index][:4]
+        alerts.append((drug_id, 'stock', float(stock_ratio[index]),
+                       'warning' if current > 0 else 'critical', 'high' if current == 0 else 'medium',
+                       f"Low stock alert: {drug_name} has only {current} units remaining (minimum: {minimum_units})"))
+    for rank, index in enumerate(anomalies['sku'].tolist()):
+        alert_type, priority = ANOMALY_ALERT_LEVELS[anomalies['severity'][rank]]
+        day = first_day + timedelta(days=int(anomalies['day'][rank]))
+        change_description = describe_change(float(anomalies['quantity'][rank]), float(anomalies['expected'][rank]))
+        alerts.append((rows[index][0], 'consumption', -abs(float(anomalies['score'][rank])), alert_type, priority,
+                       f"Consumption anomaly detected: {rows[index][1]} usage {change_description} on {day.isoformat()}"))
+    for index in np.flatnonzero(reorder).tolist():
+        drug_id, drug_name, current, minimum_units = rows[index][:4]
+        alerts.append((drug_id, 'reorder', float(current_stock[index] / usage[index]), 'info',
+                       'high' if current <= minimum_units else 'medium',
+                       f"Reorder suggestion: {drug_name} - suggested quantity: {int(order_quantity[index])}"))
+    return len(rows), alerts
+
+def refresh_active_alerts(db) -> Dict[str, Any]:
+    """
+    Re-evaluate the alert rules for the SKUs written since the last refresh
+    
+    Every SKU is evaluated on the first refresh of the day (the consumption
+    windows move with the date) and after a forecast run or supplier change.
+    Returns {'mode': 'current' | 'incremental' | 'full', 'evaluated': SKUs
+    evaluated, 'raised', 'cleared'}.
+    """
+    today = days_ago(0)
+    with connection(db) as conn:
+        pending = pending_alert_skus(conn, today)
+    if pending is not None and not len(pending):
+        return {'mode': 'current', 'evaluated': 0, 'raised': 0, 'cleared': 0}
+    
+    with connection(db, readonly=False) as conn:
+        pending = pending_alert_skus(conn, today)
+        if pending is None or len(pending):
+            # Reorder sizing reads the demand std of the SKUs being evaluated
+            refresh_demand_stats(conn)
+        if pending is None:
+            evaluated, rows = _evaluate_alert_rules(conn)
+            return dict(mode='full', evaluated=evaluated, **store_alerts(conn, None, rows, today))
+        if not len(pending):
+            return {'mode': 'current', 'evaluated': 0, 'raised': 0, 'cleared': 0}
+        rows = []
+        drug_ids = pending.tolist()
+        for start in range(0, len(drug_ids), ALERT_LOOKUP_CHUNK):
+            rows += _evaluate_alert_rules(conn, drug_ids[start:start + ALERT_LOOKUP_CHUNK])[1]
+        return dict(mode='incremental', evaluated=len(drug_ids), **store_alerts(conn, drug_ids, rows, today))
+
+def get_active_alerts(db, category: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """One category's active alerts ('stock', 'reorder' or 'consumption'), most severe first"""
+    if category not in ALERT_CATEGORIES:
+        raise ValueError(f"category must be one of {ALERT_CATEGORIES}, got {category!r}")
+    try:
+        refresh_active_alerts(db)
+    except Exception as e:
+        record_swallowed_exception(e)
+    with connection(db) as conn:
+        rows = read_active_alerts(conn, category, limit)
+    return [{
+        'drug_id': drug_id,
+        'type': alert_type,
+        'priority': priority,
+        'message': message,
+        'raised_at': raised_at
+    } for drug_id, alert_type, priority, message, raised_at in rows]
+
 def get_low_stock_items(db) -> List[Dict]:
     """Get items with low stock levels"""
     try:
-        conn = db.get_connection()
-        query = '''
-            SELECT id, drug_name, current_stock, minimum_stock, unit_price
-            FROM inventory 
-            WHERE current_stock <= minimum_stock
-            ORDER BY (CAST(current_stock AS FLOAT) / minimum_stock) ASC
-            LIMIT 10
-        '''
-        cursor = conn.cursor()
-        cursor.execute(query)
-        items = []
-        for row in cursor.fetchall():
-            items.append({
-                'id': row[0],
-                'drug_name': row[1],
-                'current_stock': row[2],
-                'minimum_stock': row[3],
-                'unit_price': row[4]
-            })
-        conn.close()
+        with connection(db) as conn:
+            query = '''
+                SELECT id, drug_name, current_stock, minimum_stock, unit_price
+                FROM inventory 
+                WHERE minimum_stock - current_stock >= 0
+                ORDER BY (CAST(current_stock AS FLOAT) / minimum_stock) ASC
+                LIMIT 10
+            '''
+            cursor = conn.cursor()
+            cursor.execute(query)
+            items = []
+            for row in cursor.fetchall():
+                items.append({
+                    'id': row[0],
+                    'drug_name': row[1],
+                    'current_stock': row[2],
+                    'minimum_stock': row[3],
+                    'unit_price': row[4]
+                })
         return items
-    except Exception:
+    except Exception as e:
+        record_swallowed_exception(e)
         return []
 
 def get_expiring_items(db) -> List[Dict]:
     """Get items expiring within 90 days"""
     try:
-        conn = db.get_connection()
-        query = '''
-            SELECT id, drug_name, batch_number, current_stock, expiry_date, unit_price,
-                   CASE 
-                       WHEN julianday(expiry_date) - julianday('now') <= 0 THEN 0
-                       ELSE CAST(julianday(expiry_date) - julianday('now') AS INTEGER)
-                   END as days_until_expiry
-            FROM inventory
-            WHERE expiry_date <= date('now', '+90 days')
-            ORDER BY days_until_expiry ASC
-            LIMIT 20
-        '''
-        cursor = conn.cursor()
-        cursor.execute(query)
-        items = []
-        for row in cursor.fetchall():
-            items.append({
-                'id': row[0],
-                'drug_name': row[1],
-                'batch_number': row[2],
-                'current_stock': row[3],
-                'expiry_date': row[4],
-                'unit_price': row[5],
-                'days_until_expiry': row[6]
-            })
-        conn.close()
+        with connection(db) as conn:
+            # Reads idx_inventory_expiry_day in order and stops after 20 rows; ties
+            # follow the rest of the index key, so the order is deterministic
+            query = '''
+                SELECT id, drug_name, batch_number, current_stock, expiry_date, unit_price,
+                       MAX(expiry_day - ?, 0) as days_until_expiry
+                FROM inventory
+                WHERE expiry_day <= ?
+                ORDER BY expiry_day ASC, current_stock, unit_price, id
+                LIMIT 20
+            '''
+            today = epoch_day()
+            cursor = conn.cursor()
+            cursor.execute(query, (today, today + 90))
+            items = []
+            for row in cursor.fetchall():
+                items.append({
+                    'id': row[0],
+                    'drug_name': row[1],
+                    'batch_number': row[2],
+                    'current_stock': row[3],
+                    'expiry_date': row[4],
+                    'unit_price': row[5],
+                    'days_until_expiry': row[6]
+                })
         return items
-    except Exception:
+    except Exception as e:
+        record_swallowed_exception(e)
         return []
 
 def get_high_value_expiring_items(db, min_value: float = 1000.0) -> List[Dict]:
     """Get high-value items that are expiring"""
     try:
-        conn = db.get_connection()
-        query = '''
-            SELECT id, drug_name, batch_number, current_stock, expiry_date, unit_price,
-                   (current_stock * unit_price) as value_at_risk,
-                   CASE 
-                       WHEN julianday(expiry_date) - julianday('now') <= 0 THEN 0
-                       ELSE CAST(julianday(expiry_date) - julianday('now') AS INTEGER)
-                   END as days_until_expiry
-            FROM inventory
-            WHERE expiry_date <= date('now', '+60 days')
-            AND (current_stock * unit_price) >= ?
-            ORDER BY value_at_risk DESC
-            LIMIT 10
-        '''
-        cursor = conn.cursor()
-        cursor.execute(query, (min_value,))
-        items = []
-        for row in cursor.fetchall():
-            items.append({
-                'id': row[0],
-                'drug_name': row[1],
-                'batch_number': row[2],
-                'current_stock': row[3],
-                'expiry_date': row[4],
-                'unit_price': row[5],
-                'value_at_risk': row[6],
-                'days_until_expiry': row[7]
-            })
-        conn.close()
+        with connection(db) as conn:
+            query = '''
+                SELECT id, drug_name, batch_number, current_stock, expiry_date, unit_price,
+                       (current_stock * unit_price) as value_at_risk,
+                       MAX(expiry_day - ?, 0) as days_until_expiry
+                FROM inventory
+                WHERE expiry_day <= ?
+                AND (current_stock * unit_price) >= ?
+                ORDER BY value_at_risk DESC
+                LIMIT 10
+            '''
+            today = epoch_day()
+            cursor = conn.cursor()
+            cursor.execute(query, (today, today + 60, min_value))
+            items = []
+            for row in cursor.fetchall():
+                items.append({
+                    'id': row[0],
+                    'drug_name': row[1],
+                    'batch_number': row[2],
+                    'current_stock': row[3],
+                    'expiry_date': row[4],
+                    'unit_price': row[5],
+                    'value_at_risk': row[6],
+                    'days_until_expiry': row[7]
+                })
         return items
-    except Exception:
+    except Exception as e:
+        record_swallowed_exception(e)
         return []
 
-def detect_consumption_anomalies(db) -> List[Dict]:
-    """Detect unusual consumption patterns"""
+def get_expiring_value(db, days: int = 90) -> Dict[str, float]:
+    """Stocked items expiring from today through today + days, their units and stock value"""
     try:
-        conn = db.get_connection()
-        
-        # Get consumption data for the last 30 days vs previous 30 days
-        query = '''
-            SELECT i.id, i.drug_name,
-                   AVG(CASE WHEN cp.date >= date('now', '-30 days') THEN cp.quantity_consumed ELSE 0 END) as recent_avg,
-                   AVG(CASE WHEN cp.date BETWEEN date('now', '-60 days') AND date('now', '-30 days') THEN cp.quantity_consumed ELSE 0 END) as previous_avg
-            FROM inventory i
-            LEFT JOIN consumption_patterns cp ON i.id = cp.drug_id
-            WHERE cp.date >= date('now', '-60 days')
-            GROUP BY i.id, i.drug_name
-            HAVING recent_avg > 0 AND previous_avg > 0
-        '''
-        
-        cursor = conn.cursor()
-        cursor.execute(query)
-        anomalies = []
-        
-        for row in cursor.fetchall():
-            drug_id, drug_name, recent_avg, previous_avg = row
-            
-            if recent_avg > 0 and previous_avg > 0:
-                change_ratio = recent_avg / previous_avg
-                
-                # Detect significant changes (>50% increase or decrease)
-                if change_ratio > 1.5:
-                    anomalies.append({
-                        'drug_id': drug_id,
-                        'drug_name': drug_name,
-                        'change_description': f'increased by {((change_ratio - 1) * 100):.1f}%',
-                        'recent_avg': recent_avg,
-                        'previous_avg': previous_avg
-                    })
-                elif change_ratio < 0.5:
-                    anomalies.append({
-                        'drug_id': drug_id,
-                        'drug_name': drug_name,
-                        'change_description': f'decreased by {((1 - change_ratio) * 100):.1f}%',
-                        'recent_avg': recent_avg,
-                        'previous_avg': previous_avg
-                    })
-        
-        conn.close()
-        return anomalies[:5]  # Return top 5 anomalies
+        with connection(db) as conn:
+            today = epoch_day()
+            items, units, value = conn.execute('''
+                SELECT COUNT(*), COALESCE(SUM(current_stock), 0),
+                       COALESCE(SUM(current_stock * unit_price), 0)
+                FROM inventory
+                WHERE expiry_day BETWEEN ? AND ? AND current_stock > 0
+            ''', (today, today + days)).fetchone()
+        return {'items': items, 'units': units, 'stock_value': float(value)}
+    except Exception as e:
+        record_swallowed_exception(e)
+        return {'items': 0, 'units': 0, 'stock_value': 0.0}
+
+def get_expiry_calendar(db, period: str = 'week', days: int = 365) -> pd.DataFrame:
+    """
+    Stocked items, units and stock value by week (from Monday) or month of
+    expiry, from the current week or month through today + days
+    """
+    if period not in EXPIRY_PERIODS:
+        raise ValueError(f"period must be one of {EXPIRY_PERIODS}, got {period!r}")
+    columns = ['period_start', 'item_count', 'units', 'stock_value']
+    try:
+        with connection(db) as conn:
+            rows = calendar_rows(conn, period, days)
+    except Exception as e:
+        record_swallowed_exception(e)
+        rows = []
+    return pd.DataFrame(
+        [(epoch_day_to_date(bucket_day), item_count, units, stock_value)
+         for bucket_day, item_count, units, stock_value in rows],
+        columns=columns
+    )
+
+def _reorder_terms_query():
+    """
+    Daily-rollup query for the reorder rule: per consuming drug, its stock,
+    minimum and the terms for sizing its order.
+    
+    Walking inventory and range-searching each drug's rollup rows by primary
+    key beats an index range over the window followed by a GROUP BY sort.
+    
+    avg_daily_consumption is the 30-day average per record, used for reorder
+    sizing of drugs without a stored forecast. Then come the stored
+    forecast's daily demand over the next 30 days (NULL without one), the
+    demand std from demand_stats, unit price, supplier lead time and pack size.
+    """
+    forecast_sql, forecast_params = forecast_daily_demand_sql('i.id', days_ago(0), 30)
+    query = f'''
+        SELECT i.id, i.drug_name, i.current_stock, i.minimum_stock,
+               SUM(d.total_quantity) * 1.0 / SUM(d.row_count) as avg_daily_consumption,
+               MAX({forecast_sql}) as forecast_daily_demand, ds.std,
+               COALESCE(i.unit_price, 0), COALESCE(s.lead_time_days, ?), COALESCE(i.tablets_per_sheet, 1)
+        FROM consumption_daily_rollup d
+        JOIN inventory i ON i.id = d.drug_id
+        LEFT JOIN demand_stats ds ON ds.window_days = ? AND ds.drug_id = i.id
+        LEFT JOIN suppliers s ON s.name = i.supplier_name
+        WHERE d.day >= ?
+        GROUP BY i.id
+        ORDER BY i.id
+    '''
+    params = forecast_params + [DEFAULT_LEAD_TIME_DAYS, DEMAND_STD_WINDOW_DAYS, days_ago(30)]
+    return query, params
+
+def _refresh_demand_std(db) -> None:
+    """
+    Bring the demand statistics whose std sizes safety stock up to date; on
+    failure the stored ones are used. When they are current only a read
+    connection is taken, so read paths do not queue for the write lock.
+    """
+    try:
+        with connection(db) as conn:
+            if demand_stats_current(conn):
+                return
+        with connection(db, readonly=False) as conn:
+            refresh_demand_stats(conn)
+    except Exception as e:
+        record_swallowed_exception(e)
+
+def _order_quantities(current_stock: np.ndarray, minimum_stock: np.ndarray, usage: np.ndarray,
+                      demand_std: np.ndarray, unit_price: np.ndarray, lead_time: np.ndarray,
+                      pack_size: np.ndarray) -> np.ndarray:
+    """
+    Units to order per SKU, as calculate_order_quantity sizes them; NaN stock
+    counts as 0 and a NaN demand_std (no statistics yet) as a 20% variation
+    """
+    demand_std = np.where(np.isnan(demand_std), usage * 0.2, demand_std)
+    safety_stock = calculate_safety_stock_array(usage, demand_std, lead_time)
+    reorder_point = calculate_reorder_point_array(usage, lead_time, safety_stock)
+    return calculate_order_quantity_array(np.nan_to_num(current_stock), np.nan_to_num(minimum_stock), reorder_point,
+                                          calculate_eoq_array(usage, unit_price), pack_size)
+
+def detect_consumption_anomalies(db, limit: Optional[int] = None) -> List[Dict]:
+    """
+    Unusual consumption over the last week, most severe first (see
+    anomaly_detection.detect_anomalies)
     
-    except Exception:
+    recent_avg is the anomalous day's consumption and previous_avg what the
+    previous 28 days led to expect.
+    """
+    try:
+        anomalies = detect_anomalies(db)[:limit]
+    except Exception as e:
+        record_swallowed_exception(e)
         return []
+    return [dict(anomaly, recent_avg=anomaly['quantity'], previous_avg=anomaly['expected'])
+            for anomaly in anomalies]
 
 def get_reorder_alerts(db) -> List[Dict]:
-    """Get reorder alerts based on current stock and consumption patterns"""
+    """
+    Get reorder alerts based on current stock and expected demand
+    
+    Demand is the stored forecast's daily average over the next 30 days,
+    or the last 30 days' average consumption for drugs without a forecast.
+    Quantities come from calculate_order_quantity with the supplier's lead
+    time and the demand std from demand_stats (refreshed first).
+    """
+    _refresh_demand_std(db)
     try:
-        conn = db.get_connection()
-        query = '''
-            SELECT i.id, i.drug_name, i.current_stock, i.minimum_stock,
-                   AVG(cp.quantity_consumed) as avg_daily_consumption
-            FROM inventory i
-            LEFT JOIN consumption_patterns cp ON i.id = cp.drug_id 
-            WHERE cp.date >= date('now', '-30 days')
-            GROUP BY i.id, i.drug_name, i.current_stock, i.minimum_stock
-            HAVING i.current_stock <= i.minimum_stock * 1.5
-        '''
+        with connection(db) as conn:
+            window_sql, params = rollup_window_sql(days_ago(30))
+            forecast_sql, forecast_params = forecast_daily_demand_sql('i.id', days_ago(0), 30)
+            query = f'''
+                SELECT i.id, i.drug_name, i.current_stock, i.minimum_stock,
+                       w.total_quantity * 1.0 / w.row_count as avg_daily_consumption,
+                       {forecast_sql} as forecast_daily_demand,
+                       COALESCE(i.unit_price, 0), COALESCE(s.lead_time_days, ?),
+                       COALESCE(i.tablets_per_sheet, 1), ds.std
+                FROM inventory i
+                JOIN ({window_sql}) w ON i.id = w.drug_id
+                LEFT JOIN suppliers s ON s.name = i.supplier_name
+                LEFT JOIN demand_stats ds ON ds.window_days = ? AND ds.drug_id = i.id
+                WHERE i.current_stock <= i.minimum_stock * 1.5
+                ORDER BY i.id
+            '''
         
-        cursor = conn.cursor()
-        cursor.execute(query)
-        alerts = []
+            cursor = conn.cursor()
+            cursor.execute(query, forecast_params + [DEFAULT_LEAD_TIME_DAYS] + params + [DEMAND_STD_WINDOW_DAYS])
+            alerts = []
         
-        for row in cursor.fetchall():
-            drug_id, drug_name, current_stock, minimum_stock, avg_daily_consumption = row
+            for row in cursor.fetchall():
+                drug_id, drug_name, current_stock, minimum_stock, avg_daily_consumption, forecast_daily_demand = row[:6]
+                demand_source = 'history'
+                if forecast_daily_demand is not None:
+                    avg_daily_consumption, demand_source = forecast_daily_demand, 'forecast'
             
-            # Calculate suggested quantity
-            if avg_daily_consumption and avg_daily_consumption > 0:
-                # Order enough for 30 days plus safety stock
-                suggested_quantity = int(avg_daily_consumption * 30 + minimum_stock - current_stock)
-                suggested_quantity = max(suggested_quantity, minimum_stock)
+                # Calculate suggested quantity
+                if avg_daily_consumption and avg_daily_consumption > 0:
+                    # EOQ, or enough to get back above the reorder point, in whole packs
+                    suggested_quantity = calculate_order_quantity(
+                        current_stock, minimum_stock, avg_daily_consumption, *row[6:9], demand_std=row[9])
+                    if suggested_quantity <= 0:
+                        continue
                 
-                priority = 'high' if current_stock <= minimum_stock else 'medium'
+                    priority = 'high' if current_stock <= minimum_stock else 'medium'
                 
-                alerts.append({
-                    'drug_id': drug_id,
-                    'drug_name': drug_name,
-                    'current_stock': current_stock,
-                    'minimum_stock': minimum_stock,
-                    'suggested_quantity': suggested_quantity,
-                    'avg_daily_consumption': avg_daily_consumption,
-                    'priority': priority
-                })
+                    alerts.append({
+                        'drug_id': drug_id,
+                        'drug_name': drug_name,
+                        'current_stock': current_stock,
+                        'minimum_stock': minimum_stock,
+                        'suggested_quantity': suggested_quantity,
+                        'avg_daily_consumption': avg_daily_consumption,
+                        'demand_source': demand_source,
+                        'priority': priority
+                    })
         
-        conn.close()
         return alerts[:5]  # Return top 5 reorder alerts
     
-    except Exception:
+    except Exception as e:
+        record_swallowed_exception(e)
         return []
 
 def calculate_inventory_turnover(db, drug_name: str = None) -> Dict[str, float]:
     """Calculate inventory turnover metrics"""
     try:
-        conn = db.get_connection()
+        with connection(db) as conn:
+            window_sql, params = rollup_window_sql(days_ago(365))
         
-        if drug_name:
-            # Calculate for specific drug
-            query = '''
-                SELECT 
-                    SUM(cp.quantity_consumed * i.unit_price) as total_consumption_value,
-                    AVG(i.current_stock * i.unit_price) as avg_inventory_value
-                FROM consumption_patterns cp
-                JOIN inventory i ON cp.drug_id = i.id
-                WHERE i.drug_name = ? AND cp.date >= date('now', '-365 days')
-                GROUP BY i.drug_name
-            '''
-            cursor = conn.cursor()
-            cursor.execute(query, (drug_name,))
-        else:
-            # Calculate for entire inventory
-            query = '''
-                SELECT 
-                    SUM(cp.quantity_consumed * i.unit_price) as total_consumption_value,
-                    AVG(i.current_stock * i.unit_price) as avg_inventory_value
-                FROM consumption_patterns cp
-                JOIN inventory i ON cp.drug_id = i.id
-                WHERE cp.date >= date('now', '-365 days')
-            '''
-            cursor = conn.cursor()
-            cursor.execute(query)
+            # Inventory value is averaged per consumption record, so weight it by row_count
+            if drug_name:
+                # Calculate for specific drug
+                query = f'''
+                    SELECT 
+                        SUM(w.total_quantity * i.unit_price) as total_consumption_value,
+                        SUM(w.row_count * i.current_stock * i.unit_price) * 1.0 / SUM(w.row_count) as avg_inventory_value
+                    FROM ({window_sql}) w
+                    JOIN inventory i ON w.drug_id = i.id
+                    WHERE i.drug_name = ?
+                    GROUP BY i.drug_name
+                '''
+                cursor = conn.cursor()
+                cursor.execute(query, params + [drug_name])
+            else:
+                # Calculate for entire inventory
+                query = f'''
+                    SELECT 
+                        SUM(w.total_quantity * i.unit_price) as total_consumption_value,
+                        SUM(w.row_count * i.current_stock * i.unit_price) * 1.0 / SUM(w.row_count) as avg_inventory_value
+                    FROM ({window_sql}) w
+                    JOIN inventory i ON w.drug_id = i.id
+                '''
+                cursor = conn.cursor()
+                cursor.execute(query, params)
         
-        result = cursor.fetchone()
-        conn.close()
+            result = cursor.fetchone()
         
         if result and result[0] and result[1]:
             total_consumption_value, avg_inventory_value = result
@@ -392,7 +751,8 @@ def calculate_inventory_turnover(db, drug_name: str = None) -> Dict[str, float]:
             'avg_inventory_value': 0
         }
     
-    except Exception:
+    except Exception as e:
+        record_swallowed_exception(e)
         return {
             'turnover_ratio': 0,
             'days_in_inventory': 365,
@@ -422,26 +782,43 @@ def sanitize_drug_name(drug_name: str) -> str:
     
     return sanitized
 
+DEFAULT_LEAD_TIME_DAYS = 7  # for items whose supplier has no lead time on record
+DEMAND_STD_WINDOW_DAYS = 90  # demand_stats window whose std sizes safety stock
+ORDERING_COST = 500.0  # cost of placing one purchase order
+HOLDING_COST_RATE = 0.25  # yearly holding cost as a share of unit price
+
+SAFETY_FACTORS = {
+    0.90: 1.28,  # 90% service level
+    0.95: 1.65,  # 95% service level
+    0.99: 2.33   # 99% service level
+}
+
+def _safety_factor(service_level: float) -> float:
+    """Z for the service level: the rounded table value, else the exact normal quantile"""
+    if service_level in SAFETY_FACTORS:
+        return SAFETY_FACTORS[service_level]
+    return NormalDist().inv_cdf(service_level)
+
 def calculate_safety_stock(avg_daily_usage: float, lead_time_days: int, 
-                          service_level: float = 0.95) -> int:
-    """Calculate safety stock based on usage patterns and service level"""
+                          service_level: float = 0.95,
+                          demand_std: Optional[float] = None) -> int:
+    """
+    Calculate safety stock based on usage patterns and service level
+    
+    demand_std is the standard deviation of daily demand; without it a 20%
+    coefficient of variation is assumed.
+    """
     if avg_daily_usage <= 0:
         return 0
     
-    # Simplified safety stock calculation
-    # In practice, this would use standard deviation of demand and lead time
-    safety_factor = {
-        0.90: 1.28,  # 90% service level
-        0.95: 1.65,  # 95% service level
-        0.99: 2.33   # 99% service level
-    }.get(service_level, 1.65)
+    safety_factor = _safety_factor(service_level)
     
-    # Assume 20% coefficient of variation for demand
-    demand_std = avg_daily_usage * 0.2
+    if demand_std is None:
+        # Assume 20% coefficient of variation for demand
+        demand_std = avg_daily_usage * 0.2
     lead_time_std = lead_time_days * 0.1  # 10% lead time variation
     
     # Safety stock formula: Z * sqrt(LT * σd² + d² * σLT²)
-    # Simplified version
     safety_stock = safety_factor * np.sqrt(
         lead_time_days * (demand_std ** 2) + 
         (avg_daily_usage ** 2) * (lead_time_std ** 2)
@@ -449,6 +826,70 @@ def calculate_safety_stock(avg_daily_usage: float, lead_time_days: int,
     
     return max(1, int(safety_stock))
 
+def calculate_safety_stock_array(avg_daily_usage: np.ndarray, demand_std: np.ndarray,
+                                 lead_time_days, service_level: float = 0.95,
+                                 lead_time_cv: float = 0.1) -> np.ndarray:
+    """
+    calculate_safety_stock for whole arrays of SKUs at once
+    
+    lead_time_days may be a scalar or one value per SKU; lead time varies by
+    lead_time_cv of itself. SKUs without demand get 0, the rest at least 1.
+    """
+    avg_daily_usage = np.asarray(avg_daily_usage, dtype=np.float64)
+    lead_time_days = np.broadcast_to(np.asarray(lead_time_days, dtype=np.float64), avg_daily_usage.shape)
+    lead_time_std = lead_time_days * lead_time_cv
+    safety_stock = _safety_factor(service_level) * np.sqrt(
+        lead_time_days * np.square(demand_std) + np.square(avg_daily_usage) * np.square(lead_time_std)
+    )
+    return np.where(avg_daily_usage > 0, np.maximum(1, np.floor(safety_stock)), 0).astype(np.int64)
+
+def get_catalog_safety_stock(db, service_level: float = 0.95, lead_time_days: Optional[int] = None,
+                             window_days: int = DEMAND_STD_WINDOW_DAYS) -> pd.DataFrame:
+    """
+    Safety stock and reorder point for every SKU from its measured demand
+    
+    Daily demand is the stored forecast over the next 30 days where there is
+    one, else the mean over the trailing window_days from the demand
+    statistics store (refreshed first, which is a no-op when it is current);
+    its standard deviation always comes from the store. Lead time is the
+    supplier's, or DEFAULT_LEAD_TIME_DAYS for unknown suppliers, unless
+    lead_time_days is given. Returns one row per inventory item.
+    """
+    windows = sorted(set(DEFAULT_WINDOWS) | {window_days})
+    with connection(db, readonly=False) as conn:
+        refresh_demand_stats(conn, windows)
+    with connection(db) as conn:
+        forecast_sql, forecast_params = forecast_daily_demand_sql('i.id', days_ago(0), 30)
+        df = pd.read_sql_query(f'''
+            SELECT i.id AS drug_id, i.drug_name, i.supplier_name,
+                   i.current_stock, COALESCE(i.minimum_stock, 0) AS minimum_stock,
+                   COALESCE(i.unit_price, 0) AS unit_price, COALESCE(i.tablets_per_sheet, 1) AS pack_size,
+                   COALESCE(sup.lead_time_days, ?) AS lead_time_days,
+                   COALESCE(s.mean, 0) AS avg_daily_usage, COALESCE(s.std, 0) AS demand_std,
+                   COALESCE(s.zero_fraction, 1) AS zero_fraction,
+                   {forecast_sql} AS forecast_daily_demand
+            FROM inventory i
+            LEFT JOIN demand_stats s ON s.window_days = ? AND s.drug_id = i.id
+            LEFT JOIN suppliers sup ON sup.name = i.supplier_name
+            ORDER BY i.id
+        ''', conn, params=[DEFAULT_LEAD_TIME_DAYS] + forecast_params + [window_days])
+    
+    forecast = df['forecast_daily_demand'].astype(np.float64)
+    forecasted = forecast.notna()
+    df['demand_source'] = np.where(forecasted, 'forecast', 'history')
+    df['avg_daily_usage'] = forecast.where(forecasted, df['avg_daily_usage'])
+    df = df.drop(columns='forecast_daily_demand')
+    if lead_time_days is not None:
+        df['lead_time_days'] = lead_time_days
+    
+    usage = df['avg_daily_usage'].to_numpy()
+    lead_times = df['lead_time_days'].to_numpy()
+    df['safety_stock'] = calculate_safety_stock_array(usage, df['demand_std'].to_numpy(),
+                                                      lead_times, service_level)
+    df['reorder_point'] = calculate_reorder_point_array(usage, lead_times, df['safety_stock'].to_numpy())
+    df['below_reorder_point'] = df['current_stock'] <= df['reorder_point']
+    return df
+
 def generate_order_number(prefix: str = "PO") -> str:
     """Generate unique order number"""
     timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
@@ -487,6 +928,52 @@ def calculate_reorder_point(avg_daily_usage: float, lead_time_days: int,
     reorder_point = (avg_daily_usage * lead_time_days) + safety_stock
     return max(1, int(reorder_point))
 
+def calculate_reorder_point_array(avg_daily_usage: np.ndarray, lead_time_days,
+                                  safety_stock: np.ndarray) -> np.ndarray:
+    """calculate_reorder_point for whole arrays of SKUs at once"""
+    avg_daily_usage = np.asarray(avg_daily_usage, dtype=np.float64)
+    reorder_point = np.maximum(1, np.floor(avg_daily_usage * lead_time_days + safety_stock))
+    return np.where(avg_daily_usage > 0, reorder_point, safety_stock).astype(np.int64)
+
+def calculate_eoq_array(avg_daily_usage: np.ndarray, unit_price: np.ndarray,
+                        ordering_cost: float = ORDERING_COST,
+                        holding_cost_rate: float = HOLDING_COST_RATE) -> np.ndarray:
+    """Economic order quantity sqrt(2DS/H) per SKU; 0 without demand or price"""
+    annual_demand = np.asarray(avg_daily_usage, dtype=np.float64) * 365
+    holding_cost = np.asarray(unit_price, dtype=np.float64) * holding_cost_rate
+    with np.errstate(divide='ignore', invalid='ignore'):
+        eoq = np.sqrt(2 * annual_demand * ordering_cost / holding_cost)
+    return np.where((annual_demand > 0) & (holding_cost > 0), eoq, 0.0)
+
+def calculate_order_quantity_array(current_stock: np.ndarray, minimum_stock: np.ndarray,
+                                   reorder_point: np.ndarray, eoq: np.ndarray,
+                                   pack_size=1) -> np.ndarray:
+    """
+    Units to order now per SKU
+    
+    A SKU at or below its reorder point (never taken below minimum_stock)
+    orders its EOQ, or more when the EOQ would not bring it back up to the
+    reorder point, rounded up to whole packs. Other SKUs order nothing.
+    """
+    current_stock = np.asarray(current_stock, dtype=np.float64)
+    trigger = np.maximum(reorder_point, minimum_stock)
+    pack_size = np.maximum(np.asarray(pack_size, dtype=np.float64), 1)
+    quantity = np.ceil(np.maximum(eoq, trigger - current_stock) / pack_size) * pack_size
+    return np.where(current_stock <= trigger, quantity, 0).astype(np.int64)
+
+def calculate_order_quantity(current_stock: int, minimum_stock: int, avg_daily_usage: float,
+                             unit_price: float, lead_time_days: int = DEFAULT_LEAD_TIME_DAYS,
+                             pack_size: int = 1, service_level: float = 0.95,
+                             demand_std: Optional[float] = None) -> int:
+    """
+    Units to order now for one SKU: calculate_order_quantity_array, with
+    calculate_safety_stock's default demand variation when demand_std is None
+    """
+    safety_stock = calculate_safety_stock(avg_daily_usage, lead_time_days, service_level, demand_std)
+    reorder_point = calculate_reorder_point(avg_daily_usage, lead_time_days, safety_stock)
+    eoq = calculate_eoq_array(avg_daily_usage, unit_price)
+    return int(calculate_order_quantity_array(current_stock, minimum_stock or 0, reorder_point, eoq, pack_size or 1))
+
 def get_consumption_forecast_accuracy(predicted: List[float], 
                                     actual: List[float]) -> Dict[str, float]:
     """Calculate forecast accuracy metrics"""
@@ -550,34 +1037,78 @@ def clean_numeric_input(value: Any) -> Optional[float]:
     return None
 
 def calculate_abc_classification(inventory_data: pd.DataFrame) -> pd.DataFrame:
-    """Calculate ABC classification based on inventory value"""
-    if inventory_data.empty:
-        return inventory_data
-    
-    # Calculate value for each item
-    inventory_data['total_value'] = inventory_data['current_stock'] * inventory_data['unit_price']
+    """
+    Calculate ABC classification based on inventory value
     
-    # Sort by value in descending order
-    sorted_data = inventory_data.sort_values('total_value', ascending=False).copy()
-    
-    # Calculate cumulative percentage
-    sorted_data['cumulative_value'] = sorted_data['total_value'].cumsum()
-    total_value = sorted_data['total_value'].sum()
-    sorted_data['cumulative_percentage'] = sorted_data['cumulative_value'] / total_value * 100
+    Returns a copy sorted by value, highest first, with total_value,
+    cumulative_value, cumulative_percentage and abc_class; the caller's frame
+    is left as it is. For the whole catalog use get_sku_classes, which keeps
+    the classes stored.
+    """
+    if inventory_data.empty:
+        return inventory_data.copy()
     
-    # Assign ABC classification
-    def assign_class(percentage):
-        if percentage <= 70:
-            return 'A'
-        elif percentage <= 90:
-            return 'B'
-        else:
-            return 'C'
+    total_value = (inventory_data['current_stock'] * inventory_data['unit_price']).to_numpy(dtype=np.float64)
+    order = np.argsort(-total_value, kind='stable')
+    sorted_value = total_value[order]
     
-    sorted_data['abc_class'] = sorted_data['cumulative_percentage'].apply(assign_class)
+    # Items without a value sort last and get no cumulative share, as with pandas' cumsum
+    missing = np.isnan(sorted_value)
+    cumulative_value = np.cumsum(np.where(missing, 0, sorted_value))
+    cumulative_value[missing] = np.nan
+    cumulative_percentage = cumulative_value / np.nansum(sorted_value) * 100
     
+    sorted_data = inventory_data.iloc[order].assign(
+        total_value=sorted_value,
+        cumulative_value=cumulative_value,
+        cumulative_percentage=cumulative_percentage,
+        abc_class=np.array(ABC_CLASSES)[abc_class_index(cumulative_percentage)]
+    )
     return sorted_data
 
+def get_sku_classes(db, abc_class: Optional[str] = None, xyz_class: Optional[str] = None) -> pd.DataFrame:
+    """
+    Stored ABC and XYZ class of every SKU, optionally only one class
+    
+    The classes are refreshed first, which is a no-op while stock values
+    and demand statistics are unchanged. Adds inventory_value and demand_cv
+    (NaN without demand) as they are now.
+    """
+    with connection(db, readonly=False) as conn:
+        refresh_sku_classes(conn)
+    conditions, params = [], [DEMAND_WINDOW_DAYS]
+    for column, value in (('abc_class', abc_class), ('xyz_class', xyz_class)):
+        if value is not None:
+            conditions.append(f"c.{column} = ?")
+            params.append(value)
+    with connection(db) as conn:
+        df = pd.read_sql_query(f'''
+            SELECT c.drug_id, i.drug_name, i.category,
+                   c.abc_class, c.xyz_class,
+                   COALESCE(i.current_stock * i.unit_price, 0) AS inventory_value,
+                   CASE WHEN s.mean > 0 THEN s.std / s.mean END AS demand_cv,
+                   c.changed_at
+            FROM sku_classes c
+            JOIN inventory i ON i.id = c.drug_id
+            LEFT JOIN demand_stats s ON s.window_days = ? AND s.drug_id = c.drug_id
+            {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+            ORDER BY c.drug_id
+        ''', conn, params=params)
+    return df
+
+def get_sku_class_summary(db) -> pd.DataFrame:
+    """SKU count per ABC x XYZ class pair (rows A-C, columns X-Z)"""
+    with connection(db, readonly=False) as conn:
+        refresh_sku_classes(conn)
+    with connection(db) as conn:
+        counts = conn.execute('''
+            SELECT abc_class, xyz_class, COUNT(*) FROM sku_classes GROUP BY abc_class, xyz_class
+        ''').fetchall()
+    summary = pd.DataFrame(0, index=list(ABC_CLASSES), columns=list(XYZ_CLASSES))
+    for abc, xyz, count in counts:
+        summary.loc[abc, xyz] = count
+    return summary
+
 def get_seasonal_adjustment_factor(date: datetime, drug_category: str) -> float:
     """Get seasonal adjustment factor for demand forecasting"""
     month = date.month